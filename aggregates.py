@@ -0,0 +1,145 @@
+#################################################################################
+## aggregates.py - streaming department-wide summaries for the Penn CIS Teaching Dashboard
+##
+## Computes the department-level numbers (the status counts of the sidebar
+## summary, and each student's total score per course) without materializing
+## the aligned submissions: they are read in bounded chunks, each chunk
+## updates running per-course and per-student aggregates, and is then
+## discarded.  Memory use depends on the number of courses and students, not
+## on the number of submissions, e.g. for summaries across many semesters:
+##
+##    python aggregates.py --terms "Fall 2025" "Spring 2026"
+##
+## Licensed to the Apache Software Foundation (ASF) under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  The ASF licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing,
+## software distributed under the License is distributed on an
+## "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+## KIND, either express or implied.  See the License for the
+## specific language governing permissions and limitations
+## under the License.
+##
+#################################################################################
+
+import argparse
+import pandas as pd
+
+from database import include_canvas_data, include_gradescope_data, iter_aligned_submissions
+from instrumentation import timed
+
+## The flags counted by the sidebar summary
+flags = ['😰', '😅', '✓']
+
+## Columns identifying a Gradescope extension (see entities.load_extensions)
+extension_keys = ['gs_user_id_', 'gs_assign_id_', 'gs_course_id_']
+
+class StatusAggregates:
+    """
+    Running aggregates over chunks of aligned submissions: the sidebar summary's flag counts per
+    Gradescope course (as views.compute_course_student_status_summary computes them from the
+    enrollments), and each student's total score per Canvas course (as in display_hw_totals)
+    """
+    def __init__(self, courses: pd.DataFrame, extensions: pd.DataFrame, is_overdue, is_near_due, is_submitted):
+        self.is_overdue = is_overdue
+        self.is_near_due = is_near_due
+        self.is_submitted = is_submitted
+
+        # A submission counts once for each course row (and each extension) it is joined with
+        self.course_rows = courses['gs_course_id'].value_counts()
+        self.extension_rows = None
+        if extensions is not None and len(extensions) and all(key in extensions.columns for key in extension_keys):
+            self.extension_rows = extensions.groupby(extension_keys).size().rename('extension_rows')
+
+        self.status = None
+        self.course_names = set()
+        self.totals = None
+        self.rows = 0
+        self.chunks = 0
+
+    def enrollments(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        """
+        The rows of a chunk that entities.load_course_enrollments keeps, with how many times each
+        one appears there
+        """
+        gs = chunk[chunk['gs_assignment_id'].notna()].dropna(subset=['gs_user_id'])
+        no_gs = chunk[chunk['gs_assignment_id'].isna()]
+
+        gs = gs.assign(weight=1)
+        if self.extension_rows is not None and len(gs):
+            keys = pd.MultiIndex.from_arrays([gs['gs_user_id'].astype(int), gs['gs_assignment_id'].astype(int), gs['gs_course_id'].astype(int)])
+            gs['weight'] = self.extension_rows.reindex(keys).fillna(1).astype(int).to_numpy()
+        return pd.concat([gs, no_gs.assign(weight=1)])
+
+    def add(self, chunk: pd.DataFrame) -> None:
+        enrollments = self.enrollments(chunk)
+        self.course_names.update(enrollments[['gs_course_id', 'course_name']].dropna(subset=['gs_course_id']).itertuples(index=False, name=None))
+
+        useful = enrollments[enrollments['gs_course_id'].isin(self.course_rows.index)]
+        if len(useful):
+            counted = pd.DataFrame({
+                'gs_course_id': useful['gs_course_id'],
+                '😰': useful.apply(lambda x: self.is_overdue(x, x['due']), axis=1),
+                '😅': useful.apply(lambda x: self.is_near_due(x, x['due']), axis=1),
+                '✓': useful.apply(lambda x: self.is_submitted(x), axis=1)})
+            counted[flags] = counted[flags].mul(useful['weight'] * useful['gs_course_id'].map(self.course_rows), axis=0)
+            status = counted.groupby('gs_course_id')[flags].sum()
+            self.status = status if self.status is None else self.status.add(status, fill_value=0)
+
+        totals = chunk.groupby(['canvas_course_id', 'email', 'student'])['Total Score'].sum()
+        self.totals = totals if self.totals is None else self.totals.add(totals, fill_value=0)
+
+        self.rows += len(chunk)
+        self.chunks += 1
+
+    def status_summary(self) -> pd.DataFrame:
+        """
+        The same frame as views.compute_course_student_status_summary
+        """
+        names = pd.DataFrame(sorted(self.course_names, key=str), columns=['gs_course_id', 'Course']).set_index('gs_course_id')
+        status = self.status if self.status is not None else pd.DataFrame(columns=flags, index=pd.Index([], name='gs_course_id'))
+        status = status.astype('int64')
+        return status.join(names)[['Course'] + flags]
+
+    def student_totals(self, canvas_course_id = None) -> pd.DataFrame:
+        """
+        Each student's total score, per course or for one course, as in display_hw_totals
+        """
+        if self.totals is None:
+            return pd.DataFrame(columns=['email', 'student', 'Total Score'])
+        totals = self.totals.rename('Total Score').reset_index()
+        if canvas_course_id is not None:
+            totals = totals[totals['canvas_course_id'] == canvas_course_id].drop(columns=['canvas_course_id'])
+        return totals.sort_values(by=['Total Score'])
+
+@timed
+def stream_status_aggregates(courses: pd.DataFrame, extensions: pd.DataFrame, is_overdue, is_near_due, is_submitted,
+                             chunksize: int = 20000, terms: list = None) -> StatusAggregates:
+    """
+    Aggregates the aligned submissions of the given terms, one chunk at a time
+    """
+    aggregates = StatusAggregates(courses, extensions, is_overdue, is_near_due, is_submitted)
+    for chunk in iter_aligned_submissions(include_gradescope_data, include_canvas_data, chunksize, terms):
+        aggregates.add(chunk)
+    return aggregates
+
+if __name__ == '__main__':
+    from entities import load_courses, load_extensions
+    from status_tests import is_overdue, is_near_due, is_submitted
+
+    parser = argparse.ArgumentParser(description='Summarize the status of every course, streaming the submissions')
+    parser.add_argument('--terms', nargs='*', default=None, help='terms to include (default: the configured ones)')
+    parser.add_argument('--chunksize', type=int, default=20000)
+    args = parser.parse_args()
+
+    aggregates = stream_status_aggregates(load_courses(args.terms), load_extensions(args.terms), is_overdue, is_near_due, is_submitted,
+                                          args.chunksize, args.terms)
+    print(aggregates.status_summary().to_string())
+    print('{} submissions in {} chunks'.format(aggregates.rows, aggregates.chunks))
@@ -40,4 +40,18 @@ def add_url(text_field: str, href_field: str) -> JsCode:
                 return this.eGui;
             }
             }
-        """)
\ No newline at end of file
+        """)
+ 
+def add_highlights(rules: list) -> JsCode:
+    """
+    Like add_highlight, for several tests: the colors of the first test that passes are used
+    :param rules: A list of (javascript_test, fgcolor, bgcolor), e.g. ('params.data["Total Score"] < 10', 'black', 'pink')
+    """
+    tests = ''.join("""
+                    if (""" + javascript_test + """) {
+                        return {'color': '""" + fgcolor + """', 'backgroundColor': '""" + bgcolor + """'}
+                    }""" for javascript_test, fgcolor, bgcolor in rules)
+    return JsCode("""
+                function(params) {""" + tests + """
+                };
+                """)
@@ -0,0 +1,214 @@
+#################################################################################
+## alerts.py - headless alert digests for the Penn CIS Teaching Dashboard
+##
+## Evaluates overdue / near-due status across all courses without Streamlit,
+## remembers what has already been notified for each (student, assignment),
+## and emits only the new transitions as one digest per course.  Intended to
+## be run every few minutes, e.g. from cron:
+##
+##    */5 * * * * cd /path/to/dashboard && python alerts.py
+##
+## Licensed to the Apache Software Foundation (ASF) under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  The ASF licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing,
+## software distributed under the License is distributed on an
+## "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+## KIND, either express or implied.  See the License for the
+## specific language governing permissions and limitations
+## under the License.
+##
+#################################################################################
+
+import os
+import sqlite3
+import smtplib
+import argparse
+import pandas as pd
+from datetime import datetime
+from email.message import EmailMessage
+
+from status_tests import now, grace, near_due_window, is_overdue, is_near_due
+from database import config, data_file, include_canvas_data, include_gradescope_data
+from database import get_pending_submissions
+
+alert_config = config.get('alerts', {}) or {}
+
+state_file = alert_config.get('state_db', 'alerts.db')
+outbox = alert_config.get('outbox', 'alerts')
+
+OVERDUE = 'overdue'
+NEAR_DUE = 'near due'
+
+def open_state(filename: str = state_file) -> sqlite3.Connection:
+    """
+    The alert state lives in its own small SQLite file, since the crawler owns the dashboard database
+    """
+    state = sqlite3.connect(filename)
+    state.execute("""create table if not exists alert_runs
+                    (run_at text, db_mtime integer, db_size integer, scope text, transitions integer)""")
+    state.execute("""create table if not exists alert_state
+                    (source text, assignment_id integer, student_id integer, course_id integer,
+                     course_name text, assignment text, student text, email text, due text,
+                     status text, notified_at text,
+                     primary key (source, assignment_id, student_id))""")
+    return state
+
+def get_db_signature() -> tuple:
+    """
+    A cheap fingerprint of the crawler database, so we can tell whether a crawl happened since the last run
+    """
+    stats = os.stat(data_file)
+    return (stats.st_mtime_ns, stats.st_size)
+
+def get_last_run(state: sqlite3.Connection) -> tuple:
+    return state.execute("select run_at, db_mtime, db_size from alert_runs order by run_at desc limit 1").fetchone()
+
+def get_candidates(last_run: tuple, signature: tuple) -> tuple:
+    """
+    Returns the scope of this run and the (unsubmitted) submissions we need to re-evaluate.
+
+    If the database has not changed since the last run, the only possible transitions come from
+    time passing, i.e., deadlines crossing the near-due or overdue horizons.  We then only fetch
+    rows whose deadline crossed one of those horizons since the last run.  Otherwise a crawl
+    happened, and we re-evaluate every pending submission up to the furthest horizon.
+    """
+    horizon = max(grace, near_due_window)
+    if last_run is None or (last_run[1], last_run[2]) != signature:
+        return 'all', get_pending_submissions(include_gradescope_data, include_canvas_data, due_before=now + horizon)
+
+    previous = datetime.fromisoformat(last_run[0])
+    windows = []
+    for offset in sorted({grace, near_due_window}):
+        windows.append(get_pending_submissions(include_gradescope_data, include_canvas_data,
+                                               due_after=previous + offset, due_before=now + offset))
+
+    return 'window', pd.concat(windows).drop_duplicates(subset=['source', 'gs_assignment_id', 'canvas_assignment_id', 'student_id'])
+
+def evaluate(candidates: pd.DataFrame) -> pd.DataFrame:
+    """
+    Applies the dashboard's status tests to the candidate rows, and keys them by (source, assignment, student)
+    """
+    if not len(candidates):
+        return pd.DataFrame(columns=['source', 'assignment_id', 'student_id', 'course_id', 'course_name',
+                                     'assignment', 'student', 'email', 'due', 'status'])
+
+    flagged = candidates.copy()
+    flagged['status'] = flagged.apply(lambda x: OVERDUE if is_overdue(x, x['due'])
+                                      else NEAR_DUE if is_near_due(x, x['due']) else None, axis=1)
+    flagged = flagged.dropna(subset=['status', 'student_id'])
+
+    flagged['assignment_id'] = flagged['gs_assignment_id'].fillna(flagged['canvas_assignment_id'])
+    flagged['course_id'] = flagged['canvas_course_id'].fillna(flagged['gs_course_id'])
+    flagged['course_name'] = flagged['course_name'].fillna(flagged['course_id'].apply(lambda x: str(int(x)) if not pd.isna(x) else 'unknown'))
+    flagged['due'] = flagged['due'].apply(lambda x: x.isoformat() if not pd.isna(x) else None)
+    flagged = flagged.astype({'assignment_id': int, 'student_id': int})
+
+    return flagged.rename(columns={'name': 'assignment'})\
+        [['source', 'assignment_id', 'student_id', 'course_id', 'course_name', 'assignment', 'student', 'email', 'due', 'status']]
+
+def update_state(state: sqlite3.Connection, scope: str, flagged: pd.DataFrame) -> pd.DataFrame:
+    """
+    Diffs the flagged rows against what was previously notified, records the new transitions,
+    and returns them.  When the whole pending set was re-evaluated, previously flagged rows that
+    no longer appear have been resolved and are forgotten (so they may alert again later).
+    """
+    previous = pd.read_sql("select source, assignment_id, student_id, status as previous_status from alert_state", state)
+    merged = flagged.merge(previous, on=['source', 'assignment_id', 'student_id'], how='left')
+    transitions = merged[merged['status'] != merged['previous_status']].drop(columns=['previous_status'])
+
+    notified_at = now.isoformat()
+    state.executemany("""insert or replace into alert_state
+                         (source, assignment_id, student_id, course_id, course_name, assignment, student, email, due, status, notified_at)
+                         values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                      [(r.source, int(r.assignment_id), int(r.student_id), None if pd.isna(r.course_id) else int(r.course_id),
+                        r.course_name, r.assignment, r.student, r.email, r.due, r.status, notified_at)
+                       for r in transitions.itertuples(index=False)])
+
+    if scope == 'all':
+        resolved = previous.merge(flagged[['source', 'assignment_id', 'student_id']], how='left', indicator=True)
+        resolved = resolved[resolved['_merge'] == 'left_only']
+        state.executemany("delete from alert_state where source = ? and assignment_id = ? and student_id = ?",
+                          [(r.source, int(r.assignment_id), int(r.student_id)) for r in resolved.itertuples(index=False)])
+
+    return transitions
+
+def format_digest(course_name: str, transitions: pd.DataFrame) -> EmailMessage:
+    """
+    One message per course, listing each assignment with the students that newly became overdue / near due
+    """
+    message = EmailMessage()
+    message['Subject'] = 'Teaching Dashboard alerts for {}'.format(course_name.strip())
+    message['From'] = alert_config.get('from', 'teaching-dashboard@localhost')
+    recipients = alert_config.get('to', {})
+    if isinstance(recipients, dict):
+        course_id = transitions.iloc[0]['course_id']
+        recipients = recipients.get(None if pd.isna(course_id) else int(course_id), recipients.get('default', []))
+    message['To'] = ', '.join(recipients) if recipients else 'undisclosed-recipients:;'
+
+    lines = ['New alerts for {} as of {}:'.format(course_name.strip(), now.strftime('%A, %B %d, %Y %H:%M %Z')), '']
+    for status in [OVERDUE, NEAR_DUE]:
+        these = transitions[transitions['status'] == status]
+        for (assignment, due), students in these.groupby(by=['assignment', 'due'], sort=True):
+            lines.append('{} ({}, due {}):'.format(assignment, status, due))
+            for student in students.sort_values(by=['student']).itertuples(index=False):
+                lines.append('  - {} <{}>'.format(student.student, student.email))
+            lines.append('')
+
+    message.set_content('\n'.join(lines))
+    return message
+
+def deliver(course_name: str, message: EmailMessage) -> str:
+    """
+    Sends the digest via SMTP if one is configured, and always keeps a copy in the outbox directory
+    """
+    os.makedirs(outbox, exist_ok=True)
+    filename = path_safe('{}-{}.eml'.format(course_name.strip(), now.strftime('%Y%m%dT%H%M%S')))
+    with open(os.path.join(outbox, filename), 'wb') as digest_file:
+        digest_file.write(bytes(message))
+
+    if 'smtp_host' in alert_config:
+        with smtplib.SMTP(alert_config['smtp_host'], alert_config.get('smtp_port', 25)) as smtp:
+            smtp.send_message(message)
+
+    return os.path.join(outbox, filename)
+
+def path_safe(name: str) -> str:
+    return ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+
+def run(dry_run: bool = False) -> pd.DataFrame:
+    """
+    A single pass of the alert job; returns the transitions that were (or would have been) notified
+    """
+    state = open_state()
+    signature = get_db_signature()
+    last_run = get_last_run(state)
+
+    scope, candidates = get_candidates(last_run, signature)
+    transitions = update_state(state, scope, evaluate(candidates))
+
+    print('Alerts: evaluated {} candidate rows ({}), {} new transitions'.format(len(candidates), scope, len(transitions)))
+
+    if not dry_run:
+        for course_name, course_transitions in transitions.groupby(by='course_name'):
+            print('  wrote {}'.format(deliver(course_name, format_digest(course_name, course_transitions))))
+
+        state.execute("insert into alert_runs values (?, ?, ?, ?, ?)", (now.isoformat(), signature[0], signature[1], scope, len(transitions)))
+        state.commit()
+    state.close()
+
+    return transitions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Emit digests of newly overdue / near-due submissions, per course')
+    parser.add_argument('--dry-run', action='store_true', help='evaluate and report, but do not write digests or update state')
+    args = parser.parse_args()
+
+    run(args.dry_run)
@@ -0,0 +1,457 @@
+#################################################################################
+## benchmark.py - performance benchmarks for the Penn CIS Teaching Dashboard
+##
+## Generates synthetic crawler databases at several scales (see
+## synthetic_data.py) and times the data pipeline against each of them:
+## the aligned loaders in database.py, the course enrollments in entities.py,
+## and the rubric scoring and status summary in views.py, with each query
+## engine (SQLite, or DuckDB; see columnar.py).  Results are emitted as JSON
+## so runs from different commits can be compared:
+##
+##    python benchmark.py --output before.json
+##    (make changes)
+##    python benchmark.py --output after.json
+##    python benchmark.py --compare before.json after.json
+##
+## With --memory, it instead reports the peak memory (RSS) of the department-wide
+## summary at each scale, materialized or streamed (see aggregates.py).
+##
+## Licensed to the Apache Software Foundation (ASF) under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  The ASF licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing,
+## software distributed under the License is distributed on an
+## "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+## KIND, either express or implied.  See the License for the
+## specific language governing permissions and limitations
+## under the License.
+##
+#################################################################################
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import statistics
+import tracemalloc
+import yaml
+from datetime import datetime, timezone
+
+import synthetic_data
+from legacy_queries import LEGACY_ALIGNED_SQL
+
+## courses x students per course x assignments per course (and source)
+SCALES = {
+    'small': {'courses': 5, 'students': 50, 'assignments': 10},
+    'medium': {'courses': 20, 'students': 150, 'assignments': 15},
+    'large': {'courses': 50, 'students': 300, 'assignments': 20},
+}
+
+def time_call(fn: callable, repeat: int, setup: callable = None) -> dict:
+    """
+    Calls fn repeatedly (running setup before each call), returning wall-clock statistics in seconds
+    and the number of rows in the result
+    """
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+
+    if isinstance(result, list):
+        rows = sum(len(r) for r in result)
+    else:
+        rows = len(result)
+
+    return {'min': min(samples), 'median': statistics.median(samples), 'mean': statistics.mean(samples),
+            'runs': len(samples), 'rows': rows}
+
+def same_rows(before, after, ordered: bool) -> bool:
+    """
+    Whether two query results hold the same rows (in the same order, if ordered)
+    """
+    if list(before.columns) != list(after.columns) or len(before) != len(after):
+        return False
+    # A column that is all null is None for SQLite, but NaN (or NaT) for DuckDB
+    before, after = [frame.astype(object).where(frame.notna(), None).astype(str) for frame in [before, after]]
+    if not ordered:
+        before = before.sort_values(list(before.columns)).reset_index(drop=True)
+        after = after.sort_values(list(after.columns)).reset_index(drop=True)
+    return before.equals(after)
+
+## Where the query builder deliberately differs from the hand-written queries: by entity, the
+## columns whose values differ, and why
+KNOWN_DIFFERENCES = {
+    'submissions': {
+        # The legacy "Missing" named canvas_submissions' missing column, so Status was 0 or 1
+        'Status': "Canvas submissions that are neither graded nor submitted are 'Missing'",
+    },
+}
+
+def compare_queries(data_file: str, repeat: int) -> dict:
+    """
+    Checks that the query builder returns the same rows as the hand-written queries it replaced,
+    for each combination of sources, and times both.  The columns listed in KNOWN_DIFFERENCES are
+    left out of the comparison, and reported with the result if their values do differ.
+    """
+    import sqlite3
+    import pandas as pd
+    from queries import ALIGNED, aligned_sql
+
+    connection = sqlite3.connect(data_file)
+    results = {}
+    for entity, variants in LEGACY_ALIGNED_SQL.items():
+        for (include_gs, include_canvas), legacy in variants.items():
+            name = '{} ({})'.format(entity, '+'.join(source for source, included in [('gradescope', include_gs), ('canvas', include_canvas)] if included))
+            builder = aligned_sql(entity, include_gs, include_canvas)
+            try:
+                before = pd.read_sql(legacy, connection)
+            except Exception as e:
+                results[name] = {'equivalent': None, 'legacy_error': str(e)}
+                continue
+            after = pd.read_sql(builder, connection)
+            if entity == 'submissions':
+                # Lateness is now parsed when the submissions are normalized (see database._normalize_lateness)
+                before, after = before.drop(columns=['late']), after.drop(columns=['late', 'Lateness (H:M:S)', 'seconds_late'])
+
+            known = [column for column in KNOWN_DIFFERENCES.get(entity, {}) if column in before.columns]
+            ordered = ALIGNED[entity].get('order', False) and include_gs and include_canvas
+            results[name] = {'equivalent': same_rows(before.drop(columns=known), after.drop(columns=known), ordered),
+                             'known_differences': {column: KNOWN_DIFFERENCES[entity][column] for column in known
+                                                   if not same_rows(before[[column]], after[[column]], ordered)},
+                             'legacy': time_call(lambda: pd.read_sql(legacy, connection), repeat),
+                             'builder': time_call(lambda: pd.read_sql(builder, connection), repeat)}
+    connection.close()
+    return results
+
+def compare_engines(database) -> dict:
+    """
+    Checks that DuckDB (see columnar.py) returns the same aligned frames as SQLite (the engine
+    database.py was configured with), for each combination of sources
+    """
+    import columnar
+    from queries import ALIGNED
+
+    terms = database.get_terms()
+    results = {}
+    for include_gs, include_canvas in [(True, True), (True, False), (False, True)]:
+        sources = '+'.join(source for source, included in [('gradescope', include_gs), ('canvas', include_canvas)] if included)
+        for entity in ['courses', 'students', 'assignments', 'submissions']:
+            sqlite = getattr(database, 'get_aligned_' + entity)(include_gs, include_canvas, terms)
+            duckdb = getattr(columnar, 'get_aligned_' + entity)(database.databases, include_gs, include_canvas, terms, database.federated)
+            if entity == 'submissions':
+                duckdb = database._normalize_lateness(duckdb)
+            results['{} ({})'.format(entity, sources)] = {
+                'equivalent': same_rows(sqlite, duckdb, ALIGNED[entity].get('order', False) and include_gs and include_canvas)}
+    return results
+
+def duckdb_unavailable(data_file: str) -> str:
+    """
+    Why DuckDB cannot read the database (e.g., it is not installed, or its sqlite extension
+    cannot be downloaded), or None if it can
+    """
+    try:
+        import duckdb
+        duckdb.connect().execute("attach '{}' as probe (type sqlite, read_only)".format(data_file.replace("'", "''")))
+    except Exception as e:
+        return '{}: {}'.format(type(e).__name__, e)
+    return None
+
+def run_engines_worker(result_file: str) -> None:
+    import database
+
+    with open(result_file, 'w') as output:
+        json.dump(compare_engines(database), output)
+
+def check_engines(name: str, params: dict, keep: bool = False) -> dict:
+    """
+    Generates a database for one scale and checks that both engines return the same aligned
+    frames, or None if DuckDB is unavailable
+    """
+    directory = tempfile.mkdtemp(prefix='dashboard-engines-{}-'.format(name))
+    try:
+        db_file = os.path.join(directory, 'dashboard.db')
+        rubric = synthetic_data.generate(db_file, **params)
+        synthetic_data.write_config(directory, 'dashboard.db', rubric)
+
+        reason = duckdb_unavailable(db_file)
+        if reason:
+            print('Skipping the engine check, DuckDB cannot read the database ({})'.format(reason), file=sys.stderr)
+            return None
+
+        result_file = os.path.join(directory, 'engines.json')
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.abspath(__file__)), os.environ.get('PYTHONPATH', '')]))
+        worker = subprocess.run([sys.executable, os.path.abspath(__file__), '--engines-worker', result_file],
+                                cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if worker.returncode != 0:
+            raise RuntimeError('Engine check failed for {}:\n{}'.format(name, worker.stderr[-2000:]))
+        with open(result_file) as measurements:
+            return json.load(measurements)
+    finally:
+        if keep:
+            print('Kept {}'.format(directory))
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+def compare_loads(entities) -> dict:
+    """
+    Checks that loading the entity frames concurrently gives the same frames (and types) as
+    loading them one after another
+    """
+    sequential, concurrent = entities.load_store(concurrent=False), entities.load_store(concurrent=True)
+    results = {}
+    for name in ['courses', 'students', 'assignments', 'submissions', 'extensions', 'enrollments']:
+        before, after = getattr(sequential, name), getattr(concurrent, name)
+        results[name] = {'equivalent': before is after if before is None or after is None else
+                         list(before.dtypes) == list(after.dtypes) and before.equals(after)}
+    return results
+
+def run_worker(result_file: str, repeat: int) -> None:
+    """
+    Runs inside the directory holding the synthetic config.yaml, since the dashboard modules
+    read their configuration (and open the database) when they are imported
+    """
+    import streamlit as st
+    import database
+    import entities
+    import views
+    from status_tests import is_overdue, is_near_due, is_submitted
+
+    gs, canvas = database.include_gradescope_data, database.include_canvas_data
+
+    def clear():
+        st.cache_data.clear()
+        st.cache_resource.clear()
+
+    timings = {}
+    for fn in [database.get_aligned_courses, database.get_aligned_students,
+               database.get_aligned_assignments, database.get_aligned_submissions]:
+        timings['database.' + fn.__name__] = time_call(lambda: fn(gs, canvas), repeat)
+
+    # The whole store, with the independent reads one after another and issued concurrently
+    tables = [entities.extension_table()] if entities.extension_table() else []
+    timings['database.load_aligned'] = time_call(lambda: database.load_aligned(gs, canvas, tables=tables)['submissions'], repeat)
+    for concurrent in [False, True]:
+        timings['entities.load_store ({})'.format('concurrent' if concurrent else 'sequential')] = \
+            time_call(lambda: entities.load_store(concurrent=concurrent).submissions, repeat)
+
+    # Cold timings clear Streamlit's caches first; warm timings reuse whatever the previous call cached
+    timings['entities.get_course_enrollments'] = time_call(entities.get_course_enrollments, repeat, clear)
+    timings['entities.get_course_enrollments (warm)'] = time_call(entities.get_course_enrollments, repeat)
+
+    summary = lambda: views.get_course_student_status_summary(is_overdue, is_near_due, is_submitted)
+    timings['views.get_course_student_status_summary'] = time_call(summary, repeat, clear)
+    timings['views.get_course_student_status_summary (warm)'] = time_call(summary, repeat)
+
+    scores = lambda: views.get_scores_in_rubric(lambda title, column, max_column, dataframe: None)
+    timings['views.get_scores_in_rubric'] = time_call(scores, repeat, clear)
+    timings['views.get_scores_in_rubric (warm)'] = time_call(scores, repeat)
+
+    # Every session asks for the same frames; holding on to what ten of them got shows
+    # whether each one receives its own copy
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = [entities.get_course_enrollments() for _ in range(10)]
+    memory = {'store_bytes': entities.get_store().memory_usage(),
+              'ten_sessions_added_bytes': tracemalloc.get_traced_memory()[0] - before}
+    tracemalloc.stop()
+
+    results = {'timings': timings, 'memory': memory, 'load': compare_loads(entities)}
+    if database.query_engine == 'sqlite':
+        results['queries'] = compare_queries(database.data_file, repeat)
+
+    with open(result_file, 'w') as output:
+        json.dump(results, output)
+
+def run_memory_worker(result_file: str, mode: str, chunksize: int) -> None:
+    """
+    Computes the department-wide status summary either from the materialized enrollments (as the
+    data store does) or by streaming the submissions in chunks (see aggregates.py), and records
+    the peak resident memory of the process
+    """
+    import resource
+    import psutil
+    import entities
+    import views
+    import aggregates
+    from status_tests import is_overdue, is_near_due, is_submitted
+
+    courses, extensions = entities.load_courses(), entities.load_extensions()
+    baseline = psutil.Process().memory_info().rss
+
+    start = time.perf_counter()
+    if mode == 'streaming':
+        summary = aggregates.stream_status_aggregates(courses, extensions, is_overdue, is_near_due, is_submitted, chunksize).status_summary()
+    else:
+        submissions = entities.load_submissions()
+        enrollments = entities.load_course_enrollments(submissions, extensions)
+        summary = views.compute_course_student_status_summary(enrollments, courses, is_overdue, is_near_due, is_submitted)
+    seconds = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    with open(result_file, 'w') as output:
+        json.dump({'mode': mode, 'seconds': seconds, 'baseline_rss_bytes': baseline, 'peak_rss_bytes': peak,
+                   'peak_added_bytes': peak - baseline, 'courses': len(summary)}, output)
+
+def run_memory(name: str, params: dict, chunksize: int, keep: bool = False) -> list:
+    """
+    Generates a database for one scale and measures the peak memory of the materialized and the
+    streaming summaries, each in a fresh interpreter
+    """
+    directory = tempfile.mkdtemp(prefix='dashboard-memory-{}-'.format(name))
+    try:
+        db_file = os.path.join(directory, 'dashboard.db')
+        rubric = synthetic_data.generate(db_file, **params)
+        synthetic_data.write_config(directory, 'dashboard.db', rubric)
+
+        results = []
+        for mode in ['materialized', 'streaming']:
+            result_file = os.path.join(directory, 'memory-{}.json'.format(mode))
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.abspath(__file__)), os.environ.get('PYTHONPATH', '')]))
+            worker = subprocess.run([sys.executable, os.path.abspath(__file__), '--memory-worker', result_file, '--mode', mode,
+                                     '--chunksize', str(chunksize)],
+                                    cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            if worker.returncode != 0:
+                raise RuntimeError('Memory worker failed for {} ({}):\n{}'.format(name, mode, worker.stderr[-2000:]))
+
+            with open(result_file) as measurements:
+                results.append(dict({'scale': name, 'params': params, 'db_bytes': os.path.getsize(db_file), 'chunksize': chunksize},
+                                    **json.load(measurements)))
+            print('{:8} {:12} peak RSS {:8.1f} MB (+{:.1f} MB) in {:.2f}s'.format(
+                name, mode, results[-1]['peak_rss_bytes'] / 2**20, results[-1]['peak_added_bytes'] / 2**20, results[-1]['seconds']), file=sys.stderr)
+        return results
+    finally:
+        if keep:
+            print('Kept {}'.format(directory))
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+def run_scale(name: str, params: dict, repeat: int, keep: bool = False, engines: list = ['sqlite']) -> list:
+    """
+    Generates a database for one scale and benchmarks it with each query engine, each in a fresh interpreter
+    """
+    directory = tempfile.mkdtemp(prefix='dashboard-bench-{}-'.format(name))
+    try:
+        db_file = os.path.join(directory, 'dashboard.db')
+        start = time.perf_counter()
+        rubric = synthetic_data.generate(db_file, **params)
+        generated = time.perf_counter() - start
+        config_file = synthetic_data.write_config(directory, 'dashboard.db', rubric)
+
+        results = []
+        for engine in engines:
+            if engine == 'duckdb':
+                reason = duckdb_unavailable(db_file)
+                if reason:
+                    print('Skipping DuckDB for {}, it cannot read the database ({})'.format(name, reason), file=sys.stderr)
+                    continue
+            with open(config_file) as config_input:
+                config = yaml.safe_load(config_input)
+            config['query_engine'] = engine
+            with open(config_file, 'w') as config_output:
+                yaml.safe_dump(config, config_output, sort_keys=False)
+
+            result_file = os.path.join(directory, 'timings-{}.json'.format(engine))
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.abspath(__file__)), os.environ.get('PYTHONPATH', '')]))
+            worker = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', result_file, '--repeat', str(repeat)],
+                                    cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            if worker.returncode != 0:
+                raise RuntimeError('Benchmark worker failed for {} ({}):\n{}'.format(name, engine, worker.stderr[-2000:]))
+
+            with open(result_file) as measurements:
+                results.append(dict({'scale': name, 'engine': engine, 'params': params, 'db_bytes': os.path.getsize(db_file),
+                                     'generate_seconds': generated}, **json.load(measurements)))
+        return results
+    finally:
+        if keep:
+            print('Kept {}'.format(directory))
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+def compare(before_file: str, after_file: str) -> None:
+    """
+    Prints the median time of each benchmark in two result files, and the ratio between them
+    """
+    with open(before_file) as before_input, open(after_file) as after_input:
+        before, after = json.load(before_input), json.load(after_input)
+
+    print('{:8} {:7} {:50} {:>10} {:>10} {:>7}'.format('scale', 'engine', 'benchmark', 'before', 'after', 'ratio'))
+    before_runs = {(run['scale'], run.get('engine', 'sqlite')): run['timings'] for run in before['results']}
+    for run in after['results']:
+        key = (run['scale'], run.get('engine', 'sqlite'))
+        for bench, timing in run['timings'].items():
+            if key in before_runs and bench in before_runs[key]:
+                old = before_runs[key][bench]['median']
+                print('{:8} {:7} {:50} {:10.4f} {:10.4f} {:7.2f}'.format(key[0], key[1], bench, old, timing['median'],
+                                                                         timing['median'] / old if old else float('nan')))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard data pipeline on synthetic data')
+    parser.add_argument('--scales', default='small,medium', help='comma-separated list of {}'.format(', '.join(SCALES)))
+    parser.add_argument('--engines', default='sqlite', help='comma-separated list of query engines (sqlite, duckdb)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None, help='JSON file for the results (default: stdout)')
+    parser.add_argument('--keep', action='store_true', help='keep the generated databases')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files')
+    parser.add_argument('--memory', action='store_true', help='measure the peak memory of the materialized and streaming summaries instead')
+    parser.add_argument('--chunksize', type=int, default=20000, help='rows per chunk for the streaming summary')
+    parser.add_argument('--check-engines', action='store_true', help='check that SQLite and DuckDB return the same aligned frames, at each scale')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--engines-worker', help=argparse.SUPPRESS)
+    parser.add_argument('--memory-worker', help=argparse.SUPPRESS)
+    parser.add_argument('--mode', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.repeat)
+    elif args.memory_worker:
+        run_memory_worker(args.memory_worker, args.mode, args.chunksize)
+    elif args.engines_worker:
+        run_engines_worker(args.engines_worker)
+    elif args.check_engines:
+        different = []
+        for scale in args.scales.split(','):
+            for variant, result in (check_engines(scale, SCALES[scale], args.keep) or {}).items():
+                print('{:8} {:35} {}'.format(scale, variant, 'same' if result['equivalent'] else 'DIFFERENT'))
+                if not result['equivalent']:
+                    different.append((scale, variant))
+        sys.exit(1 if different else 0)
+    elif args.compare:
+        compare(*args.compare)
+    else:
+        results = {'commit': get_commit(), 'timestamp': datetime.now(timezone.utc).isoformat(),
+                   'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(), 'results': []}
+        for scale in args.scales.split(','):
+            print('Benchmarking {} {}'.format(scale, SCALES[scale]), file=sys.stderr)
+            if args.memory:
+                results['results'].extend(run_memory(scale, SCALES[scale], args.chunksize, args.keep))
+            else:
+                results['results'].extend(run_scale(scale, SCALES[scale], args.repeat, args.keep, args.engines.split(',')))
+
+        if args.output:
+            with open(args.output, 'w') as output:
+                json.dump(results, output, indent=2)
+        else:
+            print(json.dumps(results, indent=2))
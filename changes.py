@@ -0,0 +1,356 @@
+#################################################################################
+## changes.py - what changed between crawls, for the Penn CIS Teaching Dashboard
+##
+## Each time the data store is rebuilt after a crawl, every aligned submission
+## and extension is reduced to a hash of its key and a hash of its contents
+## (vectorized, with pandas' row hashing).  Comparing them with the hashes of
+## the previous crawl gives the rows that were inserted, updated or deleted;
+## only those are described and saved, in a small SQLite file of their own,
+## along with the latest hashes (updated by the same delta).  Reading the
+## changes of a crawl is then an indexed lookup, however long the history.
+##
+##    changes:
+##      state_db: changes.db
+##      keep: 200          # crawls of history to keep
+##
+## Licensed to the Apache Software Foundation (ASF) under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  The ASF licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing,
+## software distributed under the License is distributed on an
+## "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+## KIND, either express or implied.  See the License for the
+## specific language governing permissions and limitations
+## under the License.
+##
+#################################################################################
+
+import os
+import re
+import sqlite3
+import logging
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from datetime import datetime, timezone
+
+from database import config, default_terms
+from instrumentation import timed, timer
+
+change_config = config.get('changes', {}) or {}
+
+state_file = change_config.get('state_db', 'changes.db')
+
+logger = logging.getLogger(__name__)
+
+INSERTED = 'inserted'
+UPDATED = 'updated'
+DELETED = 'deleted'
+
+## For each tracked frame: the columns identifying a row (those present), and the columns whose
+## changes are reported (by default, all of the others)
+TRACKED = {
+    'submissions': {'key': ['term', 'source', 'gs_assignment_id', 'canvas_assignment_id', 'student_id', 'email'],
+                    'values': ['Status', 'Total Score', 'Max Points', 'Submission Time', 'due', 'late', 'seconds_late', 'points_deducted']},
+    'extensions': {'key': ['extension_id', 'gs_course_id_', 'gs_assign_id_', 'gs_user_id_', 'SID', 'assign_id', 'course_id'],
+                   'values': None},
+}
+
+CHANGE_COLUMNS = ['crawl_id', 'entity', 'change', 'course', 'item', 'student', 'email', 'detail']
+
+def open_state(filename: str = state_file) -> sqlite3.Connection:
+    """
+    The change history lives in its own small SQLite file, since the crawler owns the dashboard database
+    """
+    state = sqlite3.connect(filename, isolation_level=None, check_same_thread=False)
+    state.execute("""create table if not exists crawls
+                    (crawl_id integer primary key autoincrement, version text unique, detected_at text,
+                     inserted integer, updated integer, deleted integer)""")
+    state.execute("""create table if not exists changes
+                    (crawl_id integer, entity text, change text, course text, item text, student text, email text, detail text)""")
+    state.execute("create index if not exists changes_by_crawl on changes (crawl_id)")
+    state.execute("""create table if not exists row_hashes
+                    (entity text, row_key integer, row_hash integer, primary key (entity, row_key)) without rowid""")
+    return state
+
+def tracked_columns(entity: str, frame: pd.DataFrame) -> tuple:
+    spec = TRACKED[entity]
+    key = [column for column in spec['key'] if column in frame.columns]
+    values = spec['values'] if spec['values'] is not None else [column for column in frame.columns if column not in key]
+    return key, [column for column in values if column in frame.columns]
+
+def hash_rows(frame: pd.DataFrame) -> np.ndarray:
+    """
+    A 64-bit hash of each row, as signed integers (so SQLite can store them)
+    """
+    try:
+        hashes = pd.util.hash_pandas_object(frame, index=False)
+    except TypeError:
+        # Columns mixing strings and numbers (e.g., Status) are hashed as strings
+        frame = frame.copy()
+        for column in frame.columns[frame.dtypes == object]:
+            frame[column] = frame[column].apply(lambda x: x if pd.isna(x) else str(x))
+        hashes = pd.util.hash_pandas_object(frame, index=False)
+    return hashes.to_numpy().view(np.int64)
+
+@timed
+def row_hashes(entity: str, frame: pd.DataFrame) -> pd.Series:
+    """
+    The content hash of each row of a frame, indexed by the hash of its key.  Rows with the same
+    key are told apart by their position when sorted by key and content, since the aligned
+    queries return rows in no particular order.
+    """
+    key, values = tracked_columns(entity, frame)
+    keys = frame[key].reset_index(drop=True)
+    contents = hash_rows(frame[values].reset_index(drop=True))
+    order = np.lexsort((contents, hash_rows(keys)))
+    occurrence = np.empty(len(keys), dtype=np.int64)
+    occurrence[order] = keys.iloc[order].groupby(key, sort=False, dropna=False).cumcount().to_numpy()
+    keys['occurrence'] = occurrence
+    return pd.Series(contents, index=hash_rows(keys), name='row_hash')
+
+def diff_hashes(before: pd.Series, after: pd.Series) -> dict:
+    """
+    The keys of the rows inserted, updated and deleted between two versions
+    """
+    common = after.index.intersection(before.index)
+    return {INSERTED: after.index.difference(before.index),
+            UPDATED: common[before.reindex(common).to_numpy() != after.reindex(common).to_numpy()],
+            DELETED: before.index.difference(after.index)}
+
+def format_value(value) -> str:
+    if pd.isna(value):
+        return '–'
+    if isinstance(value, pd.Timestamp):
+        return value.strftime('%Y-%m-%d %H:%M')
+    if isinstance(value, float):
+        return '{:g}'.format(value)
+    return str(value)
+
+def describe_rows(rows: pd.DataFrame, old: pd.DataFrame, values: list) -> list:
+    """
+    For each changed row, its values, or the ones that changed (old → new) if the old rows are known
+    """
+    if old is None:
+        return ['; '.join('{}: {}'.format(column, format_value(row[column])) for column in values) for _, row in rows.iterrows()]
+    return ['; '.join('{}: {} → {}'.format(column, format_value(before[column]), format_value(after[column]))
+                      for column in values if format_value(before[column]) != format_value(after[column]))
+            for (_, before), (_, after) in zip(old.iterrows(), rows.iterrows())]
+
+def labels(entity: str, rows: pd.DataFrame, store) -> pd.DataFrame:
+    """
+    The course, item (assignment) and student of each changed row, for display
+    """
+    if entity == 'submissions':
+        return pd.DataFrame({'course': rows['course_name'], 'item': rows['name'], 'student': rows['student'], 'email': rows['email']})
+
+    get = lambda column: rows[column] if column in rows.columns else pd.Series([None] * len(rows), index=rows.index)
+    courses = store.courses.dropna(subset=['gs_course_id']).drop_duplicates(subset=['gs_course_id']).set_index('gs_course_id')['shortname']
+    assignments = store.assignments.dropna(subset=['gs_assignment_id']).drop_duplicates(subset=['gs_assignment_id']).set_index('gs_assignment_id')['name']
+    return pd.DataFrame({'course': get('gs_course_id_').map(courses).fillna(get('gs_course_id_').fillna(get('course_id'))),
+                         'item': get('gs_assign_id_').map(assignments).fillna(get('gs_assign_id_').fillna(get('assign_id'))),
+                         'student': (get('First Name').fillna('') + ' ' + get('Last Name').fillna('')).str.strip(),
+                         'email': get('Email')})
+
+class ChangeTracker:
+    """
+    Records, for each new data store snapshot, the rows that changed since the previous one.  The
+    latest hashes are kept in memory (and in the state file, for restarts and other processes).
+    """
+    def __init__(self, filename: str = state_file):
+        self.filename = filename
+        self.hashes = None
+        self.crawl_id = None
+        self._lock = threading.Lock()
+
+    def load_hashes(self, state: sqlite3.Connection) -> dict:
+        hashes = pd.read_sql('select entity, row_key, row_hash from row_hashes', state)
+        return {entity: hashes[hashes['entity'] == entity].set_index('row_key')['row_hash'] for entity in TRACKED}
+
+    @timed
+    def record(self, store, previous = None) -> int:
+        """
+        Diffs a new snapshot against the last recorded one, and saves what changed.  previous is
+        the snapshot it replaces, if still in memory, to report old values as well.  Returns the
+        crawl's ID (None if nothing changed, or it was already recorded, e.g. by another process).
+        """
+        with self._lock:
+            state = open_state(self.filename)
+            try:
+                state.execute('begin immediate')
+                version = repr(store.version)
+                last = state.execute('select crawl_id, version from crawls order by crawl_id desc limit 1').fetchone()
+                if last is not None and last[1] == version:
+                    state.execute('rollback')
+                    return None
+                if last is not None and self.crawl_id != last[0]:
+                    self.hashes = self.load_hashes(state)
+                if previous is not None and (last is None or repr(previous.version) != last[1]):
+                    previous = None
+
+                hashes = {entity: row_hashes(entity, getattr(store, entity)) for entity in TRACKED}
+                counts = {INSERTED: 0, UPDATED: 0, DELETED: 0}
+                described = []
+                deltas = []
+                for entity, after in hashes.items():
+                    if last is None:
+                        # The first snapshot is the baseline: nothing has changed yet
+                        deltas.append((entity, after, after.index, pd.Index([])))
+                        continue
+                    diff = diff_hashes(self.hashes[entity], after)
+                    for change, keys in diff.items():
+                        counts[change] += len(keys)
+                    described.append(self.describe(entity, store, previous, after, diff))
+                    deltas.append((entity, after, diff[INSERTED].append(diff[UPDATED]), diff[DELETED]))
+
+                if last is not None and not sum(counts.values()):
+                    # E.g., a restart: the version changed, but not the data
+                    state.execute('rollback')
+                    self.hashes, self.crawl_id = hashes, last[0]
+                    return None
+
+                cursor = state.execute('insert into crawls (version, detected_at, inserted, updated, deleted) values (?, ?, ?, ?, ?)',
+                                       (version, datetime.now(timezone.utc).isoformat(), counts[INSERTED], counts[UPDATED], counts[DELETED]))
+                crawl_id = cursor.lastrowid
+
+                with timer('changes.ChangeTracker.record: save'):
+                    for frame in described:
+                        rows = frame.assign(crawl_id=crawl_id)[CHANGE_COLUMNS].astype(object)
+                        state.executemany('insert into changes values (?, ?, ?, ?, ?, ?, ?, ?)',
+                                          rows.where(rows.notna(), None).itertuples(index=False, name=None))
+                    for entity, after, upserted, deleted in deltas:
+                        state.executemany('insert or replace into row_hashes values (?, ?, ?)',
+                                          ((entity, int(key), int(row_hash)) for key, row_hash in after.reindex(upserted).items()))
+                        state.executemany('delete from row_hashes where entity = ? and row_key = ?', ((entity, int(key)) for key in deleted))
+
+                    # Only the most recent crawls are kept
+                    keep = change_config.get('keep', 200)
+                    state.execute('delete from changes where crawl_id <= ?', (crawl_id - keep,))
+                    state.execute('delete from crawls where crawl_id <= ?', (crawl_id - keep,))
+                state.execute('commit')
+            except BaseException:
+                if state.in_transaction:
+                    state.execute('rollback')
+                raise
+            finally:
+                state.close()
+
+            self.hashes = hashes
+            self.crawl_id = crawl_id
+            if last is not None:
+                logger.info('Crawl %s: %s inserted, %s updated, %s deleted', crawl_id, counts[INSERTED], counts[UPDATED], counts[DELETED])
+            return crawl_id
+
+    def describe(self, entity: str, store, previous, after: pd.Series, diff: dict) -> pd.DataFrame:
+        """
+        The changed rows of one frame, labelled and described
+        """
+        frame = getattr(store, entity)
+        _, values = tracked_columns(entity, frame)
+        positions = pd.Series(np.arange(len(after)), index=after.index)
+        old_positions = None
+        if previous is not None:
+            before = row_hashes(entity, getattr(previous, entity))
+            old_positions = pd.Series(np.arange(len(before)), index=before.index)
+
+        described = []
+        for change in [INSERTED, UPDATED, DELETED]:
+            keys = diff[change]
+            if not len(keys):
+                continue
+            if change == DELETED and old_positions is None:
+                # Without the previous snapshot, all we know is that rows are gone
+                described.append(pd.DataFrame({'entity': [entity], 'change': [change], 'course': [None], 'item': [None],
+                                               'student': [None], 'email': [None], 'detail': ['{} row(s) deleted'.format(len(keys))]}))
+                continue
+
+            old = None
+            if change != INSERTED and old_positions is not None:
+                old = getattr(previous, entity).iloc[old_positions.reindex(keys).to_numpy()]
+            if change == DELETED:
+                rows, old, source = old, None, previous
+            else:
+                rows, source = frame.iloc[positions.reindex(keys).to_numpy()], store
+            described.append(labels(entity, rows, source).reset_index(drop=True).assign(
+                entity=entity, change=change, detail=describe_rows(rows, old, values)))
+        if not described:
+            return pd.DataFrame(columns=CHANGE_COLUMNS[1:])
+        return pd.concat(described, ignore_index=True)
+
+def state_path(terms: list = None) -> str:
+    """
+    The change history of a set of terms: state_db for the configured ones, and a file of its own
+    for any other set (e.g., past semesters picked in the dashboard), whose rows would otherwise
+    look inserted or deleted
+    """
+    if not terms or sorted(terms, key=str) == sorted(default_terms, key=str):
+        return state_file
+    base, extension = os.path.splitext(state_file)
+    return '{}-{}{}'.format(base, '-'.join(re.sub(r'\W+', '_', str(term)) for term in sorted(terms, key=str)), extension)
+
+tracker = ChangeTracker()
+_trackers = {state_file: tracker}
+_trackers_lock = threading.Lock()
+
+def get_tracker(terms: list = None) -> ChangeTracker:
+    filename = state_path(terms)
+    with _trackers_lock:
+        return _trackers.setdefault(filename, ChangeTracker(filename))
+
+def record_changes(store, previous = None) -> None:
+    """
+    Records what a new snapshot changed (see ChangeTracker.record); a failure is reported, but
+    does not hold up the snapshot
+    """
+    if not change_config.get('enabled', True):
+        return
+    try:
+        get_tracker(getattr(store, 'terms', None)).record(store, previous)
+    except Exception:
+        logger.exception('Could not record the changes of data version %r', store.version)
+
+def get_crawls(limit: int = 20, filename: str = state_file) -> pd.DataFrame:
+    """
+    The most recent crawls, with how many rows each one changed
+    """
+    state = open_state(filename)
+    try:
+        return pd.read_sql('select * from crawls order by crawl_id desc limit ?', state, params=(limit,))
+    finally:
+        state.close()
+
+def get_changes(since: int = None, course: str = None, filename: str = state_file) -> pd.DataFrame:
+    """
+    The changes recorded after crawl since (by default, those of the latest crawl), optionally
+    for one course.  Only the rows of those crawls are read.
+    """
+    state = open_state(filename)
+    try:
+        if since is None:
+            last = state.execute('select max(crawl_id) from crawls').fetchone()[0]
+            since = (last or 0) - 1
+        sql = 'select * from changes where crawl_id > ?'
+        params = [since]
+        if course is not None:
+            sql += ' and course = ?'
+            params.append(course)
+        return pd.read_sql(sql + ' order by crawl_id, entity, course, item, student', state, params=params)
+    finally:
+        state.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show what changed in the last crawls')
+    parser.add_argument('--since', type=int, default=None, help='show the changes after this crawl (default: the latest crawl)')
+    parser.add_argument('--course', default=None)
+    args = parser.parse_args()
+
+    print(get_crawls().to_string(index=False))
+    print(get_changes(args.since, args.course).to_string(index=False))
@@ -0,0 +1,124 @@
+#################################################################################
+## columnar.py - DuckDB query engine for the Penn CIS Teaching Dashboard
+##
+## An alternative to SQLite for the aligned (Gradescope + Canvas) queries in
+## database.py.  DuckDB attaches the crawler's SQLite files read-only (via its
+## sqlite extension) and runs the same aligned queries (built from the specs
+## in queries.py), plus the timestamp parsing that the SQLite path does in
+## pandas, vectorized and multi-threaded.  The results come back through
+## Arrow.  Selected in config.yaml:
+##
+##    query_engine: duckdb      # default: sqlite
+##
+## Licensed to the Apache Software Foundation (ASF) under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  The ASF licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing,
+## software distributed under the License is distributed on an
+## "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+## KIND, either express or implied.  See the License for the
+## specific language governing permissions and limitations
+## under the License.
+##
+#################################################################################
+
+import threading
+import duckdb
+import pandas as pd
+
+import queries
+
+_connection = None
+_lock = threading.Lock()
+
+def schema(index: int) -> str:
+    return 'term_{}'.format(index)
+
+def connect(databases: dict) -> duckdb.DuckDBPyConnection:
+    """
+    One DuckDB connection per process, with each term's SQLite file attached (read-only) as
+    its own catalog; each query runs on its own cursor
+    """
+    global _connection
+    with _lock:
+        if _connection is None:
+            connection = duckdb.connect()
+            connection.execute("set TimeZone = 'UTC'")
+            for index, file in enumerate(databases.values()):
+                connection.execute("attach '{}' as {} (type sqlite, read_only)".format(file.replace("'", "''"), schema(index)))
+            _connection = connection
+    return _connection
+
+def utc(column: str) -> str:
+    """
+    A text timestamp in UTC, as a naive timestamp (like the SQLite path's strptime)
+    """
+    return "timezone('UTC', try_cast({} as timestamptz))".format(column)
+
+## The columns DuckDB parses (which the SQLite path parses in pandas), and those it then drops
+PARSED = {
+    'courses': {'start_at': utc('start_at'), 'end_at': utc('end_at')},
+    'assignments': {'assigned': utc('assigned'), 'due': utc('due')},
+    # Canvas's submitted_at if there is one, else Gradescope's time (with its UTC offset)
+    'submissions': {'Submission Time': "coalesce(try_cast(submitted_at as timestamptz), try_strptime(\"Submission Time\", '%Y-%m-%d %H:%M:%S %z'))",
+                    'due': 'try_cast(due as timestamptz)'},
+}
+DROPPED = {'submissions': ['submitted_at']}
+
+def aligned_sql(entity: str, include_gs: bool, include_canvas: bool) -> str:
+    """
+    The aligned query of queries.py, in DuckDB's dialect, with its dates parsed
+    """
+    sql = queries.aligned_sql(entity, include_gs, include_canvas, 'duckdb')
+    if entity not in PARSED:
+        return sql
+    return 'select * {}replace ({}) from ({})'.format(
+        'exclude ({}) '.format(', '.join(DROPPED[entity])) if entity in DROPPED else '',
+        ', '.join('{} as {}'.format(expression, queries.quote(column)) for column, expression in PARSED[entity].items()), sql)
+
+def query(databases: dict, entity: str, include_gs: bool, include_canvas: bool, terms: list, label: bool) -> pd.DataFrame:
+    """
+    Runs the aligned query against each term's database (on a cursor using its catalog),
+    labelling the rows of each with its term
+    """
+    names = list(databases)
+    sql = aligned_sql(entity, include_gs, include_canvas)
+    frames = []
+    for term in terms:
+        cursor = connect(databases).cursor()
+        try:
+            cursor.execute('use {}'.format(schema(names.index(term))))
+            frame = cursor.execute(sql).fetch_arrow_table().to_pandas()
+        finally:
+            cursor.close()
+
+        # DuckDB names UTC as Etc/UTC
+        for column in frame.columns[[isinstance(dtype, pd.DatetimeTZDtype) for dtype in frame.dtypes]]:
+            frame[column] = frame[column].dt.tz_convert('UTC')
+
+        if label:
+            if 'term' in frame.columns:
+                frame['term'] = frame['term'].where(frame['term'].notna(), term)
+            else:
+                frame['term'] = term
+        frames.append(frame)
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+def get_aligned_students(databases: dict, include_gs: bool, include_canvas: bool, terms: list, label: bool) -> pd.DataFrame:
+    return query(databases, 'students', include_gs, include_canvas, terms, label)
+
+def get_aligned_courses(databases: dict, include_gs: bool, include_canvas: bool, terms: list, label: bool) -> pd.DataFrame:
+    return query(databases, 'courses', include_gs, include_canvas, terms, label)
+
+def get_aligned_assignments(databases: dict, include_gs: bool, include_canvas: bool, terms: list, label: bool) -> pd.DataFrame:
+    return query(databases, 'assignments', include_gs, include_canvas, terms, label)
+
+def get_aligned_submissions(databases: dict, include_gs: bool, include_canvas: bool, terms: list, label: bool) -> pd.DataFrame:
+    return query(databases, 'submissions', include_gs, include_canvas, terms, label)
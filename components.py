@@ -28,20 +28,30 @@ from st_aggrid import AgGrid, GridOptionsBuilder, ColumnsAutoSizeMode
 from st_aggrid import GridOptionsBuilder, GridUpdateMode, DataReturnMode, AgGridTheme
 import aggrid_helper
 import pandas as pd
+import numpy as np
+import itertools
 from datetime import datetime
 import matplotlib.pyplot as plt
 
 from status_tests import now
-from entities import get_courses, get_assignments, get_course_enrollments, get_submissions
-from views import get_scores_in_rubric, get_assignments_and_submissions
+from entities import get_courses, get_assignments, get_course_enrollments, get_submissions, get_course_submissions
+from views import get_scores_in_rubric, get_assignments_and_submissions, get_page, get_course_view, status_flags
+from views import get_student_drilldown, get_student_rollup, get_lateness_distribution, LATENESS_LABELS
+from views import get_changes_since_last_crawl
 
 from status_tests import is_overdue, is_near_due, is_submitted, is_below_mean, is_far_below_mean, is_far_above_mean
+from instrumentation import timed, timer, summarize
 
 
-def display_hw_status(course_name:str, assign:pd.DataFrame, due_date: datetime, df: pd.DataFrame) -> None:
+@timed
+def display_hw_status(course_name:str, assign:pd.DataFrame, due_date: datetime, df: pd.DataFrame, flags: dict = None) -> None:
     """
-    Outputs, for each assignment, the student status
+    Outputs, for each assignment, the student status (flags, if given, are the submissions'
+    precomputed status_flags)
     """
+    if flags is None:
+        flags = status_flags(df, due_date)
+
     st.markdown('### %s'%assign['name'])
     # st.write('released on %s and due on %s'%(assigned,due))
     st.write('Due on %s'%(due_date.strftime('%A, %B %d, %Y')))
@@ -59,37 +69,36 @@ def display_hw_status(course_name:str, assign:pd.DataFrame, due_date: datetime,
     #     # st.write("Submissions over time:")
     #     st.line_chart(data=by_time,x='Day',y='Count')
 
-    late_df = df[df.apply(lambda x: is_overdue(x, due_date), axis=1)]['email']
+    late_df = df[flags['overdue']]['email']
     late_as_list = str(late_df.to_list())[1:-2].replace('\'','').replace(' ','')
     
-    last_minute_df = df[df.apply(lambda x: is_near_due(x, due_date), axis=1)]['email']
+    last_minute_df = df[flags['near_due']]['email']
     last_minute_as_list = str(last_minute_df.to_list())[1:-2].replace('\'','').replace(' ','')
 
     # with col1:
         # st.write("Students and submissions:")
-    st.dataframe(df.style.format(precision=0).apply(
-        lambda x: [f"background-color:pink" 
-                    if is_overdue(x, due_date) 
-                    else f'background-color:mistyrose' 
-                        if is_near_due(x, due_date) 
-                        else 'background-color:lightgreen' if is_submitted(x) else '' for i in x],
-        axis=1), use_container_width=True,hide_index=True,
-                column_config={
-                    'name':None,'sid':None,'cid':None,
-                    'gs_assignment_id':None,'Last Name':None,'First Name':None, 
-                    'assigned':None,'due': None,
-                    'shortname':None,
-                    # 'Sections':None,
-                    'gs_course_id': None,
-                    'gs_user_id': None,
-                    'gs_student_id': None,
-                    'canvas_sid': None,
-                    'canvas_course_id': None,
-                    'sis_course_id': None,
-                    'Total Score':st.column_config.NumberColumn(step=1,format="$%d"),
-                    'Max Points':st.column_config.NumberColumn(step=1,format="$%d"),
-                    # 'Submission Time':st.column_config.DatetimeColumn(format="D MM YY, h:mm a")
-                    })
+    colors = np.select([flags['overdue'], flags['near_due'], flags['submitted']],
+                       ['background-color:pink', 'background-color:mistyrose', 'background-color:lightgreen'], '')
+    with timer('components.display_hw_status: styler'):
+        st.dataframe(df.style.format(precision=0).apply(
+            lambda x: pd.DataFrame(np.repeat(colors[:, None], x.shape[1], axis=1), index=x.index, columns=x.columns),
+            axis=None), use_container_width=True,hide_index=True,
+                    column_config={
+                        'name':None,'sid':None,'cid':None,
+                        'gs_assignment_id':None,'Last Name':None,'First Name':None, 
+                        'assigned':None,'due': None,
+                        'shortname':None,
+                        # 'Sections':None,
+                        'gs_course_id': None,
+                        'gs_user_id': None,
+                        'gs_student_id': None,
+                        'canvas_sid': None,
+                        'canvas_course_id': None,
+                        'sis_course_id': None,
+                        'Total Score':st.column_config.NumberColumn(step=1,format="$%d"),
+                        'Max Points':st.column_config.NumberColumn(step=1,format="$%d"),
+                        # 'Submission Time':st.column_config.DatetimeColumn(format="D MM YY, h:mm a")
+                        })
         
     if len(late_df) > 0 and len(late_df) < 20:
         URL_STRING = "mailto:" + late_as_list + "?subject=Late homework&body=Hi, we have not received your submission for " + assign['name'] + " for " + course_name.strip() + ". Please let us know if you need special accommodation."
@@ -106,6 +115,7 @@ def display_hw_status(course_name:str, assign:pd.DataFrame, due_date: datetime,
             unsafe_allow_html=True
         )
 
+@timed
 def display_course(course_filter: pd.DataFrame):
     """
     Given a course dataframe (with a singleton row), displays for each assignment (in ascending order of deadline):
@@ -120,10 +130,13 @@ def display_course(course_filter: pd.DataFrame):
     course_num = int(course['canvas_course_id'])
     course_name = course['name']
 
-    col1, col2, col3, col4, col5 = st.tabs(['Status','Grading','Students','Submissions','Assignments'])
+    col1, col2, col3, col4, col5, col6 = st.tabs(['Status','Grading','Students','Submissions','Assignments','Lateness'])
 
     with col1:
-       grading_dfs = get_scores_in_rubric(display_rubric_component, course)
+       # The components are shown in the same order on every rerun, which keeps their widget keys stable
+       components = itertools.count()
+       grading_dfs = get_scores_in_rubric(lambda title, column, max_column, dataframe: display_rubric_component(
+           title, column, max_column, dataframe, 'rubric_{}_{}'.format(course_num, next(components))), course)
 
     with col2:
         courses = []
@@ -139,15 +152,22 @@ def display_course(course_filter: pd.DataFrame):
             with tabs[inx]:
                 assign_grades(this_course)
 
+    # Totals and assignment statuses, prefetched if this course was next to the previous one
+    view = get_course_view(course_num)
+
     with col3:
-        display_hw_totals(course_num)
+        display_hw_totals(course_num, view['totals'])
 
     with col4:
         display_hw_assignment_scores(course_num)
 
     with col5:
-        display_hws(course_name, course_num)
+        display_hws(course_name, course_num, view['assignments'])
+
+    with col6:
+        display_lateness(course_num)
 
+@timed
 def display_birds_eye(birds_eye_df: pd.DataFrame) -> None:
     """
     Bird's eye view of student progress
@@ -185,12 +205,83 @@ def display_birds_eye(birds_eye_df: pd.DataFrame) -> None:
         allow_unsafe_jscode=True
         )
     
-def display_rubric_component(title: str, column: str, max_column: str, dataframe: pd.DataFrame) -> None:
+PAGE_SIZES = [25, 50, 100, 250]
+
+def mean_highlights(column: str, mean: float, overall_max: float = None) -> list:
+    """
+    The rules of is_far_below_mean, is_below_mean and is_far_above_mean, as client-side
+    highlights (see aggrid_helper.add_highlights)
+    """
+    value = 'params.data["{}"]'.format(column)
+    rules = []
+    if not pd.isna(mean):
+        rules.append(('{0} != null && {0} < {1}'.format(value, mean / 2), 'black', 'pink'))
+        rules.append(('{0} != null && {0} < {1}'.format(value, mean * 0.9), 'black', 'mistyrose'))
+    if overall_max is not None and not pd.isna(overall_max):
+        rules.append(('{0} != null && {0} >= {1}'.format(value, overall_max * 0.95), 'black', 'lightgreen'))
+    return rules
+
+@timed
+def display_paged_grid(dataframe: pd.DataFrame, key: str, sort_by = None, ascending: bool = True,
+                       hidden: list = None, highlights: list = None, precision: int = None) -> None:
+    """
+    Shows a (possibly large) table a page at a time.  Filtering, sorting and paging happen here,
+    on the cached frame, so only the visible page is sent to the browser, where rows are colored
+    by the highlight rules (see aggrid_helper.add_highlights).  If precision is given, the numbers
+    on the page are rounded to that many decimals.
+    """
+    hidden = hidden or []
+    highlights = highlights or []
+    columns = [column for column in dataframe.columns if column not in hidden]
+
+    col1, col2, col3, col4, col5 = st.columns([3, 2, 1, 1, 1])
+    with col1:
+        search = st.text_input('Filter', key=key + '_search')
+    with col2:
+        sort_column = st.selectbox('Sort by', ['(default)'] + columns, key=key + '_sort')
+    with col3:
+        order = st.selectbox('Order', ['Ascending', 'Descending'], index=0 if ascending else 1, key=key + '_order')
+    with col4:
+        page_size = st.selectbox('Rows', PAGE_SIZES, index=1, key=key + '_rows')
+    with col5:
+        page_number = st.number_input('Page', min_value=1, value=1, step=1, key=key + '_page')
+
+    if sort_column != '(default)':
+        sort_by = sort_column
+    with timer('components.display_paged_grid: page'):
+        page, total, page_number = get_page(dataframe, sort_by, order == 'Ascending', search, page_number, page_size, columns)
+        if precision is not None:
+            page = page.round(precision)
+
+    gb = GridOptionsBuilder.from_dataframe(page)
+    # The page is already sorted and filtered
+    gb.configure_default_column(sortable=False, filter=False)
+    gridOptions = gb.build()
+    if len(highlights) == 1:
+        gridOptions['getRowStyle'] = aggrid_helper.add_highlight(*highlights[0])
+    elif len(highlights):
+        gridOptions['getRowStyle'] = aggrid_helper.add_highlights(highlights)
+
+    AgGrid(
+        page,
+        gridOptions=gridOptions,
+        height=min(400, 35 * (len(page) + 2)),
+        columns_auto_size_mode=ColumnsAutoSizeMode.FIT_CONTENTS,
+        allow_unsafe_jscode=True,
+        update_on=[],
+        key=key + '_grid'
+        )
+    st.caption('Rows {}-{} of {} (page {} of {})'.format(min(total, (page_number - 1) * page_size + 1), min(total, page_number * page_size),
+                                                         total, page_number, max(1, -(-total // page_size))))
+
+@timed
+def display_rubric_component(title: str, column: str, max_column: str, dataframe: pd.DataFrame, key: str = None) -> None:
     """
     Helper function: given a dataframe representing a component of the rubric, displays a table with color coding
     and all students.
     """
     st.markdown('### %s'%title)
+    key = key or 'rubric_' + title
     if column and len(dataframe):
         mean = dataframe[column].dropna().mean()
         overall_max = dataframe[max_column].dropna().max()
@@ -201,37 +292,32 @@ def display_rubric_component(title: str, column: str, max_column: str, dataframe
             st.write('Mean: {:.2f}'.format(mean))
         elif not pd.isna(overall_max):
             st.write('Max: {}'.format(overall_max))
-        st.dataframe(dataframe.style.format(precision=0).apply(
-            lambda x: [f"background-color:pink" 
-                        if is_far_below_mean(x, mean, column) 
-                        else f'background-color:mistyrose' 
-                            if is_below_mean(x, mean, column) 
-                            else 'background-color:lightgreen' 
-                                    if is_far_above_mean(x, overall_max, mean, column)
-                                    else '' for i in x],
-            axis=1), use_container_width=True,hide_index=True)
+        display_paged_grid(dataframe, key, highlights=mean_highlights(column, mean, overall_max), precision=0)
     else:
-        st.dataframe(dataframe, use_container_width=True,hide_index=True)
+        display_paged_grid(dataframe, key)
 
+@timed
 def display_hw_assignment_scores(course = None) -> None:
     """
     For an optionally restricted course, shows the scores for each assignment
     """
     st.markdown('## Student Scores by Assignment')
 
-    scores = get_assignments_and_submissions()
     if course is not None:
-        scores = scores[scores['canvas_course_id'] == course]
+        scores = get_course_submissions(canvas_course_id=course)
+    else:
+        scores = get_assignments_and_submissions()
 
-    scores = scores\
-                [['name', 'due', 'student', 'email', 'Total Score', 'Status', 'late']].\
-                sort_values(by=['due', 'name', 'Total Score'])
+    columns = ['name', 'due', 'student', 'email', 'Total Score', 'Status', 'late']
 
         #melt(id_vars=['First Name', 'Last Name', 'Email', 'Sections', 'course_id', 'assign_id', 'Submission ID', 'Total Score', 'Max Points', 'Submission Time', 'Status', 'Lateness (H:M:S)']).\
 
-    st.dataframe(scores)
+    display_paged_grid(scores, 'scores_{}'.format(course), sort_by=['due', 'name', 'Total Score'],
+                       hidden=[column for column in scores.columns if column not in columns],
+                       highlights=[('params.data["late"]', 'black', 'mistyrose')])
 
 
+@timed
 def assign_grades(grade_totals: pd.DataFrame) -> None:
     """
     Grading control, presents sliders for each grade threshold and displays the resulting distribution.
@@ -282,18 +368,21 @@ def assign_grades(grade_totals: pd.DataFrame) -> None:
         st.dataframe(grade_totals[['student','student_id','email','Total Points','grade']].sort_values(by=['Total Points','student']), use_container_width=True,hide_index=True)
 
 
-def display_hw_totals(course: int = None) -> None:
+@timed
+def display_hw_totals(course: int = None, scores: pd.DataFrame = None) -> None:
     """
-    Aggregate status by student
+    Aggregate status by student (scores, if given, are the precomputed totals)
     """
     st.markdown('## Student Aggregate Status: Points Earned')
 
-    scores = get_assignments_and_submissions()
-    if course is not None:
-        scores = scores[scores['canvas_course_id'] == course]
-    scores = scores.\
-                            groupby(by=['email','student']).sum()['Total Score'].reset_index().\
-                            sort_values(by=['Total Score'])
+    if scores is None:
+        if course is not None:
+            scores = get_course_submissions(canvas_course_id=course)
+        else:
+            scores = get_assignments_and_submissions()
+        scores = scores.\
+                                groupby(by=['email','student']).sum()['Total Score'].reset_index().\
+                                sort_values(by=['Total Score'])
 
         #melt(id_vars=['First Name', 'Last Name', 'Email', 'Sections', 'course_id', 'assign_id', 'Submission ID', 'Total Score', 'Max Points', 'Submission Time', 'Status', 'Lateness (H:M:S)']).\
 
@@ -301,48 +390,110 @@ def display_hw_totals(course: int = None) -> None:
 
     st.markdown('Out of {} students, the mean score is {} out of {}'.format(int(len(scores)), int(mean), int(scores['Total Score'].max())))
 
-    st.dataframe(scores.style.format(precision=0).apply(
-        lambda x: [f"background-color:pink" 
-                    if is_far_below_mean(x, mean) 
-                    else f'background-color:mistyrose' 
-                        if is_below_mean(x, mean) 
-                        else 'background-color:lightgreen' for i in x],
-        axis=1), use_container_width=True,hide_index=True,
-                column_config={
-                    'name':None,'sid':None,'cid':None,
-                    'assign_id':None,
-                    'assigned':None,'due': None,
-                    'shortname':None,
-                    'Sections': None,
-                    'gs_course_id': None,
-                    'user_id': None,
-                    'student_id': None,
-                    'canvas_sid': None,
-                    'canvas_id': None,
-                    'sis_course_id': None,
-                    'Total Score':st.column_config.NumberColumn(step=1,format="$%d")
-                    # 'Submission Time':st.column_config.DatetimeColumn(format="D MM YY, h:mm a")
-                    })
-
-
-def display_hws(course_name: str, course: int = None):
-    scores = get_assignments_and_submissions()
+    display_paged_grid(scores, 'totals_{}'.format(course), sort_by='Total Score',
+                       highlights=mean_highlights('Total Score', mean) + [('true', 'black', 'lightgreen')], precision=0)
+
+
+@timed
+def display_hws(course_name: str, course: int = None, assignments: list = None):
+    """
+    The status of each past-due assignment of a course (assignments, if given, are the course
+    view's precomputed ones)
+    """
     if course is not None:
-        scores = scores[scores['canvas_course_id'] == course]
+        if assignments is None:
+            assignments = get_course_view(course)['assignments']
 
-        assigns = scores[['gs_assignment_id','name','due']].drop_duplicates()
+        for assignment in assignments:
+            display_hw_status(course_name, assignment['assign'], assignment['due'], assignment['submissions'], assignment)
+        st.divider()
 
-        for a,assign in assigns.iterrows():
-            df = scores[scores['gs_assignment_id']==assign['gs_assignment_id']]
+@timed
+def display_lateness(course: int) -> None:
+    """
+    How late the course's submitted work was, per assignment, and the students who were late
+    more than once
+    """
+    st.markdown('## Lateness')
 
-            if len(df):
-                due = list(df['due'].drop_duplicates())[0]
-                due_date = due
+    lateness = get_lateness_distribution(course)
+    if not len(lateness['courses']):
+        st.write('No submissions yet.')
+        return
 
-                with st.container():
-                    # Skip homework if it's not yet due!
-                    if now < due_date:
-                        continue
+    totals = lateness['courses'].iloc[0]
+    st.write('{} of {} submissions late ({}%); median {} hours late, 90th percentile {} hours.'.format(
+        int(totals['Late']), int(totals['Submitted']), totals['Late %'], totals['p50 (h)'], totals['p90 (h)']))
+    st.bar_chart(totals[LATENESS_LABELS].astype(int))
 
-                display_hw_status(course_name, assign, due_date, df)
-        st.divider()
+    display_paged_grid(lateness['assignments'], 'lateness_{}'.format(course), sort_by='due',
+                       hidden=['canvas_course_id', 'course_name'],
+                       highlights=[('params.data["Late %"] >= 20', 'black', 'mistyrose')])
+
+    st.markdown('### Late More Than Once')
+    if len(lateness['students']):
+        st.dataframe(lateness['students'].drop(columns=['canvas_course_id', 'course_name']), use_container_width=True, hide_index=True)
+    else:
+        st.write('No student was late more than once.')
+
+@timed
+def display_student_lookup() -> None:
+    """
+    Looks up students by name, email or SIS ID (or the start of one), and shows each one's
+    standing across all of their courses, then every assignment
+    """
+    query = st.text_input('Name, email or SIS ID', key='student_lookup')
+    if not query:
+        return
+
+    drilldown = get_student_drilldown(query)
+    if not len(drilldown):
+        st.write('No students match "{}".'.format(query))
+        return
+
+    st.dataframe(get_student_rollup(drilldown), use_container_width=True, hide_index=True)
+    display_paged_grid(drilldown, 'student_lookup', hidden=['email'],
+                       highlights=[('params.data["😰"]', 'black', 'pink'),
+                                   ('params.data["😅"]', 'black', 'mistyrose'),
+                                   ('params.data["✓"]', 'black', 'lightgreen')])
+
+@timed
+def display_changes() -> None:
+    """
+    The grades, statuses and extensions that the latest crawl changed
+    """
+    changes = get_changes_since_last_crawl()
+    if not len(changes):
+        st.write('Nothing changed in the latest crawl.')
+        return
+
+    counts = changes.groupby(['entity', 'change']).size()
+    st.write('; '.join('{} {} {}'.format(count, entity, change) for (entity, change), count in counts.items()))
+    display_paged_grid(changes, 'changes', sort_by=['course', 'item', 'student'], hidden=['crawl_id'],
+                       highlights=[('params.data["change"] == "deleted"', 'black', 'mistyrose'),
+                                   ('params.data["change"] == "inserted"', 'black', 'lightgreen')])
+
+def display_timings(samples: list) -> None:
+    """
+    Breakdown of where the time went in this rerun, by instrumented function
+    """
+    with st.expander('Timings for this rerun'):
+        if not len(samples):
+            st.write('No samples recorded.')
+            return
+        summary = pd.DataFrame(summarize(samples))
+        summary['ms'] = summary['seconds'] * 1000
+        st.dataframe(summary[['name', 'ms', 'calls', 'rows_in', 'rows_out', 'hits', 'misses']], use_container_width=True, hide_index=True,
+                     column_config={'ms': st.column_config.NumberColumn(format="%.1f")})
+
+def display_refresh_status(status) -> None:
+    """
+    When the data was last refreshed from the crawler database, and how long that took
+    (status is the refresher or the data service client)
+    """
+    if status is None or status.last_refresh is None:
+        return
+    st.caption('Data refreshed {} ({:.1f}s)'.format(
+        status.last_refresh.astimezone().strftime('%A, %B %d, %Y %H:%M:%S'), status.last_duration))
+    if status.last_error is not None:
+        st.caption('Last refresh failed: {}'.format(status.last_error))
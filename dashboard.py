@@ -25,14 +25,30 @@
 #################################################################################
 
 import streamlit as st
-from entities import get_course_names
+import instrumentation
+from entities import get_course_names, start_refresher, pin_store, get_refresh_status
+from entities import refresh_config, remote_store
 
-from components import display_course, display_birds_eye
-from views import get_course_student_status_summary
+from components import display_course, display_birds_eye, display_timings, display_refresh_status, display_student_lookup, display_changes
+from views import get_course_student_status_summary, warm_store, prefetch_courses
 from status_tests import is_overdue, is_near_due, is_submitted
-from database import include_canvas_data, include_gradescope_data
+from database import include_canvas_data, include_gradescope_data, databases, default_terms
 
 
+instrumentation.start_run()
+
+### The data is rebuilt in the background whenever the crawler updates the database
+### (unless it comes from the data service), and each rerun reads a single snapshot of it
+if remote_store is None and refresh_config.get('enabled', True):
+    start_refresher(warm_store)
+
+### With several semester databases, only the selected semesters are read
+terms = None
+if len(databases) > 1 and remote_store is None:
+    with st.sidebar:
+        terms = st.multiselect('Semesters', list(databases), default=default_terms)
+pin_store(terms)
+
 name = ''
 if include_gradescope_data:
     name = 'Gradescope'
@@ -64,8 +80,26 @@ st.markdown(
 with st.sidebar:
     display_birds_eye(get_course_student_status_summary(
         is_overdue, is_near_due, is_submitted))
+    display_refresh_status(get_refresh_status())
+
+# Look up a student across all of their courses
+with st.expander('Find a student'):
+    display_student_lookup()
+
+# What the latest crawl changed
+with st.expander('Changes since the last crawl'):
+    display_changes()
 
 # Display the currently selected course contents
-course_filter = st.selectbox("Select course", get_course_names())
+course_names = get_course_names()
+course_filter = st.selectbox("Select course", course_names)
+
+display_course(course_filter=course_filter)
+
+# Meanwhile, compute the courses the user is likely to switch to next
+prefetch_courses(course_filter, course_names['Course'].tolist())
 
-display_course(course_filter=course_filter)
\ No newline at end of file
+samples = instrumentation.end_run()
+if instrumentation.show_panel:
+    with st.sidebar:
+        display_timings(samples)
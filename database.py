@@ -22,13 +22,22 @@
 ##
 #################################################################################
 
+import os
 import yaml
+import logging
+import threading
 import sys, traceback
 import sqlite3
+import numpy as np
 import pandas as pd
 import sqlalchemy
 from sqlalchemy.sql import text
-from datetime import datetime
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import timed
+from queries import aligned_parts, aligned_sql, aligned_statement
+
+logger = logging.getLogger(__name__)
 
 include_gradescope_data = True
 include_canvas_data = True
@@ -46,14 +55,93 @@ with open('config.yaml') as config_file:
 
 
 # connection = sqlite3.connect("grades.db", check_same_thread=False)
-if 'db' in config:
-    data_file = config['db']
+## The crawler writes one database per semester.  db may name a single file, or list several
+## (or map term names to them), most recent first; each term is then queried separately
+databases = {}
+if 'db' not in config:
+    databases[None] = 'dashboard.db'
+elif isinstance(config['db'], dict):
+    databases = dict(config['db'])
+elif isinstance(config['db'], list):
+    databases = {os.path.splitext(os.path.basename(file))[0]: file for file in config['db']}
 else:
-    data_file = 'dashboard.db'
-dbEngine=sqlalchemy.create_engine('sqlite:///./{}'.format(data_file)) # ensure this is the correct path for the sqlite file. 
+    databases[None] = config['db']
+
+current_term = next(iter(databases))
+federated = len(databases) > 1 or current_term is not None
+
+## The terms loaded unless a view asks for others
+default_terms = config.get('terms', [current_term]) if federated else [current_term]
+
+## The aligned queries run on SQLite itself, or on DuckDB reading the same files (see columnar.py)
+query_engine = config.get('query_engine', 'sqlite')
+if query_engine == 'duckdb':
+    try:
+        import columnar
+        columnar.connect(databases)
+    except Exception as e:
+        # E.g., duckdb is not installed, or its sqlite extension cannot be downloaded
+        logger.warning('Cannot run the queries on DuckDB (%s: %s); using SQLite instead', type(e).__name__, e)
+        query_engine = 'sqlite'
+
+engines = {term: sqlalchemy.create_engine('sqlite:///./{}'.format(file)) for term, file in databases.items()}
+
+## Read-only engines for the concurrent loader (see load_aligned), which reads on several connections at once
+readonly_engines = {term: sqlalchemy.create_engine('sqlite:///file:{}?mode=ro&uri=true'.format(file)) for term, file in databases.items()}
+
+data_file = databases[current_term]
+dbEngine = engines[current_term] # ensure this is the correct path for the sqlite file. 
 
 connection = dbEngine.connect()
 
+## Separate (stdlib) connections used only to notice when the crawler has written to a database,
+## one per term, shared by every thread (the refresher, the fan-out workers and the sessions)
+version_connections = {}
+version_lock = threading.Lock()
+
+def get_terms(terms: list = None) -> list:
+    return list(default_terms) if terms is None else list(terms)
+
+def get_data_version(terms: list = None) -> tuple:
+    """
+    Changes whenever the database does: the file's modification time and size (which catch the
+    file being replaced), plus SQLite's data_version (which catches commits still in the WAL).
+    Only the databases of the given terms are checked.
+    """
+    versions = []
+    for term in get_terms(terms):
+        stats = os.stat(databases[term])
+        with version_lock:
+            if term not in version_connections:
+                version_connections[term] = sqlite3.connect('file:{}?mode=ro'.format(databases[term]), uri=True, check_same_thread=False)
+            data_version = version_connections[term].execute('pragma data_version').fetchone()[0]
+        versions.append((stats.st_mtime_ns, stats.st_size, data_version))
+    return versions[0] if len(versions) == 1 else tuple(versions)
+
+def fan_out(query: callable, terms: list = None, label: bool = True) -> pd.DataFrame:
+    """
+    Runs query(engine) against the database of each term (in parallel if there are several),
+    and concatenates the results, labelling each row with its term if there are several databases
+    """
+    terms = get_terms(terms)
+    if len(terms) == 1:
+        frames = [query(engines[terms[0]])]
+    else:
+        with ThreadPoolExecutor(max_workers=len(terms), thread_name_prefix='fan-out') as pool:
+            frames = list(pool.map(lambda term: query(engines[term]), terms))
+
+    if federated and label:
+        for term, frame in zip(terms, frames):
+            _label(frame, term)
+
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+def _label(frame: pd.DataFrame, term) -> None:
+    if 'term' in frame.columns:
+        frame['term'] = frame['term'].where(frame['term'].notna(), term)
+    else:
+        frame['term'] = term
+
 def get_gs_students() -> pd.DataFrame:
     return pd.read_sql_table("gs_students", connection)
 
@@ -61,31 +149,11 @@ def get_canvas_students() -> pd.DataFrame:
     return pd.read_sql_table("canvas_students", connection)
     # return pd.read_csv('data/canvas_students.csv')
 
-def get_aligned_students(include_gs: bool, include_canvas: bool) -> pd.DataFrame:
-    with dbEngine.connect() as connection:
-        if include_gs and include_canvas:
-            # SQLite does not support full outerjoin
-            students = pd.read_sql(sql=text("""select cast(sid as int) as gs_student_id, cast(student_id as int) as student_id, 
-                                           case when gs.name is not null then gs.name else c.name end as student, 
-                                           case when emails is not null then emails else c.email end as email, cast(user_id as int) as gs_user_id, gs.course_id as gs_course_id, lti as canvas_course_id, c.id as canvas_sid
-                                           from gs_students gs join gs_courses crs on gs.course_id=crs.cid left join canvas_students c on cast(student_id as int) = cast(sis_user_id as int)
-                                           where role like "%STUDENT"
-                                           union
-                                           select cast(null as int) as gs_student_id, cast(c.sis_user_id as int) as student_id, c.name,
-                                           c.email as email, null as gs_user_id, null as gs_course_id, c.course_id as canvas_course_id, c.id as canvas_sid
-                                           from canvas_students c
-                                           where not exists (select * from gs_students where cast(student_id as int) = cast(c.sis_user_id as int))
-                                           """), con=connection)
-        elif include_gs:
-            students = pd.read_sql(sql=text("""select cast(sid as int) as gs_student_id, cast(student_id as int) as student_id, gs.name as student, emails as email, cast(user_id as int) as gs_user_id, gs.course_id as gs_course_id, lti as canvas_course_id, null as canvas_sid
-                                           from gs_students gs join gs_courses crs on cast(gs.course_id as int)=cast(crs.cid as int)
-                                           where role like "%STUDENT"
-                                           """), con=connection)
-        else:
-            students = pd.read_sql(sql=text("""select null as gs_student_id, cast(sis_user_id as int) as student_id,name as student, email, null as gs_user_id, null as gs_course_id, course_id as canvas_course_id, c.id as canvas_sid
-                                    from canvas_students c"""), con=connection)
-
-        return students
+@timed
+def get_aligned_students(include_gs: bool, include_canvas: bool, terms: list = None) -> pd.DataFrame:
+    if query_engine == 'duckdb':
+        return columnar.get_aligned_students(databases, include_gs, include_canvas, get_terms(terms), federated)
+    return fan_out(lambda engine: _read_sql(engine, aligned_statement('students', include_gs, include_canvas)), terms)
 
 def get_gs_courses() -> pd.DataFrame:
     return pd.read_sql_table("gs_courses", connection)
@@ -94,26 +162,20 @@ def get_canvas_courses() -> pd.DataFrame:
     return pd.read_sql_table("canvas_courses", connection)
     # return pd.read_csv('data/canvas_courses.csv')
 
-def get_aligned_courses(include_gs: bool, include_canvas: bool) -> pd.DataFrame:
-    with dbEngine.connect() as connection:
-        if include_gs and include_canvas:
-            # SQLite does not support full outerjoin
-            courses = pd.read_sql(sql=text("""select cid as gs_course_id, gs.name as gs_name, c.name as canvas_name, shortname, year as term, lti as canvas_course_id, sis_course_id, start_at, end_at
-                                    from gs_courses gs left join canvas_courses c on gs.lti = c.id
-                                           union
-                                           select cid as gs_course_id, gs.name as gs_name, c.name as canvas_name, shortname, year as term, c.id as canvas_course_id, sis_course_id, start_at, end_at
-                                    from  canvas_courses c left join gs_courses gs on gs.lti = c.id"""), con=connection)
-        elif include_gs:
-            courses = pd.read_sql(sql=text("""select cid as gs_course_id, gs.name as gs_name, null as canvas_name, shortname, year as term, lti as canvas_course_id, null as sis_course_id, null as start_at, null as end_at
-                                    from gs_courses gs"""), con=connection)
-        else:
-            courses = pd.read_sql(sql=text("""select null as gs_course_id, null as gs_name, c.name as canvas_name, null as shortname, null as term, c.id as canvas_course_id, sis_course_id, start_at, end_at
-                                    from canvas_courses gs"""), con=connection)
-        
-        courses['start_at'] = courses['start_at'].apply(lambda x: datetime.strptime(x, "%Y-%m-%dT%H:%M:%SZ") if not pd.isna(x) else None)
-        courses['end_at'] = courses['end_at'].apply(lambda x: datetime.strptime(x, "%Y-%m-%dT%H:%M:%SZ") if not pd.isna(x) else None)
-        
-        return courses
+@timed
+def get_aligned_courses(include_gs: bool, include_canvas: bool, terms: list = None) -> pd.DataFrame:
+    if query_engine == 'duckdb':
+        return columnar.get_aligned_courses(databases, include_gs, include_canvas, get_terms(terms), federated)
+    return fan_out(lambda engine: _aligned_courses(engine, include_gs, include_canvas), terms)
+
+def _aligned_courses(engine, include_gs: bool, include_canvas: bool) -> pd.DataFrame:
+    return _parse_course_dates(_read_sql(engine, aligned_statement('courses', include_gs, include_canvas)))
+
+def _parse_course_dates(courses: pd.DataFrame) -> pd.DataFrame:
+    courses['start_at'] = courses['start_at'].apply(lambda x: datetime.strptime(x, "%Y-%m-%dT%H:%M:%SZ") if not pd.isna(x) else None)
+    courses['end_at'] = courses['end_at'].apply(lambda x: datetime.strptime(x, "%Y-%m-%dT%H:%M:%SZ") if not pd.isna(x) else None)
+
+    return courses
 
 def get_gs_assignments() -> pd.DataFrame:
     return pd.read_sql_table("gs_assignments", connection)
@@ -122,27 +184,20 @@ def get_canvas_assignments() -> pd.DataFrame:
     return pd.read_sql_table("canvas_assignments", connection)
     # return pd.read_csv('data/canvas_assignments.csv')
 
-def get_aligned_assignments(include_gs: bool, include_canvas: bool) -> pd.DataFrame:
-    with dbEngine.connect() as connection:
-        if include_gs and include_canvas:
-            assignments = pd.read_sql(sql=text("""select gs.id as gs_assignment_id, null as canvas_assignment_id, gs.course_id as gs_course_id, crs.lti as canvas_course_id, gs.name, strftime("%Y-%m-%dT%H:%M:%SZ", gs.assigned) as assigned, strftime("%Y-%m-%dT%H:%M:%SZ", gs.due) as due, null as canvas_max_points, "Gradescope" as source
-                                                from gs_assignments gs join gs_courses crs on gs.course_id = crs.cid
-                                                union
-                                                select null as gs_assignment_id, c.id as canvas_assignment_id, null as gs_course_id, c.course_id as canvas_course_id, c.name as name, unlock_at as assigned, due_at as due, points_possible as canvas_max_points, "Canvas" as source
-                                               from canvas_assignments c left join gs_courses crs on c.course_id = crs.lti
-                                               """), con=connection)
-        elif include_gs:
-            assignments = pd.read_sql(sql=text("""select gs.id as gs_assignment_id, null as canvas_assignment_id, gs.course_id as gs_course_id, crs.lti as canvas_course_id, gs.name, strftime("%Y-%m-%dT%H:%M:%SZ", gs.assigned) as assigned, strftime("%Y-%m-%dT%H:%M:%SZ", gs.due) as due, null as canvas_max_points, "Gradescope" as source
-                                    from gs_assignments gs join gs_courses crs on gs.course_id = crs.cid
-                                    """), con=connection)
-        else:
-            assignments = pd.read_sql(sql=text("""select null as gs_assignment_id, c.id as canvas_assignment_id, null as gs_course_id, c.course_id as canvas_course_id, c.name as name, unlock_at as assigned, due_at as due, points_possible as canvas_max_points, "Canvas" as source
-                                    from canvas_assignments c"""), con=connection)
-
-        assignments['due'] = assignments['due'].apply(lambda x: datetime.strptime(x, "%Y-%m-%dT%H:%M:%SZ") if not pd.isna(x) else None)
-        assignments['assigned'] = assignments['assigned'].apply(lambda x: datetime.strptime(x, "%Y-%m-%dT%H:%M:%SZ") if not pd.isna(x) else None)
-
-        return assignments
+@timed
+def get_aligned_assignments(include_gs: bool, include_canvas: bool, terms: list = None) -> pd.DataFrame:
+    if query_engine == 'duckdb':
+        return columnar.get_aligned_assignments(databases, include_gs, include_canvas, get_terms(terms), federated)
+    return fan_out(lambda engine: _aligned_assignments(engine, include_gs, include_canvas), terms)
+
+def _aligned_assignments(engine, include_gs: bool, include_canvas: bool) -> pd.DataFrame:
+    return _parse_assignment_dates(_read_sql(engine, aligned_statement('assignments', include_gs, include_canvas)))
+
+def _parse_assignment_dates(assignments: pd.DataFrame) -> pd.DataFrame:
+    assignments['due'] = assignments['due'].apply(lambda x: datetime.strptime(x, "%Y-%m-%dT%H:%M:%SZ") if not pd.isna(x) else None)
+    assignments['assigned'] = assignments['assigned'].apply(lambda x: datetime.strptime(x, "%Y-%m-%dT%H:%M:%SZ") if not pd.isna(x) else None)
+
+    return assignments
 
 def get_gs_submissions() -> pd.DataFrame:
     return pd.read_sql_table("gs_submissions", connection)
@@ -151,57 +206,170 @@ def get_canvas_submissions() -> pd.DataFrame:
     return pd.read_sql_table("canvas_submissions", connection)
     # return pd.read_csv('data/canvas_submissions.csv', low_memory=False)
 
-def get_aligned_submissions(include_gs: bool, include_canvas: bool) -> pd.DataFrame:
-    with dbEngine.connect() as connection:
-        if include_gs and include_canvas:
-            # student, email, [Total Score], [Max Points], Status, gs_submission_id, canvas_submission_id, [Submission Time], [Lateness (H:M:S)], student_id, 
-            # gs_assignment_id, canvas_assignment_id, gs_student_id, gs_user_id, gs_course_id, canvas_course_id
-            submissions = pd.read_sql(sql=text("""select [First Name] || " " || [Last Name] as student, Email as email, [Total Score], [Max Points], Status, 
-                                               [Submission ID] as gs_submission_id, null as canvas_submission_id, [Submission Time], null as submitted_at, due,
-                                               cast(st.student_id as int) as student_id, assign_id as gs_assignment_id, null as canvas_assignment_id, gsa.name,
-                                               cast(st.sid as int) as gs_student_id, user_id as gs_user_id,gs.course_id as gs_course_id,gsc.lti as canvas_course_id, 
-                                               case when gs.[Lateness (H:M:S)] > "00:00:00" then true else false end as late, 0 as points_deducted, gsc.shortname as course_name, "Gradescope" as source
-                                               from gs_submissions gs left join gs_students st on gs.SID = cast(st.student_id as int) left join gs_courses gsc on gs.course_id=gsc.cid left join gs_assignments gsa on gs.assign_id = gsa.id
-                                              union
-                                               select st.name as student, st.email, score as [Total Score], a.points_possible as [Max Points], 
-                                               case when graded_at is not null then "Graded" when submitted_at is not null then "Submitted" else "Missing" end as Status, 
-                                               null as gs_submission_id, s.id as canvas_submission_id, null as [Submission Time], submitted_at, a.due_at as due,
-                                               cast(sis_user_id as int) as student_id, null as gs_assignment_id, assignment_id as canvas_assignment_id, a.name, cast(gst.sid as int) as gs_student_id, 
-                                               gst.user_id as gs_user_id, gsc.cid as gs_course_id,a.course_id as canvas_course_id, late, points_deducted, gsc.shortname as course_name, "Canvas" as source
-                                               from canvas_submissions s join canvas_students st on s.user_id = st.id join canvas_assignments a on s.assignment_id = a.id 
-                                               left join gs_students gst on cast(gst.student_id as int) = sis_user_id left join gs_courses gsc on gsc.lti = a.course_id
-                                               """), con=connection)
-        elif include_gs:
-            # student, email, [Total Score], [Max Points], Status, gs_submission_id, canvas_submission_id, [Submission Time], [Lateness (H:M:S)], student_id, 
-            # gs_assignment_id, canvas_assignment_id, gs_student_id, gs_user_id, gs_course_id, canvas_course_id
-            submissions = pd.read_sql(sql=text("""select [First Name] || " " || [Last Name] as student, Email as email, [Total Score], [Max Points], Status, 
-                                               [Submission ID] as gs_submission_id, null as canvas_submission_id, [Submission Time], null as submitted_at, due,
-                                               cast(st.student_id as int) as student_id, assign_id as gs_assignment_id, null as canvas_assignment_id, gsa.name,
-                                               cast(st.sid as int) as gs_student_id, user_id as gs_user_id,gs.course_id as gs_course_id,gsc.lti as canvas_course_id, 
-                                               case when gs.[Lateness (H:M:S)] > "00:00:00" then true else false end as late, 0 as points_deducted, gsc.shortname as course_name, "Gradescope" as source
-                                               from gs_submissions gs left join gs_students st on gs.SID = cast(st.student_id as int) left join gs_courses gsc on gs.course_id=gsc.cid left join gs_assignments gsa on gs.assign_id = gsa.id
-                                    """), con=connection)
-        else:
-            # student, email, [Total Score], [Max Points], Status, gs_submission_id, canvas_submission_id, [Submission Time], [Lateness (H:M:S)], student_id,
-            # gs_assignment_id, canvas_assignment_id, gs_student_id, gs_user_id, gs_course_id, canvas_course_id
-            submissions = pd.read_sql(sql=text("""select st.name as student, st.email, score as [Total Score], a.points_possible as [Max Points], 
-                                               case when graded_at is not null then "Graded" when submitted_at is not null then "Submitted" else "Missing" end as Status, 
-                                               null as gs_submission_id, s.id as canvas_submission_id, null as [Submission Time], submitted_at, a.due_at as due,
-                                               cast(sis_user_id as int) as student_id, null as gs_assignment_id, assignment_id as canvas_assignment_id, a.name, null as gs_student_id, null as gs_user_id, 
-                                               null as gs_course_id, a.course_id as canvas_course_id, late, points_deducted, canvas_name as course_name, "Canvas" as source
-                                               from canvas_submissions s join canvas_students st on s.user_id = st.id join canvas_assignments a on s.assignment_id = a.id"""), con=connection)
-
-        submissions['Submission Time'] = submissions.apply(lambda x: datetime.strptime(x['submitted_at'], "%Y-%m-%dT%H:%M:%SZ") if not pd.isna(x['submitted_at']) else datetime.strptime(x['Submission Time'], '%Y-%m-%d %H:%M:%S %z') if not pd.isna(x['Submission Time']) else pd.NaT, axis=1)
-
-        submissions['Submission Time'] = pd.to_datetime(submissions['Submission Time'], utc=True)
-        submissions['due'] = pd.to_datetime(submissions['due'], utc=True)
-
-        return submissions.drop(columns=['submitted_at'], axis=1)
-
-
-def get_gs_extensions() -> pd.DataFrame:
-    return pd.read_sql_table("gs_extensions", connection)
-
-def get_canvas_extensions() -> pd.DataFrame:
-    return pd.read_sql_table("canvas_extensions", connection)
-    # return pd.read_csv('data/canvas_extensions.csv')
\ No newline at end of file
+@timed
+def lateness_seconds(lateness: pd.Series) -> pd.Series:
+    """
+    Parses Gradescope's lateness (H:M:S, where the hours may exceed 24) into seconds, or NaN
+    """
+    parts = lateness.astype('string').str.extract(r'^\s*(\d+):(\d+):(\d+)').astype('float64')
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+def _normalize_lateness(submissions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Replaces the raw lateness of each source with seconds_late (an integer, 0 if on time) and
+    hours_late.  Both sources measure it from the student's own deadline, i.e., after any
+    extension.  Gradescope submissions are late if their lateness is positive; Canvas keeps its
+    own late flag, which follows the course's late policy.
+    """
+    seconds = pd.to_numeric(submissions['seconds_late'], errors='coerce').fillna(lateness_seconds(submissions['Lateness (H:M:S)']))
+    seconds = seconds.fillna(0).clip(lower=0).astype('int64')
+
+    gradescope = (submissions['source'] == 'Gradescope').to_numpy()
+    canvas_late = pd.to_numeric(submissions['late'], errors='coerce').fillna(0).to_numpy() != 0
+    submissions['late'] = np.where(gradescope, seconds.to_numpy() > 0, canvas_late)
+    submissions['points_deducted'] = pd.to_numeric(submissions['points_deducted'], errors='coerce').fillna(0).astype('float64')
+    submissions['seconds_late'] = seconds
+    submissions['hours_late'] = seconds / 3600
+
+    return submissions.drop(columns=['Lateness (H:M:S)'])
+
+def _normalize_submissions(submissions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Parses the submission time (which is formatted differently by each source), the due date,
+    and the lateness
+    """
+    # Canvas's submitted_at if there is one, else Gradescope's time (with its UTC offset, which
+    # pandas' ISO parser handles much faster than an explicit %z format)
+    submissions['Submission Time'] = pd.to_datetime(submissions['submitted_at'], format="%Y-%m-%dT%H:%M:%SZ", utc=True).\
+        fillna(pd.to_datetime(submissions['Submission Time'], utc=True))
+    submissions['due'] = pd.to_datetime(submissions['due'], utc=True)
+
+    return _normalize_lateness(submissions.drop(columns=['submitted_at'], axis=1))
+
+def _read_sql(engine, sql, params: dict = None) -> pd.DataFrame:
+    with engine.connect() as connection:
+        return pd.read_sql(sql=text(sql) if isinstance(sql, str) else sql, con=connection, params=params)
+
+def _read_table(engine, table: str) -> pd.DataFrame:
+    with engine.connect() as connection:
+        return pd.read_sql_table(table, connection)
+
+@timed
+def get_aligned_submissions(include_gs: bool, include_canvas: bool, terms: list = None) -> pd.DataFrame:
+    if query_engine == 'duckdb':
+        # Dates already parsed by DuckDB
+        return _normalize_lateness(columnar.get_aligned_submissions(databases, include_gs, include_canvas, get_terms(terms), federated))
+    submissions = fan_out(lambda engine: _read_sql(engine, aligned_statement('submissions', include_gs, include_canvas)), terms)
+
+    return _normalize_submissions(submissions)
+
+def iter_aligned_submissions(include_gs: bool, include_canvas: bool, chunksize: int = 20000, terms: list = None):
+    """
+    The aligned submissions of each term, normalized like get_aligned_submissions, in chunks of at
+    most chunksize rows.  The rows are streamed from SQLite (the aligned query has no sort), so
+    only one chunk is in memory at a time.
+    """
+    for term in get_terms(terms):
+        with engines[term].connect().execution_options(stream_results=True) as connection:
+            for chunk in pd.read_sql(aligned_statement('submissions', include_gs, include_canvas), connection, chunksize=chunksize):
+                if federated:
+                    _label(chunk, term)
+                # A chunk where every score is null would otherwise hold None rather than NaN
+                yield _normalize_submissions(chunk.astype({'Total Score': 'float64', 'Max Points': 'float64'}))
+
+@timed
+def get_pending_submissions(include_gs: bool, include_canvas: bool, due_after: datetime = None, due_before: datetime = None,
+                            terms: list = None) -> pd.DataFrame:
+    """
+    Aligned submissions that still count as unsubmitted (see status_tests.is_unsubmitted), optionally
+    restricted to due dates in (due_after, due_before].  The filtering happens in SQLite, so only
+    the candidate rows are parsed by pandas.
+    """
+    where = ["(Status = 'Missing' or [Total Score] is null or [Total Score] < [Max Points] / 2.0)"]
+    params = {}
+    if due_after is not None:
+        where.append('strftime("%Y-%m-%dT%H:%M:%SZ", due) > :due_after')
+        params['due_after'] = due_after.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    if due_before is not None:
+        where.append('strftime("%Y-%m-%dT%H:%M:%SZ", due) <= :due_before')
+        params['due_before'] = due_before.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    sql = "select * from ({}) where {}".format(aligned_sql('submissions', include_gs, include_canvas), ' and '.join(where))
+    submissions = fan_out(lambda engine: _read_sql(engine, sql, params), terms)
+
+    return _normalize_submissions(submissions)
+
+
+def get_gs_extensions(terms: list = None) -> pd.DataFrame:
+    # Not labelled with the term, since extensions are merged into the (labelled) submissions
+    return fan_out(lambda engine: _read_table(engine, "gs_extensions"), terms, label=False)
+
+def get_canvas_extensions(terms: list = None) -> pd.DataFrame:
+    return fan_out(lambda engine: _read_table(engine, "canvas_extensions"), terms, label=False)
+    # return pd.read_csv('data/canvas_extensions.csv')
+
+## What the concurrent loader does with each aligned entity once its rows are read
+_parse_aligned = {'courses': _parse_course_dates, 'assignments': _parse_assignment_dates, 'submissions': _normalize_submissions}
+
+def _read_rows(engine, sql: str) -> tuple:
+    """
+    The column names and the rows of a query, read on a connection of its own (with plain
+    sqlite3 cursors, which fetch rows about twice as fast as SQLAlchemy's results)
+    """
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(sql)
+        return [column[0] for column in cursor.description], cursor.fetchall()
+    finally:
+        connection.close()
+
+def _assemble(parts: list) -> pd.DataFrame:
+    """
+    The frame holding the rows of each part in turn, built as pandas.read_sql would build it from
+    the rows of a single query (so the types are inferred over all of them)
+    """
+    rows = [row for _, part in parts for row in part]
+    return pd.DataFrame.from_records(rows, columns=parts[0][0], coerce_float=True)
+
+@timed
+def load_aligned(include_gs: bool, include_canvas: bool, terms: list = None, tables: list = None, workers: int = 8) -> dict:
+    """
+    The aligned courses, students, assignments and submissions of the given terms, plus the given
+    (unaligned) tables, keyed by name.  The reads are independent, so they are issued together
+    on a pool of threads, each half of each aligned query (see queries.aligned_parts) and each
+    table of each term on its own read-only connection; SQLite releases the GIL while it runs a
+    query, so the load takes about as long as the slowest read rather than the sum of them.  The
+    frames are the same as those of get_aligned_courses etc. and fan_out(_read_table).
+    """
+    terms = get_terms(terms)
+    tables = tables or []
+    if query_engine == 'duckdb':
+        frames = {'courses': get_aligned_courses(include_gs, include_canvas, terms),
+                  'students': get_aligned_students(include_gs, include_canvas, terms),
+                  'assignments': get_aligned_assignments(include_gs, include_canvas, terms),
+                  'submissions': get_aligned_submissions(include_gs, include_canvas, terms)}
+        for table in tables:
+            frames[table] = fan_out(lambda engine: _read_table(engine, table), terms, label=False)
+        return frames
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='load') as pool:
+        # The slowest reads are queued first, and assembled last: the small frames are parsed
+        # while the submissions are still being read
+        reads = {(entity, term): [pool.submit(_read_rows, readonly_engines[term], sql) for sql in aligned_parts(entity, include_gs, include_canvas)]
+                 for entity in ['submissions', 'students', 'assignments', 'courses'] for term in terms}
+        table_reads = {(table, term): pool.submit(_read_table, readonly_engines[term], table) for table in tables for term in terms}
+
+        frames = {}
+        for table in tables:
+            results = [table_reads[(table, term)].result() for term in terms]
+            frames[table] = results[0] if len(results) == 1 else pd.concat(results, ignore_index=True)
+
+        for entity in ['courses', 'assignments', 'students', 'submissions']:
+            results = [_assemble([read.result() for read in reads[(entity, term)]]) for term in terms]
+            if federated:
+                for term, frame in zip(terms, results):
+                    _label(frame, term)
+            frame = results[0] if len(results) == 1 else pd.concat(results, ignore_index=True)
+            frames[entity] = _parse_aligned[entity](frame) if entity in _parse_aligned else frame
+    return frames
@@ -0,0 +1,186 @@
+#################################################################################
+## dataservice.py - local read-only data service for the Penn CIS Teaching Dashboard
+##
+## Owns the database connection and the data store (kept fresh by the
+## background refresher), and serves the frames, the sidebar summary,
+## per-course grading and what the latest crawl changed as Arrow (or JSON)
+## over HTTP.  Responses carry ETags hashed from their contents, so
+## clients re-download a frame only after a crawl changed it.  Requests may name the
+## version they read (?version=), which is served from that snapshot as
+## long as it is one of the latest few.  Dashboards set
+## data_service: url in config.yaml to use it:
+##
+##    python dataservice.py --port 8503
+##    gunicorn -w 1 --threads 8 -b 127.0.0.1:8503 'dataservice:create_app()'
+##
+## Use a single worker process: each one holds its own copy of the data.
+##
+## Licensed to the Apache Software Foundation (ASF) under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  The ASF licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing,
+## software distributed under the License is distributed on an
+## "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+## KIND, either express or implied.  See the License for the
+## specific language governing permissions and limitations
+## under the License.
+##
+#################################################################################
+
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from flask import Flask, Response, abort, jsonify, request
+
+import entities
+import datastore
+from datastore import ARROW, DataStore, to_arrow
+from database import include_canvas_data, include_gradescope_data
+
+frame_names = ['courses', 'students', 'assignments', 'submissions', 'extensions', 'enrollments']
+
+## The snapshots still served to clients pinned to their version, e.g. a dashboard rerun that
+## started before the latest refresh
+kept_versions = 2
+
+def get_etag(store: DataStore, representation: str) -> str:
+    """
+    The tag of a store's data version
+    """
+    return '{}-{}'.format(hashlib.sha1(repr(store.version).encode()).hexdigest()[:16], representation)
+
+def encode(body, representation: str) -> tuple:
+    """
+    A response body, with an ETag hashed from the body itself
+    """
+    data = body if isinstance(body, bytes) else body.encode()
+    return body, '{}-{}'.format(hashlib.sha1(data).hexdigest()[:16], representation)
+
+def respond(store: DataStore, key: tuple, compute: callable, stamp = None) -> Response:
+    """
+    Serves a frame computed from the store as Arrow or JSON, depending on the Accept header.
+    The encoded body is kept with the snapshot, with an ETag hashed from its contents, so a
+    client that already has the same frame (e.g., one that a crawl left unchanged) gets a 304.
+    stamp is whatever else the frame depends on besides the data (e.g., a course's rubric),
+    which is then part of the key.
+    """
+    representation = 'arrow' if request.accept_mimetypes.best_match(['application/json', ARROW]) == ARROW else 'json'
+    if stamp is not None:
+        key = key + (stamp,)
+
+    if representation == 'arrow':
+        body, etag = store.derive(('arrow',) + key, lambda: encode(to_arrow(compute()), representation))
+        mimetype = ARROW
+    else:
+        body, etag = store.derive(('json',) + key, lambda: encode(compute().to_json(orient='split', date_format='iso'), representation))
+        mimetype = 'application/json'
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': '"{}"'.format(etag)})
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    return response
+
+def create_app() -> Flask:
+    from views import warm_store, get_course_student_status_summary, get_grading_part, grading_stamp
+    from status_tests import is_overdue, is_near_due, is_submitted
+    from changes import get_changes
+
+    # The service itself always reads the database, even if config.yaml points dashboards at it
+    entities.remote_store = None
+    snapshots = OrderedDict()
+    snapshots_lock = threading.Lock()
+
+    def on_build(store: DataStore) -> None:
+        warm_store(store)
+        with snapshots_lock:
+            snapshots[get_etag(store, 'data')] = store
+            while len(snapshots) > kept_versions:
+                snapshots.popitem(last=False)
+
+    refresher = entities.start_refresher(on_build)
+
+    app = Flask(__name__)
+
+    @app.before_request
+    def pin():
+        # One snapshot per request, as for each dashboard rerun: the requested version if given
+        version = request.args.get('version')
+        if version is None:
+            entities.pin_store()
+            return
+        with snapshots_lock:
+            store = snapshots.get(version)
+        if store is None:
+            abort(410)
+        datastore.pin(store)
+
+    @app.route('/version')
+    def version():
+        store = entities.get_store()
+        return jsonify({'version': get_etag(store, 'data'),
+                        'built_at': store.built_at.isoformat(),
+                        'last_refresh': refresher.last_refresh.isoformat() if refresher.last_refresh else None,
+                        'last_duration': refresher.last_duration,
+                        'last_error': str(refresher.last_error) if refresher.last_error else None,
+                        'gradescope': include_gradescope_data, 'canvas': include_canvas_data})
+
+    @app.route('/frames/<name>')
+    def frame(name: str):
+        if name not in frame_names:
+            abort(404)
+        store = entities.get_store()
+        canvas_course_id = request.args.get('canvas_course_id', type=int)
+        gs_course_id = request.args.get('gs_course_id', type=int)
+
+        if name in ['submissions', 'enrollments'] and (canvas_course_id is not None or gs_course_id is not None):
+            select = getattr(store, 'course_' + name)
+            return respond(store, (name, canvas_course_id, gs_course_id), lambda: select(canvas_course_id, gs_course_id))
+        return respond(store, (name,), lambda: getattr(store, name))
+
+    @app.route('/summary')
+    def summary():
+        store = entities.get_store()
+        return respond(store, ('summary',),
+                       lambda: get_course_student_status_summary(is_overdue, is_near_due, is_submitted, store))
+
+    @app.route('/changes')
+    def changes():
+        store = entities.get_store()
+        since = request.args.get('since', type=int)
+        course = request.args.get('course')
+        return respond(store, ('changes', since, course), lambda: get_changes(since, course))
+
+    @app.route('/grading')
+    def grading():
+        store = entities.get_store()
+        gs_course_id = request.args.get('gs_course_id', type=int)
+        part = request.args.get('part', 'grading')
+        courses = store.courses[store.courses['gs_course_id'] == gs_course_id]
+        if not len(courses):
+            abort(404)
+
+        def compute():
+            frame = get_grading_part(store, courses.iloc[0], part)
+            if frame is None:
+                abort(404)
+            return frame
+        # Recomputed after an edit to the course's rubric or additional-fields spreadsheet
+        return respond(store, ('grading', gs_course_id, part), compute, grading_stamp(courses.iloc[0]))
+
+    return app
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the dashboard data over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=entities.data_service_config.get('port', 8503))
+    args = parser.parse_args()
+
+    create_app().run(host=args.host, port=args.port, threaded=True)
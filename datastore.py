@@ -0,0 +1,429 @@
+#################################################################################
+## datastore.py - shared in-memory data store for the Penn CIS Teaching Dashboard
+##
+## A read-only snapshot of the entity frames (courses, students, assignments,
+## submissions, extensions and enrollments), built once per process and
+## shared by every Streamlit session without pickling or copying.  Views get
+## per-course slices of the submissions and enrollments, which are positional
+## (zero-copy) slices of the shared frames.
+##
+## A background Refresher can rebuild the store whenever the crawler's
+## database changes, and swap the new snapshot in once it is complete.
+## A RemoteStore offers the same frames, fetched from the data service
+## (dataservice.py) as RemoteSnapshots, one per data version, with
+## conditional requests.
+##
+## Licensed to the Apache Software Foundation (ASF) under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  The ASF licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing,
+## software distributed under the License is distributed on an
+## "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+## KIND, either express or implied.  See the License for the
+## specific language governing permissions and limitations
+## under the License.
+##
+#################################################################################
+
+import time
+import threading
+import traceback
+import requests
+import pyarrow as pa
+import pandas as pd
+import instrumentation
+from datetime import datetime, timezone
+
+## Columns identifying the course of a submission / enrollment row
+course_keys = ['canvas_course_id', 'gs_course_id']
+
+def sort_by_course(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Groups the rows of each course together, keeping their relative order within the course
+    """
+    return frame.sort_values(course_keys, kind='mergesort', na_position='last').reset_index(drop=True)
+
+def partition(frame: pd.DataFrame, column: str) -> dict:
+    """
+    Maps each value of the column to the rows holding it: a slice if they are contiguous
+    (so selecting them is zero-copy), or else an array of positions
+    """
+    partitions = {}
+    for key, positions in frame.groupby(column, sort=False).indices.items():
+        if positions[-1] - positions[0] + 1 == len(positions):
+            partitions[key] = slice(positions[0], positions[-1] + 1)
+        else:
+            partitions[key] = positions
+    return partitions
+
+class DataStore:
+    """
+    An immutable snapshot of the entity frames, shared by all sessions.
+
+    The frames are handed out as-is, so callers must treat them (and the per-course slices)
+    as read-only, and copy before modifying.
+    """
+    def __init__(self, courses: pd.DataFrame, students: pd.DataFrame, assignments: pd.DataFrame,
+                 submissions: pd.DataFrame, extensions: pd.DataFrame, enrollments: pd.DataFrame,
+                 version=None, terms: list = None):
+        self.version = version
+        self.terms = terms
+        self.built_at = datetime.now(timezone.utc)
+
+        self.courses = courses
+        self.students = students
+        self.assignments = assignments
+        self.extensions = extensions
+        self.submissions = sort_by_course(submissions)
+        self.enrollments = sort_by_course(enrollments)
+
+        self._derived = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+        self._partitions = {}
+        for name in ['submissions', 'enrollments']:
+            for column in course_keys:
+                self._partitions[(name, column)] = partition(getattr(self, name), column)
+
+    def _slice(self, name: str, canvas_course_id=None, gs_course_id=None) -> pd.DataFrame:
+        frame = getattr(self, name)
+        if canvas_course_id is not None:
+            rows = self._partitions[(name, 'canvas_course_id')].get(canvas_course_id)
+        elif gs_course_id is not None:
+            rows = self._partitions[(name, 'gs_course_id')].get(gs_course_id)
+        else:
+            return frame
+
+        if rows is None:
+            return frame.iloc[0:0]
+        return frame.iloc[rows]
+
+    def course_submissions(self, canvas_course_id=None, gs_course_id=None) -> pd.DataFrame:
+        """
+        The submissions of one course, by Canvas or Gradescope course ID
+        """
+        return self._slice('submissions', canvas_course_id, gs_course_id)
+
+    def course_enrollments(self, canvas_course_id=None, gs_course_id=None) -> pd.DataFrame:
+        """
+        The enrollments (submissions with extensions) of one course, by Canvas or Gradescope course ID
+        """
+        return self._slice('enrollments', canvas_course_id, gs_course_id)
+
+    def memory_usage(self) -> int:
+        """
+        Bytes held by the frames of this snapshot
+        """
+        return int(sum(getattr(self, name).memory_usage(index=True, deep=True).sum()
+                       for name in ['courses', 'students', 'assignments', 'submissions', 'extensions', 'enrollments']))
+
+    def derive(self, key, compute: callable):
+        """
+        Memoizes something computed from this snapshot (e.g., the sidebar summary), so that it is
+        computed once per snapshot no matter how many sessions ask for it
+        """
+        with self._lock:
+            if key in self._derived:
+                return self._derived[key]
+            lock = self._locks.setdefault(key, threading.Lock())
+
+        with lock:
+            if key not in self._derived:
+                self._derived[key] = compute()
+            return self._derived[key]
+
+    def discard(self, stale: callable) -> None:
+        """
+        Drops the derived results whose keys are stale (e.g., after a rubric edit)
+        """
+        with self._lock:
+            for key in [key for key in self._derived if stale(key)]:
+                del self._derived[key]
+
+## The most recently published snapshot, and the one each script run is reading
+_current = None
+_pinned = threading.local()
+
+def publish(store: DataStore) -> None:
+    """
+    Makes a (completely built) snapshot the current one; sessions already reading the previous
+    snapshot keep it until their next rerun
+    """
+    global _current
+    _current = store
+
+def current() -> DataStore:
+    return _current
+
+def pin(store: DataStore) -> None:
+    """
+    Pins a snapshot for the rest of this script run (Streamlit runs each rerun on its own thread),
+    so a refresh in the middle of a rerun can't mix data from two snapshots
+    """
+    _pinned.store = store
+
+def pinned() -> DataStore:
+    return getattr(_pinned, 'store', None)
+
+class Refresher(threading.Thread):
+    """
+    Background thread that polls the data version, and whenever it changes builds a new
+    snapshot off the request path (running on_build on it, e.g. to precompute summaries)
+    before publishing it
+    """
+    def __init__(self, build: callable, version: callable, interval: float = 5.0, on_build: callable = None):
+        super().__init__(name='datastore-refresher', daemon=True)
+        self.build = build
+        self.version = version
+        self.interval = interval
+        self.on_build = on_build
+
+        self.ready = threading.Event()
+        self.stopping = threading.Event()
+        self.last_refresh = None
+        self.last_duration = None
+        self.last_error = None
+        self.refreshes = 0
+
+    def run(self) -> None:
+        seen = None
+        while not self.stopping.is_set():
+            try:
+                version = self.version()
+                if version != seen:
+                    # Each refresh is its own "run", so its timings don't accumulate on this thread
+                    instrumentation.start_run()
+                    try:
+                        self.refresh(version)
+                    finally:
+                        instrumentation.end_run()
+                    seen = version
+            except Exception as e:
+                self.last_error = e
+                traceback.print_exc()
+            self.stopping.wait(self.interval)
+
+    def refresh(self, version=None) -> DataStore:
+        start = time.perf_counter()
+        store = self.build(version)
+        if self.on_build is not None:
+            self.on_build(store)
+        publish(store)
+
+        self.last_duration = time.perf_counter() - start
+        self.last_refresh = datetime.now(timezone.utc)
+        self.last_error = None
+        self.refreshes += 1
+        self.ready.set()
+        return store
+
+    def wait(self, timeout: float = None) -> DataStore:
+        """
+        The current snapshot, waiting for the first one to be built if necessary
+        """
+        self.ready.wait(timeout)
+        return current()
+
+    def stop(self) -> None:
+        self.stopping.set()
+
+ARROW = 'application/vnd.apache.arrow.stream'
+
+def to_arrow(frame: pd.DataFrame) -> bytes:
+    """
+    Serializes a frame as an Arrow IPC stream.  Columns mixing strings and numbers (e.g., Status,
+    which is text for Gradescope and a number for Canvas) are sent as strings.
+    """
+    try:
+        table = pa.Table.from_pandas(frame)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        frame = frame.copy()
+        for column in frame.columns[frame.dtypes == object]:
+            frame[column] = frame[column].apply(lambda x: x if pd.isna(x) else str(x))
+        table = pa.Table.from_pandas(frame)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def from_arrow(body: bytes) -> pd.DataFrame:
+    return pa.ipc.open_stream(body).read_all().to_pandas()
+
+class RemoteStore:
+    """
+    Client for the data service.  check() returns a RemoteSnapshot of the service's current data
+    version, shared by every session of this process until the service has a new one.  A new
+    snapshot asks for the frames of the previous one with their ETags, so only the frames that
+    changed are downloaded again.
+    """
+    def __init__(self, url: str, timeout: float = 120):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+        self.last_refresh = None
+        self.last_duration = None
+        self.last_error = None
+
+        self.snapshot = None
+        self._lock = threading.Lock()
+
+    def get(self, path: str, params: dict, cached: tuple = None) -> tuple:
+        """
+        The ETag and frame of a resource; cached is the (ETag, frame) the client already has, which
+        is returned as-is if the service answers that it is unchanged
+        """
+        headers = {'Accept': ARROW}
+        if cached is not None and cached[0]:
+            headers['If-None-Match'] = cached[0]
+        response = requests.get(self.url + path, params=params, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and cached is not None:
+            return cached
+        response.raise_for_status()
+        return response.headers.get('ETag'), from_arrow(response.content)
+
+    def check(self) -> 'RemoteSnapshot':
+        """
+        Picks up the service's current data version and when it was last refreshed, and returns
+        the snapshot of that version
+        """
+        response = requests.get(self.url + '/version', timeout=self.timeout)
+        response.raise_for_status()
+        status = response.json()
+
+        self.last_refresh = datetime.fromisoformat(status['last_refresh']) if status['last_refresh'] else None
+        self.last_duration = status['last_duration']
+        self.last_error = status['last_error']
+        with self._lock:
+            if self.snapshot is None or self.snapshot.version != status['version']:
+                self.snapshot = RemoteSnapshot(self, status['version'], self.snapshot)
+            return self.snapshot
+
+    def current(self) -> 'RemoteSnapshot':
+        return self.snapshot if self.snapshot is not None else self.check()
+
+class RemoteSnapshot:
+    """
+    One data version of the service: the same frames as a DataStore, each fetched (once) from the
+    service's snapshot of that version, so a rerun that pinned it never mixes two versions even if
+    the service refreshes in the middle of it.  The fetched frames are read-only like a DataStore's,
+    and go away with the snapshot, except those the next snapshot finds unchanged.
+    """
+    def __init__(self, service: RemoteStore, version: str, previous: 'RemoteSnapshot' = None):
+        self.service = service
+        self.version = version
+        self.terms = None
+        self.built_at = datetime.now(timezone.utc)
+
+        # The (ETag, frame) of each resource in the previous version, for conditional requests;
+        # each entry is dropped once asked for again
+        self._previous = dict(previous._frames) if previous is not None else {}
+        self._frames = {}
+        self._derived = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _memoize(self, name: str, key, compute: callable):
+        results = getattr(self, name)
+        with self._lock:
+            if key in results:
+                return results[key]
+            lock = self._locks.setdefault((name, key), threading.Lock())
+
+        with lock:
+            if key not in results:
+                results[key] = compute()
+            return results[key]
+
+    def fetch(self, path: str, stamp = None, **params) -> pd.DataFrame:
+        """
+        A resource of this version, fetched once.  stamp is whatever else it depends on (e.g., the
+        course's rubric), so that it is fetched again when that changes.
+        """
+        params = {key: int(value) if isinstance(value, float) and value.is_integer() else value
+                  for key, value in params.items() if value is not None and not pd.isna(value)}
+        key = (path, tuple(sorted(params.items())), stamp)
+
+        def get() -> tuple:
+            with self._lock:
+                cached = self._previous.pop(key, None)
+            return self.service.get(path, {**params, 'version': self.version}, cached)
+        return self._memoize('_frames', key, get)[1]
+
+    @property
+    def courses(self) -> pd.DataFrame:
+        return self.fetch('/frames/courses')
+
+    @property
+    def students(self) -> pd.DataFrame:
+        return self.fetch('/frames/students')
+
+    @property
+    def assignments(self) -> pd.DataFrame:
+        return self.fetch('/frames/assignments')
+
+    @property
+    def submissions(self) -> pd.DataFrame:
+        return self.fetch('/frames/submissions')
+
+    @property
+    def extensions(self) -> pd.DataFrame:
+        return self.fetch('/frames/extensions')
+
+    @property
+    def enrollments(self) -> pd.DataFrame:
+        return self.fetch('/frames/enrollments')
+
+    def course_submissions(self, canvas_course_id=None, gs_course_id=None) -> pd.DataFrame:
+        return self.fetch('/frames/submissions', canvas_course_id=canvas_course_id, gs_course_id=gs_course_id)
+
+    def course_enrollments(self, canvas_course_id=None, gs_course_id=None) -> pd.DataFrame:
+        return self.fetch('/frames/enrollments', canvas_course_id=canvas_course_id, gs_course_id=gs_course_id)
+
+    def summary(self) -> pd.DataFrame:
+        """
+        The sidebar summary, as computed by the service
+        """
+        return self.fetch('/summary')
+
+    def changes(self, since: int = None, course: str = None) -> pd.DataFrame:
+        """
+        What the crawls after since (by default, the latest crawl) changed, as recorded by the service
+        """
+        return self.fetch('/changes', since=since, course=course)
+
+    def grading(self, gs_course_id, groups: list, stamp = None) -> tuple:
+        """
+        The rubric component frames of a course, by group, and its totals, as graded by the service
+        (see views.grade_course); stamp is the rubric they were graded with
+        """
+        def part(name: str) -> pd.DataFrame:
+            return self.fetch('/grading', stamp, gs_course_id=gs_course_id, part=name)
+
+        errors = part('errors')
+        more_fields = part('more_fields')
+        return ({group: part(group) for group in groups},
+                {'students': part('total'), 'grading': part('grading'), 'errors': [errors] if len(errors) else [],
+                 'more_fields': more_fields['field'].tolist() if len(more_fields) else None})
+
+    def derive(self, key, compute: callable):
+        """
+        Memoizes something computed locally from this snapshot, as DataStore.derive does
+        """
+        return self._memoize('_derived', key, compute)
+
+    def discard(self, stale: callable) -> None:
+        with self._lock:
+            for key in [key for key in self._derived if stale(key)]:
+                del self._derived[key]
+
+    def memory_usage(self) -> int:
+        return int(sum(frame.memory_usage(index=True, deep=True).sum() for _, frame in list(self._frames.values())))
@@ -2,7 +2,8 @@
 ## entities.py - data entities for the Penn CIS Teaching Dashboard
 ##
 ## Provides interfaces to data about courses, students, assignments, submissions,
-## and extensions.  Also provides a cache for the data, to avoid repeated retrieval.
+## and extensions.  The data is loaded once into a shared, read-only store (see
+## datastore.py), to avoid repeated retrieval and per-session copies.
 ##
 ## Licensed to the Apache Software Foundation (ASF) under one
 ## or more contributor license agreements.  See the NOTICE file
@@ -25,42 +26,62 @@
 
 import streamlit as st
 import sqlite3
+import threading
 import pandas as pd
 import json
 from datetime import datetime
 from dateutil.tz import *
 from status_tests import now, date_format
-from database import include_canvas_data, include_gradescope_data
+from instrumentation import timed, timed_resource, timer
+import datastore
+from datastore import DataStore, Refresher, RemoteStore
+from database import config, include_canvas_data, include_gradescope_data, get_data_version, get_terms, default_terms
 from database import get_canvas_students, get_gs_students, get_gs_courses, get_canvas_courses
 from database import get_gs_assignments, get_canvas_assignments, get_gs_submissions, get_canvas_submissions
 from database import get_gs_extensions, get_canvas_extensions, get_aligned_courses, get_aligned_students
-from database import get_aligned_assignments, get_aligned_submissions
+from database import get_aligned_assignments, get_aligned_submissions, load_aligned
+from changes import record_changes
 
 timezone = datetime.now().astimezone().tzinfo
 # offset = timezone.utcoffset(datetime.now())
 # tzoffset = f"{offset.days * 24 + offset.seconds // 3600:+03d}:{offset.seconds % 3600 // 60:02d}"
 
-@st.cache_data
-def get_courses() -> pd.DataFrame:
+@timed
+def load_courses(terms: list = None) -> pd.DataFrame:
+    return name_courses(get_aligned_courses(include_gradescope_data, include_canvas_data, terms))
+
+def name_courses(courses: pd.DataFrame) -> pd.DataFrame:
     if include_gradescope_data:
-        return get_aligned_courses(include_gradescope_data, include_canvas_data).rename(columns={'gs_name': 'name'})
+        return courses.rename(columns={'gs_name': 'name'})
     else:
-        return get_aligned_courses(include_gradescope_data, include_canvas_data).rename(columns={'canvas_name': 'name'})
+        return courses.rename(columns={'canvas_name': 'name'})
 
-@st.cache_data
-def get_students() -> pd.DataFrame:
-    return get_aligned_students(include_gradescope_data, include_canvas_data)
+@timed
+def load_students(terms: list = None) -> pd.DataFrame:
+    return get_aligned_students(include_gradescope_data, include_canvas_data, terms)
 
-@st.cache_data
-def get_assignments() -> pd.DataFrame:
-    return get_aligned_assignments(include_gradescope_data, include_canvas_data)
+@timed
+def load_assignments(terms: list = None) -> pd.DataFrame:
+    return get_aligned_assignments(include_gradescope_data, include_canvas_data, terms)
 
-@st.cache_data
-def get_submissions(do_all = False) -> pd.DataFrame:
-    return get_aligned_submissions(include_gradescope_data, include_canvas_data)
+@timed
+def load_submissions(terms: list = None) -> pd.DataFrame:
+    return get_aligned_submissions(include_gradescope_data, include_canvas_data, terms)
 
-@st.cache_data
-def get_extensions() -> pd.DataFrame:
+@timed
+def load_extensions(terms: list = None) -> pd.DataFrame:
+    if include_gradescope_data:
+        return shape_extensions(get_gs_extensions(terms))
+    elif include_canvas_data:
+        return shape_extensions(get_canvas_extensions(terms))
+
+def extension_table() -> str:
+    """
+    The table the extensions are read from
+    """
+    return 'gs_extensions' if include_gradescope_data else 'canvas_extensions' if include_canvas_data else None
+
+def shape_extensions(extensions: pd.DataFrame) -> pd.DataFrame:
     # TODO: how do we merge homework extensions??
     if include_gradescope_data:
         # duelate = 'Release (' + timezone + ')Due (' + timezone + ')'
@@ -68,7 +89,7 @@ def get_extensions() -> pd.DataFrame:
         release = 'Release ({})'.format(timezone)
         due = 'Due ({})'.format(timezone)
         late = 'Late Due ({})'.format(timezone)
-        extensions = get_gs_extensions().\
+        extensions = extensions.\
             drop(columns=['Edit','Section', 'First & Last Name Swap', 'Last, First Name Swap', 'Sections', duelate, release, 'Time Limit','Extension Type'])
 
         extensions['Due'] = extensions[due].apply(lambda x: datetime.strptime(x, '%b %d %Y %I:%M %p') if x != '(no change)' and x != 'No late due date' and x != '--' and not pd.isnull(x) else None)
@@ -80,27 +101,7 @@ def get_extensions() -> pd.DataFrame:
         
         return extensions
     elif include_canvas_data:
-        return get_canvas_extensions().rename(columns={'id':'extension_id', 'user_id':'SID', 'assignment_id':'assign_id', 'course_id':'course_id', 'extra_attempts':'Extra Attempts', 'extra_time':'Extra Time', 'extra_credit':'Extra Credit', 'late_due_at':'Late Due', 'extended_due_at':'Extended Due', 'created_at':'Created At', 'updated_at':'Updated At', 'workflow_state':'Workflow State', 'grader_id':'Grader ID', 'grader_notes':'Grader Notes', 'grader_visible_comment':'Grader Visible Comment', 'grader_anonymous_id':'Grader Anonymous ID', 'score':'Score', 'late':'Late', 'missing':'Missing', 'seconds_late':'Seconds Late', 'entered_score':'Entered Score', 'entered_grade':'Entered Grade', 'entered_at':'Entered At', 'excused':'Excused', 'posted_at':'Posted At', 'assignment_visible':'Assignment Visible', 'excuse':'Excuse', 'late_policy_status':'Late Policy Status', 'points_deducted':'Points Deducted', 'grading_period_id':'Grading Period ID', 'late_policy_deductible':'Late Policy Deductible', 'seconds_late_deduction':'Seconds Late Deduction', 'grading_period_title':'Grading Period Title', 'late_policy_status':'Late Policy Status', 'missing_submission_type':'Missing Submission Type', 'late_policy_deductible':'Late Policy Deductible', 'seconds_late_deduction':'Seconds Late Deduction', 'grading_period_title':'Grading Period Title', 'missing_submission_type':'Missing Submission Type', 'late_policy_status':'Late Policy Status', 'missing_submission_type':'Missing Submission Type', 'late_policy_status':'Late Policy Status', 'missing_submission_type':'Missing Submission Type', 'late_policy_status':'Late Policy Status', 'missing_submission_type':'Missing Submission Type', 'late_policy_status':'Late Policy Status', 'missing_submission_type':'Missing Submission Type', 'late_policy_status':'Late Policy Status', 'missing_submission_type':'Missing Submission Type', 'late_policy_status':'Late Policy Status', 'missing_submission_type':'Missing Submission Type', 'late_policy_status':'Late Policy Status', 'missing_submission_type':'Missing Submission Type'})
-
-@st.cache_data
-def get_assignments_and_submissions() -> pd.DataFrame:
-    '''
-    Joins assignments and submissions, paying attention to course ID as well as assignment ID
-
-    Also drops some duplicates
-    '''
-
-    # st.write('Courses')
-    # st.dataframe(get_courses())
-    # st.write('Students')
-    # st.dataframe(get_students())
-    # st.write('Assignments')
-    # st.dataframe(get_assignments())
-    # st.write('Submissions')
-    # st.dataframe(get_submissions())
-
-    return get_submissions()
-
+        return extensions.rename(columns={'id':'extension_id', 'user_id':'SID', 'assignment_id':'assign_id', 'course_id':'course_id', 'extra_attempts':'Extra Attempts', 'extra_time':'Extra Time', 'extra_credit':'Extra Credit', 'late_due_at':'Late Due', 'extended_due_at':'Extended Due', 'created_at':'Created At', 'updated_at':'Updated At', 'workflow_state':'Workflow State', 'grader_id':'Grader ID', 'grader_notes':'Grader Notes', 'grader_visible_comment':'Grader Visible Comment', 'grader_anonymous_id':'Grader Anonymous ID', 'score':'Score', 'late':'Late', 'missing':'Missing', 'seconds_late':'Seconds Late', 'entered_score':'Entered Score', 'entered_grade':'Entered Grade', 'entered_at':'Entered At', 'excused':'Excused', 'posted_at':'Posted At', 'assignment_visible':'Assignment Visible', 'excuse':'Excuse', 'late_policy_status':'Late Policy Status', 'points_deducted':'Points Deducted', 'grading_period_id':'Grading Period ID', 'late_policy_deductible':'Late Policy Deductible', 'seconds_late_deduction':'Seconds Late Deduction', 'grading_period_title':'Grading Period Title', 'late_policy_status':'Late Policy Status', 'missing_submission_type':'Missing Submission Type', 'late_policy_deductible':'Late Policy Deductible', 'seconds_late_deduction':'Seconds Late Deduction', 'grading_period_title':'Grading Period Title', 'missing_submission_type':'Missing Submission Type', 'late_policy_status':'Late Policy Status', 'missing_submission_type':'Missing Submission Type', 'late_policy_status':'Late Policy Status', 'missing_submission_type':'Missing Submission Type', 'late_policy_status':'Late Policy Status', 'missing_submission_type':'Missing Submission Type', 'late_policy_status':'Late Policy Status', 'missing_submission_type':'Missing Submission Type', 'late_policy_status':'Late Policy Status', 'missing_submission_type':'Missing Submission Type', 'late_policy_status':'Late Policy Status', 'missing_submission_type':'Missing Submission Type', 'late_policy_status':'Late Policy Status', 'missing_submission_type':'Missing Submission Type'})
 
 def get_course_names():
     """
@@ -108,12 +109,11 @@ def get_course_names():
     """
     return get_courses().rename(columns={'shortname':'Course'}).set_index('gs_course_id')[['Course']].dropna()
 
-@st.cache_data
-def get_course_enrollments() -> pd.DataFrame:
+@timed
+def load_course_enrollments(enrollments: pd.DataFrame, extensions: pd.DataFrame) -> pd.DataFrame:
     """
     Information about each course, students, and submissions along with extensions
     """
-    enrollments = get_assignments_and_submissions()
 
     enrollments_no_gs = enrollments[enrollments['gs_assignment_id'].apply(lambda x: pd.isna(x))]
     enrollments_gs = enrollments[enrollments['gs_assignment_id'].apply(lambda x: not pd.isna(x))].dropna(subset=['gs_user_id'])
@@ -126,9 +126,10 @@ def get_course_enrollments() -> pd.DataFrame:
     # st.write('Enrollments')
     # st.dataframe(enrollments.head(5000))
     # print(get_extensions().dtypes)
-    enrollments_with_exts = enrollments_gs.\
-        merge(get_extensions(), left_on=['gs_user_id','gs_assignment_id','gs_course_id'], right_on=['gs_user_id_','gs_assign_id_','gs_course_id_'], how='left').\
-        drop(columns=['gs_course_id_','gs_assign_id_','gs_user_id_'])
+    with timer('entities.load_course_enrollments: merge extensions'):
+        enrollments_with_exts = enrollments_gs.\
+            merge(extensions, left_on=['gs_user_id','gs_assignment_id','gs_course_id'], right_on=['gs_user_id_','gs_assign_id_','gs_course_id_'], how='left').\
+            drop(columns=['gs_course_id_','gs_assign_id_','gs_user_id_'])
 
     # print(enrollments_with_exts.dtypes)
 
@@ -143,4 +144,140 @@ def get_course_enrollments() -> pd.DataFrame:
     
     return enrollments_with_exts
 
+## The entity frames are read concurrently (see database.load_aligned), unless concurrent is false
+load_config = config.get('load', {}) or {}
+
+def load_store(version = None, terms: list = None, concurrent: bool = None) -> DataStore:
+    """
+    Loads all of the entity frames of the given terms (by default, the configured ones) into a
+    new (read-only) data store, and records what changed since the store it replaces
+    """
+    if concurrent is None:
+        concurrent = load_config.get('concurrent', True)
+
+    if concurrent:
+        table = extension_table()
+        frames = load_aligned(include_gradescope_data, include_canvas_data, terms, [table] if table else [], load_config.get('workers', 8))
+        courses, students, assignments = name_courses(frames['courses']), frames['students'], frames['assignments']
+        submissions = frames['submissions']
+        extensions = shape_extensions(frames[table]) if table else None
+    else:
+        courses, students, assignments = load_courses(terms), load_students(terms), load_assignments(terms)
+        submissions = load_submissions(terms)
+        extensions = load_extensions(terms)
+
+    store = DataStore(courses=courses, students=students, assignments=assignments,
+                      submissions=submissions, extensions=extensions,
+                      enrollments=load_course_enrollments(submissions, extensions),
+                      version=version, terms=get_terms(terms))
+    record_changes(store, datastore.current())
+    return store
+
+refresh_config = config.get('refresh', {}) or {}
+
+## If a data service is configured, the frames come from it rather than from the database
+data_service_config = config.get('data_service', {}) or {}
+remote_store = RemoteStore(data_service_config['url']) if data_service_config.get('url') else None
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+def start_refresher(on_build: callable = None) -> Refresher:
+    """
+    Starts (once per process) the background thread that rebuilds the data store whenever the
+    crawler database changes; on_build is run on each new store before it is swapped in
+    """
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = Refresher(load_store, get_data_version, refresh_config.get('interval', 5), on_build)
+            _refresher.start()
+    return _refresher
+
+def get_refresher() -> Refresher:
+    return _refresher
+
+@timed_resource
+def get_cached_store() -> DataStore:
+    """
+    The data store, built on first use and shared by every session of this process
+    """
+    return load_store(get_data_version())
+
+@timed_resource(max_entries=4)
+def get_term_store(terms: tuple, version) -> DataStore:
+    """
+    A data store for other terms than the configured ones, e.g. for comparisons with past
+    semesters; keyed by the version so it is rebuilt after a crawl of one of those terms
+    """
+    return load_store(version, list(terms))
+
+def get_store() -> DataStore:
+    """
+    The data store for this rerun: the pinned snapshot if there is one, else the data service,
+    else the refresher's latest snapshot, else one built on first use
+    """
+    store = datastore.pinned()
+    if store is None and remote_store is not None:
+        store = remote_store.current()
+    if store is None and _refresher is not None:
+        store = _refresher.wait(refresh_config.get('timeout', 120))
+    if store is None:
+        store = get_cached_store()
+    return store
+
+def pin_store(terms: list = None) -> DataStore:
+    """
+    Called at the top of the Streamlit script, so that the whole rerun reads a single snapshot
+    even if a refresh completes in the middle of it.  Only the databases of the requested terms
+    (by default, the configured ones) are read.
+    """
+    datastore.pin(None)
+    if remote_store is not None:
+        store = remote_store.check()
+    elif terms and sorted(terms, key=str) != sorted(default_terms, key=str):
+        store = get_term_store(tuple(terms), get_data_version(terms))
+    else:
+        store = get_store()
+    datastore.pin(store)
+    return store
+
+def get_refresh_status():
+    """
+    Whatever knows when the data was last refreshed: the data service or the local refresher
+    """
+    return remote_store if remote_store is not None else _refresher
+
+def get_courses() -> pd.DataFrame:
+    return get_store().courses
+
+def get_students() -> pd.DataFrame:
+    return get_store().students
+
+def get_assignments() -> pd.DataFrame:
+    return get_store().assignments
+
+def get_submissions(do_all = False) -> pd.DataFrame:
+    return get_store().submissions
+
+def get_extensions() -> pd.DataFrame:
+    return get_store().extensions
+
+def get_assignments_and_submissions() -> pd.DataFrame:
+    '''
+    Joins assignments and submissions, paying attention to course ID as well as assignment ID
+    '''
+    return get_submissions()
 
+def get_course_submissions(canvas_course_id = None, gs_course_id = None) -> pd.DataFrame:
+    """
+    The submissions of a single course (a read-only slice of the shared frame)
+    """
+    return get_store().course_submissions(canvas_course_id, gs_course_id)
+
+def get_course_enrollments(canvas_course_id = None, gs_course_id = None) -> pd.DataFrame:
+    """
+    Information about each course, students, and submissions along with extensions, optionally
+    for a single course (a read-only slice of the shared frame)
+    """
+    return get_store().course_enrollments(canvas_course_id, gs_course_id)
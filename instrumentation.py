@@ -0,0 +1,253 @@
+#################################################################################
+## instrumentation.py - hot-path timing for the Penn CIS Teaching Dashboard
+##
+## Lightweight timing of the data pipeline: wall time, rows in / out and cache
+## hits / misses of each instrumented function, collected per script rerun.
+## Samples can be shown in the sidebar and appended to a JSONL file, or
+## accumulated into a Prometheus text file.  Enabled in config.yaml:
+##
+##    instrumentation:
+##      enabled: true
+##      panel: true
+##      export: timings.jsonl     # or timings.prom
+##      format: jsonl             # or prometheus
+##
+## When disabled, the decorators return the original functions untouched.
+##
+## Licensed to the Apache Software Foundation (ASF) under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  The ASF licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing,
+## software distributed under the License is distributed on an
+## "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+## KIND, either express or implied.  See the License for the
+## specific language governing permissions and limitations
+## under the License.
+##
+#################################################################################
+
+import os
+import json
+import time
+import uuid
+import yaml
+import threading
+import functools
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+enabled = False
+show_panel = False
+export_file = None
+export_format = 'jsonl'
+max_samples = 10000
+
+with open('config.yaml') as config_file:
+    config = yaml.safe_load(config_file)
+
+    if 'instrumentation' in config and config['instrumentation']:
+        enabled = config['instrumentation'].get('enabled', False)
+        show_panel = config['instrumentation'].get('panel', False)
+        export_file = config['instrumentation'].get('export', None)
+        export_format = config['instrumentation'].get('format', 'prometheus' if export_file and export_file.endswith('.prom') else 'jsonl')
+        max_samples = config['instrumentation'].get('max_samples', max_samples)
+
+## Each Streamlit session reruns its script on its own thread, so samples are collected per thread;
+## threads that never start a new run (e.g., pooled ones) keep only the latest max_samples
+_local = threading.local()
+
+## Running totals across all sessions, for the Prometheus exporter
+_totals = {}
+_export_lock = threading.Lock()
+
+def _samples() -> list:
+    if not hasattr(_local, 'samples'):
+        _local.samples = deque(maxlen=max_samples)
+        _local.run = None
+        _local.active = []
+    return _local.samples
+
+def count_rows(value) -> int:
+    """
+    Number of rows in a dataframe (or series), or in a list of them; None for anything else
+    """
+    if hasattr(value, 'shape') and hasattr(value, '__len__'):
+        return len(value)
+    if isinstance(value, (list, tuple)) and len(value) and all(hasattr(v, 'shape') for v in value):
+        return sum(len(v) for v in value)
+    return None
+
+def _record(name: str, seconds: float, rows_in: int = None, rows_out: int = None, cache: str = None) -> None:
+    _samples().append({'run': _local.run, 'name': name, 'seconds': seconds,
+                       'rows_in': rows_in, 'rows_out': rows_out, 'cache': cache, 'time': time.time()})
+
+def timed(fn: callable = None, name: str = None, cache: str = None) -> callable:
+    """
+    Decorator recording the wall time of each call, along with the number of rows in the
+    dataframe arguments and in the result
+    """
+    if fn is None:
+        return lambda f: timed(f, name, cache)
+    if not enabled:
+        return fn
+
+    label = name or '{}.{}'.format(fn.__module__, fn.__qualname__)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        _samples()
+        rows_in = [count_rows(arg) for arg in list(args) + list(kwargs.values())]
+        rows_in = [rows for rows in rows_in if rows is not None]
+        frame = {'cache': cache}
+        _local.active.append(frame)
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            _local.active.pop()
+        _record(label, elapsed, sum(rows_in) if rows_in else None, count_rows(result), frame['cache'])
+        return result
+
+    return wrapper
+
+def timed_cache(fn: callable = None, **cache_args) -> callable:
+    """
+    Drop-in replacement for st.cache_data that also records timings, and whether each call
+    was served from the cache
+    """
+    import streamlit as st
+
+    if fn is None:
+        return lambda f: timed_cache(f, **cache_args)
+    return _timed_cached(st.cache_data, fn, **cache_args)
+
+def timed_resource(fn: callable = None, **cache_args) -> callable:
+    """
+    Drop-in replacement for st.cache_resource that also records timings and cache hits / misses
+    """
+    import streamlit as st
+
+    if fn is None:
+        return lambda f: timed_resource(f, **cache_args)
+    return _timed_cached(st.cache_resource, fn, **cache_args)
+
+def _timed_cached(cache: callable, fn: callable, **cache_args) -> callable:
+    if not enabled:
+        return cache(fn, **cache_args)
+
+    @functools.wraps(fn)
+    def body(*args, **kwargs):
+        # Streamlit only runs the body on a cache miss
+        if len(getattr(_local, 'active', [])):
+            _local.active[-1]['cache'] = 'miss'
+        return fn(*args, **kwargs)
+
+    cached = cache(body, **cache_args)
+    wrapper = timed(cached, '{}.{}'.format(fn.__module__, fn.__qualname__), cache='hit')
+    wrapper.clear = cached.clear
+    return wrapper
+
+def timer(name: str):
+    """
+    Context manager timing a block within a function, e.g. a merge or a Styler render
+    """
+    if not enabled:
+        return nullcontext()
+    return _timer(name)
+
+@contextmanager
+def _timer(name: str):
+    _samples()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - start)
+
+def start_run() -> None:
+    """
+    Called at the top of the Streamlit script: starts collecting samples for a new rerun
+    """
+    if enabled:
+        _samples()
+        _local.samples = deque(maxlen=max_samples)
+        _local.run = uuid.uuid4().hex[:8]
+
+def end_run() -> list:
+    """
+    Called at the end of the Streamlit script: exports and returns the samples for this rerun
+    """
+    if not enabled:
+        return []
+    samples = list(_samples())
+    if export_file:
+        export(samples)
+    return samples
+
+def summarize(samples: list) -> list:
+    """
+    Aggregates the samples of a rerun by function: calls, total time, rows and cache hits / misses
+    """
+    summary = {}
+    for sample in samples:
+        entry = summary.setdefault(sample['name'], {'name': sample['name'], 'calls': 0, 'seconds': 0.0,
+                                                    'rows_in': 0, 'rows_out': 0, 'hits': 0, 'misses': 0})
+        entry['calls'] += 1
+        entry['seconds'] += sample['seconds']
+        entry['rows_in'] += sample['rows_in'] or 0
+        entry['rows_out'] += sample['rows_out'] or 0
+        if sample['cache'] == 'hit':
+            entry['hits'] += 1
+        elif sample['cache'] == 'miss':
+            entry['misses'] += 1
+    return sorted(summary.values(), key=lambda x: x['seconds'], reverse=True)
+
+def export(samples: list) -> None:
+    if export_format == 'prometheus':
+        export_prometheus(samples)
+    else:
+        export_jsonl(samples)
+
+def export_jsonl(samples: list) -> None:
+    """
+    Appends one JSON line per sample
+    """
+    with _export_lock, open(export_file, 'a') as output:
+        for sample in samples:
+            output.write(json.dumps(sample) + '\n')
+
+def export_prometheus(samples: list) -> None:
+    """
+    Adds the samples to the running totals and rewrites the text file (in the format read by
+    node_exporter's textfile collector)
+    """
+    with _export_lock:
+        for entry in summarize(samples):
+            total = _totals.setdefault(entry['name'], {'calls': 0, 'seconds': 0.0, 'rows_in': 0, 'rows_out': 0, 'hits': 0, 'misses': 0})
+            for key in total:
+                total[key] += entry[key]
+
+        lines = []
+        for metric, key, help in [('dashboard_function_calls_total', 'calls', 'Calls of each instrumented function'),
+                                  ('dashboard_function_seconds_total', 'seconds', 'Wall time spent in each instrumented function'),
+                                  ('dashboard_function_rows_in_total', 'rows_in', 'Dataframe rows passed to each instrumented function'),
+                                  ('dashboard_function_rows_out_total', 'rows_out', 'Dataframe rows returned by each instrumented function'),
+                                  ('dashboard_function_cache_hits_total', 'hits', 'Cache hits of each cached function'),
+                                  ('dashboard_function_cache_misses_total', 'misses', 'Cache misses of each cached function')]:
+            lines.append('# HELP {} {}'.format(metric, help))
+            lines.append('# TYPE {} counter'.format(metric))
+            for name, total in sorted(_totals.items()):
+                lines.append('{}{{function="{}"}} {}'.format(metric, name.replace('"', '\\"'), total[key]))
+
+        temp_file = export_file + '.tmp'
+        with open(temp_file, 'w') as output:
+            output.write('\n'.join(lines) + '\n')
+        os.replace(temp_file, export_file)
@@ -0,0 +1,103 @@
+#################################################################################
+## legacy_queries.py - the hand-written aligned queries, before queries.py
+##
+## Kept only so that benchmark.py can check that the query builder returns
+## the same rows as these did, and time the difference.  Keyed by entity and
+## (include Gradescope, include Canvas).  The Canvas-only courses and
+## submissions queries never ran (they named a missing alias and a missing
+## column); they are corrected here so those variants are compared too.
+##
+## Licensed to the Apache Software Foundation (ASF) under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  The ASF licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing,
+## software distributed under the License is distributed on an
+## "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+## KIND, either express or implied.  See the License for the
+## specific language governing permissions and limitations
+## under the License.
+##
+#################################################################################
+
+LEGACY_ALIGNED_SQL = {
+    'students': {
+        (True, True): """select cast(sid as int) as gs_student_id, cast(student_id as int) as student_id, 
+                                           case when gs.name is not null then gs.name else c.name end as student, 
+                                           case when emails is not null then emails else c.email end as email, cast(user_id as int) as gs_user_id, gs.course_id as gs_course_id, lti as canvas_course_id, c.id as canvas_sid
+                                           from gs_students gs join gs_courses crs on gs.course_id=crs.cid left join canvas_students c on cast(student_id as int) = cast(sis_user_id as int)
+                                           where role like "%STUDENT"
+                                           union
+                                           select cast(null as int) as gs_student_id, cast(c.sis_user_id as int) as student_id, c.name,
+                                           c.email as email, null as gs_user_id, null as gs_course_id, c.course_id as canvas_course_id, c.id as canvas_sid
+                                           from canvas_students c
+                                           where not exists (select * from gs_students where cast(student_id as int) = cast(c.sis_user_id as int))
+                                           """,
+        (True, False): """select cast(sid as int) as gs_student_id, cast(student_id as int) as student_id, gs.name as student, emails as email, cast(user_id as int) as gs_user_id, gs.course_id as gs_course_id, lti as canvas_course_id, null as canvas_sid
+                                           from gs_students gs join gs_courses crs on cast(gs.course_id as int)=cast(crs.cid as int)
+                                           where role like "%STUDENT"
+                                           """,
+        (False, True): """select null as gs_student_id, cast(sis_user_id as int) as student_id,name as student, email, null as gs_user_id, null as gs_course_id, course_id as canvas_course_id, c.id as canvas_sid
+                                    from canvas_students c""",
+    },
+    'courses': {
+        (True, True): """select cid as gs_course_id, gs.name as gs_name, c.name as canvas_name, shortname, year as term, lti as canvas_course_id, sis_course_id, start_at, end_at
+                                    from gs_courses gs left join canvas_courses c on gs.lti = c.id
+                                           union
+                                           select cid as gs_course_id, gs.name as gs_name, c.name as canvas_name, shortname, year as term, c.id as canvas_course_id, sis_course_id, start_at, end_at
+                                    from  canvas_courses c left join gs_courses gs on gs.lti = c.id""",
+        (True, False): """select cid as gs_course_id, gs.name as gs_name, null as canvas_name, shortname, year as term, lti as canvas_course_id, null as sis_course_id, null as start_at, null as end_at
+                                    from gs_courses gs""",
+        (False, True): """select null as gs_course_id, null as gs_name, c.name as canvas_name, null as shortname, null as term, c.id as canvas_course_id, sis_course_id, start_at, end_at
+                                    from canvas_courses c""",
+    },
+    'assignments': {
+        (True, True): """select gs.id as gs_assignment_id, null as canvas_assignment_id, gs.course_id as gs_course_id, crs.lti as canvas_course_id, gs.name, strftime("%Y-%m-%dT%H:%M:%SZ", gs.assigned) as assigned, strftime("%Y-%m-%dT%H:%M:%SZ", gs.due) as due, null as canvas_max_points, "Gradescope" as source
+                                                from gs_assignments gs join gs_courses crs on gs.course_id = crs.cid
+                                                union
+                                                select null as gs_assignment_id, c.id as canvas_assignment_id, null as gs_course_id, c.course_id as canvas_course_id, c.name as name, unlock_at as assigned, due_at as due, points_possible as canvas_max_points, "Canvas" as source
+                                               from canvas_assignments c left join gs_courses crs on c.course_id = crs.lti
+                                               """,
+        (True, False): """select gs.id as gs_assignment_id, null as canvas_assignment_id, gs.course_id as gs_course_id, crs.lti as canvas_course_id, gs.name, strftime("%Y-%m-%dT%H:%M:%SZ", gs.assigned) as assigned, strftime("%Y-%m-%dT%H:%M:%SZ", gs.due) as due, null as canvas_max_points, "Gradescope" as source
+                                    from gs_assignments gs join gs_courses crs on gs.course_id = crs.cid
+                                    """,
+        (False, True): """select null as gs_assignment_id, c.id as canvas_assignment_id, null as gs_course_id, c.course_id as canvas_course_id, c.name as name, unlock_at as assigned, due_at as due, points_possible as canvas_max_points, "Canvas" as source
+                                    from canvas_assignments c""",
+    },
+    'submissions': {
+        (True, True): """select [First Name] || " " || [Last Name] as student, Email as email, [Total Score], [Max Points], Status, 
+                                           [Submission ID] as gs_submission_id, null as canvas_submission_id, [Submission Time], null as submitted_at, due,
+                                           cast(st.student_id as int) as student_id, assign_id as gs_assignment_id, null as canvas_assignment_id, gsa.name,
+                                           cast(st.sid as int) as gs_student_id, user_id as gs_user_id,gs.course_id as gs_course_id,gsc.lti as canvas_course_id, 
+                                           case when gs.[Lateness (H:M:S)] > "00:00:00" then true else false end as late, 0 as points_deducted, gsc.shortname as course_name, "Gradescope" as source
+                                           from gs_submissions gs left join gs_students st on gs.SID = cast(st.student_id as int) left join gs_courses gsc on gs.course_id=gsc.cid left join gs_assignments gsa on gs.assign_id = gsa.id
+                                          union
+                                           select st.name as student, st.email, score as [Total Score], a.points_possible as [Max Points], 
+                                           case when graded_at is not null then "Graded" when submitted_at is not null then "Submitted" else "Missing" end as Status, 
+                                           null as gs_submission_id, s.id as canvas_submission_id, null as [Submission Time], submitted_at, a.due_at as due,
+                                           cast(sis_user_id as int) as student_id, null as gs_assignment_id, assignment_id as canvas_assignment_id, a.name, cast(gst.sid as int) as gs_student_id, 
+                                           gst.user_id as gs_user_id, gsc.cid as gs_course_id,a.course_id as canvas_course_id, late, points_deducted, gsc.shortname as course_name, "Canvas" as source
+                                           from canvas_submissions s join canvas_students st on s.user_id = st.id join canvas_assignments a on s.assignment_id = a.id 
+                                           left join gs_students gst on cast(gst.student_id as int) = sis_user_id left join gs_courses gsc on gsc.lti = a.course_id
+                                           """,
+        (True, False): """select [First Name] || " " || [Last Name] as student, Email as email, [Total Score], [Max Points], Status, 
+                                           [Submission ID] as gs_submission_id, null as canvas_submission_id, [Submission Time], null as submitted_at, due,
+                                           cast(st.student_id as int) as student_id, assign_id as gs_assignment_id, null as canvas_assignment_id, gsa.name,
+                                           cast(st.sid as int) as gs_student_id, user_id as gs_user_id,gs.course_id as gs_course_id,gsc.lti as canvas_course_id, 
+                                           case when gs.[Lateness (H:M:S)] > "00:00:00" then true else false end as late, 0 as points_deducted, gsc.shortname as course_name, "Gradescope" as source
+                                           from gs_submissions gs left join gs_students st on gs.SID = cast(st.student_id as int) left join gs_courses gsc on gs.course_id=gsc.cid left join gs_assignments gsa on gs.assign_id = gsa.id
+                                """,
+        (False, True): """select st.name as student, st.email, score as [Total Score], a.points_possible as [Max Points], 
+                                           case when graded_at is not null then "Graded" when submitted_at is not null then "Submitted" else "Missing" end as Status, 
+                                           null as gs_submission_id, s.id as canvas_submission_id, null as [Submission Time], submitted_at, a.due_at as due,
+                                           cast(sis_user_id as int) as student_id, null as gs_assignment_id, assignment_id as canvas_assignment_id, a.name, null as gs_student_id, null as gs_user_id, 
+                                           null as gs_course_id, a.course_id as canvas_course_id, late, points_deducted, (select name from canvas_courses where id = a.course_id) as course_name, "Canvas" as source
+                                           from canvas_submissions s join canvas_students st on s.user_id = st.id join canvas_assignments a on s.assignment_id = a.id""",
+    },
+}
@@ -0,0 +1,224 @@
+#################################################################################
+## loadtest.py - multi-session load test for the Penn CIS Teaching Dashboard
+##
+## Drives dashboard.py headlessly with many simulated sessions at once, as at
+## the start of a semester, against a synthetic crawler database (see
+## synthetic_data.py).  Each session is a Streamlit AppTest on its own thread
+## of one process, as sessions are on a Streamlit server: it opens the
+## dashboard, then repeatedly switches to another course and changes a grade
+## threshold (in assign_grades).  For each number of sessions, in a fresh
+## process, it reports the p50 / p95 rerun latency, the throughput (reruns
+## per second) and the peak memory:
+##
+##    python loadtest.py --scale small --sessions 1,2,4,8 --steps 5
+##    python loadtest.py --data path/to/dir --output load.json   # an existing dashboard.db and config.yaml
+##
+## Licensed to the Apache Software Foundation (ASF) under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  The ASF licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing,
+## software distributed under the License is distributed on an
+## "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+## KIND, either express or implied.  See the License for the
+## specific language governing permissions and limitations
+## under the License.
+##
+#################################################################################
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timezone
+
+import synthetic_data
+from benchmark import SCALES, get_commit
+
+DASHBOARD = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dashboard.py')
+
+## The grade threshold each session edits, and the values it cycles through
+THRESHOLD = 'B ≥'
+THRESHOLD_VALUES = ['83', '84', '85', '82']
+
+def percentile(samples: list, fraction: float) -> float:
+    """
+    The given percentile of the samples (nearest rank)
+    """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+class MemorySampler(threading.Thread):
+    """
+    Samples the resident memory of this process, keeping the peak
+    """
+    def __init__(self, interval: float = 0.05):
+        import psutil
+
+        super().__init__(name='loadtest-memory', daemon=True)
+        self.process = psutil.Process()
+        self.interval = interval
+        self.peak = self.process.memory_info().rss
+        self.stopping = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopping.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self.stopping.wait(self.interval)
+
+    def stop(self) -> int:
+        self.stopping.set()
+        self.join()
+        return max(self.peak, self.process.memory_info().rss)
+
+def run_session(session: int, steps: int, timeout: float, samples: list, errors: list) -> None:
+    """
+    One simulated user: opens the dashboard, then for each step switches course and changes a
+    grade threshold, recording the latency of each rerun
+    """
+    from streamlit.testing.v1 import AppTest
+
+    def rerun(action: str, run: callable) -> None:
+        start = time.perf_counter()
+        app = run()
+        samples.append({'session': session, 'action': action, 'seconds': time.perf_counter() - start})
+        if len(app.exception):
+            errors.append({'session': session, 'action': action, 'error': app.exception[0].message})
+
+    at = AppTest.from_file(DASHBOARD, default_timeout=timeout)
+    rerun('open', at.run)
+    for step in range(steps):
+        select = [widget for widget in at.selectbox if widget.label == 'Select course']
+        if select and select[0].options:
+            options = select[0].options
+            rerun('select course', select[0].select(options[(session + step + 1) % len(options)]).run)
+
+        # Only courses with a rubric have grade thresholds
+        threshold = [widget for widget in at.text_input if widget.label == THRESHOLD]
+        if threshold:
+            rerun('change threshold', threshold[0].set_value(THRESHOLD_VALUES[(session + step) % len(THRESHOLD_VALUES)]).run)
+
+def run_worker(result_file: str, sessions: int, steps: int, timeout: float) -> None:
+    """
+    Runs inside the directory holding the synthetic config.yaml: opens the dashboard once (so the
+    data is loaded), then runs the sessions concurrently
+    """
+    import resource
+    from streamlit.testing.v1 import AppTest
+
+    sampler = MemorySampler()
+    baseline = sampler.peak
+    sampler.start()
+
+    start = time.perf_counter()
+    warmup = AppTest.from_file(DASHBOARD, default_timeout=timeout).run()
+    warmup_seconds = time.perf_counter() - start
+    warm = sampler.process.memory_info().rss
+
+    samples, errors = [], []
+    threads = [threading.Thread(target=run_session, args=(session, steps, timeout, samples, errors), name='session-{}'.format(session))
+               for session in range(sessions)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    peak = sampler.stop()
+
+    latencies = [sample['seconds'] for sample in samples]
+    by_action = {}
+    for sample in samples:
+        by_action.setdefault(sample['action'], []).append(sample['seconds'])
+
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    with open(result_file, 'w') as output:
+        json.dump({'sessions': sessions, 'steps': steps, 'reruns': len(samples), 'seconds': elapsed,
+                   'throughput': len(samples) / elapsed if elapsed else None,
+                   'p50': percentile(latencies, 0.5), 'p95': percentile(latencies, 0.95), 'max': max(latencies) if latencies else None,
+                   'actions': {action: {'reruns': len(values), 'p50': percentile(values, 0.5), 'p95': percentile(values, 0.95)}
+                               for action, values in by_action.items()},
+                   'warmup_seconds': warmup_seconds, 'warmup_errors': len(warmup.exception),
+                   'baseline_rss_bytes': baseline, 'warm_rss_bytes': warm, 'peak_rss_bytes': max(peak, max_rss),
+                   'errors': errors}, output)
+
+def run_level(directory: str, sessions: int, steps: int, timeout: float) -> dict:
+    """
+    Runs one number of sessions in a fresh interpreter, so each level starts from the same memory
+    """
+    result_file = os.path.join(directory, 'load-{}.json'.format(sessions))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.abspath(__file__)), os.environ.get('PYTHONPATH', '')]))
+    worker = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', result_file, '--sessions', str(sessions),
+                             '--steps', str(steps), '--timeout', str(timeout)],
+                            cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if worker.returncode != 0:
+        raise RuntimeError('Load test worker failed with {} sessions:\n{}'.format(sessions, worker.stderr[-2000:]))
+
+    with open(result_file) as measurements:
+        return json.load(measurements)
+
+def report(result: dict) -> None:
+    print('{:>8} {:>7} {:>8.2f} {:>8.2f} {:>8.2f} {:>10.2f} {:>10.1f} {:>7}'.format(
+        result['sessions'], result['reruns'], result['p50'], result['p95'], result['max'], result['throughput'],
+        result['peak_rss_bytes'] / 2**20, len(result['errors'])), file=sys.stderr)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the dashboard with concurrent simulated sessions')
+    parser.add_argument('--scale', default='small', help='synthetic data scale: {}'.format(', '.join(SCALES)))
+    parser.add_argument('--data', default=None, help='directory with an existing dashboard.db and config.yaml (instead of generating one)')
+    parser.add_argument('--sessions', default='1,2,4,8', help='comma-separated numbers of concurrent sessions')
+    parser.add_argument('--steps', type=int, default=5, help='course switches (each followed by a threshold change) per session')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds allowed for each rerun')
+    parser.add_argument('--output', default=None, help='JSON file for the results (default: stdout)')
+    parser.add_argument('--keep', action='store_true', help='keep the generated database')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, int(args.sessions), args.steps, args.timeout)
+        sys.exit(0)
+
+    directory = args.data
+    if directory is None:
+        directory = tempfile.mkdtemp(prefix='dashboard-load-{}-'.format(args.scale))
+        print('Generating {} data {}'.format(args.scale, SCALES[args.scale]), file=sys.stderr)
+        rubric = synthetic_data.generate(os.path.join(directory, 'dashboard.db'), **SCALES[args.scale])
+        synthetic_data.write_config(directory, 'dashboard.db', rubric)
+
+    results = {'commit': get_commit(), 'timestamp': datetime.now(timezone.utc).isoformat(),
+               'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+               'scale': None if args.data else args.scale, 'results': []}
+    try:
+        print('{:>8} {:>7} {:>8} {:>8} {:>8} {:>10} {:>10} {:>7}'.format(
+            'sessions', 'reruns', 'p50 (s)', 'p95 (s)', 'max (s)', 'reruns/s', 'peak MB', 'errors'), file=sys.stderr)
+        for sessions in [int(count) for count in args.sessions.split(',')]:
+            results['results'].append(run_level(directory, sessions, args.steps, args.timeout))
+            report(results['results'][-1])
+    finally:
+        if args.data is None:
+            if args.keep:
+                print('Kept {}'.format(directory), file=sys.stderr)
+            else:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
@@ -0,0 +1,196 @@
+#################################################################################
+## prefetch.py - background prefetch of course pages for the Penn CIS Teaching Dashboard
+##
+## Staff who manage several sections switch between courses in the course
+## selector all the time.  Once a course page has rendered, the per-course
+## results of the other courses in the selector (rubric scores, student
+## totals and each assignment's status table) are computed on a small thread
+## pool, nearest courses first, so that switching to one of them renders from
+## cache.  The results are kept in an LRU cache bounded by the memory their
+## frames use.  Configured in config.yaml:
+##
+##    prefetch:
+##      enabled: true
+##      workers: 2
+##      max_mb: 256
+##
+## Licensed to the Apache Software Foundation (ASF) under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  The ASF licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing,
+## software distributed under the License is distributed on an
+## "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+## KIND, either express or implied.  See the License for the
+## specific language governing permissions and limitations
+## under the License.
+##
+#################################################################################
+
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+import instrumentation
+from database import config
+
+prefetch_config = config.get('prefetch', {}) or {}
+
+def size_of(value) -> int:
+    """
+    Bytes held by the frames and arrays in a (nested) result
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(size_of(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(size_of(item) for item in value)
+    return 0
+
+class LRUCache:
+    """
+    Results kept by key, least recently used evicted first once their frames use more than
+    max_bytes in total
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][0]
+
+    def put(self, key, value) -> None:
+        size = size_of(value)
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def discard(self, stale: callable) -> None:
+        """
+        Drops the results whose keys are stale (e.g., after a rubric edit)
+        """
+        with self._lock:
+            for key in [key for key in self._entries if stale(key)]:
+                self.bytes -= self._entries.pop(key)[1]
+
+class Prefetcher:
+    """
+    Computes results on a bounded thread pool into an LRU cache, each key at most once at a time.
+    Only the latest batch of requests is worked on: when the user switches courses, the courses
+    queued for the previous one are dropped.
+    """
+    def __init__(self, cache: LRUCache, workers: int = 2):
+        self.cache = cache
+        self.prefetched = 0
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self._pending = {}
+        self._requested = {}
+        self._batch = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, compute: callable):
+        """
+        The cached result, or else computes (and caches) it now
+        """
+        result = self.cache.get(key)
+        if result is None:
+            # If it is being prefetched right now, wait for that rather than compute it twice
+            with self._lock:
+                future = self._pending.get(key)
+            if future is not None and future.running():
+                future.result()
+                result = self.cache.get(key)
+        if result is None:
+            result = compute()
+            self.cache.put(key, result)
+        return result
+
+    def prefetch(self, requests: list) -> None:
+        """
+        Queues (key, compute) requests, in order of priority, for those not already cached or queued
+        """
+        with self._lock:
+            self._batch += 1
+            batch = self._batch
+            for key, compute in requests:
+                if key in self.cache:
+                    continue
+                self._requested[key] = batch
+                if key in self._pending:
+                    continue
+                self._pending[key] = self._executor.submit(self._run, key, compute)
+
+    def _run(self, key, compute: callable) -> None:
+        try:
+            if self._requested.get(key) != self._batch or key in self.cache:
+                return
+            # Each prefetch is its own "run", so its timings don't accumulate on the worker thread
+            instrumentation.start_run()
+            try:
+                self.cache.put(key, compute())
+                self.prefetched += 1
+            finally:
+                instrumentation.end_run()
+        except Exception:
+            # Only a prefetch: the page computes it again (and shows the error) when it is opened
+            traceback.print_exc()
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+                self._requested.pop(key, None)
+
+course_cache = LRUCache(prefetch_config.get('max_mb', 256) * 1024 * 1024)
+prefetcher = Prefetcher(course_cache, prefetch_config.get('workers', 2))
+
+def nearest_first(options: list, selected) -> list:
+    """
+    The other options of a selector, those next to the selected one first
+    """
+    options = list(options)
+    if selected not in options:
+        return options
+    index = options.index(selected)
+    after, before = options[index + 1:], options[:index][::-1]
+    return [option for pair in zip(after, before) for option in pair] + after[len(before):] + before[len(after):]
@@ -0,0 +1,212 @@
+#################################################################################
+## queries.py - aligned query builder for the Penn CIS Teaching Dashboard
+##
+## The aligned (Gradescope + Canvas) queries in database.py are composed from
+## a Gradescope half and a Canvas half, according to which sources are shown.
+## Each half gives an expression for every output column and the tables it
+## reads.  The halves never produce the same row (they differ in source, or
+## in which IDs are null), so they are combined with UNION ALL rather than
+## UNION, which would sort and compare every column of every row.  Instead,
+## where a join can repeat a row (e.g., a student on several course rosters),
+## the joined table is first reduced to the distinct keys and columns it
+## contributes.
+##
+## The same specs build the SQL for SQLite and for DuckDB (see columnar.py), so
+## they are written in the SQL both understand: 'text' literals, "quoted"
+## identifiers and bigint casts; the few expressions that differ are declared
+## per dialect.
+##
+## Licensed to the Apache Software Foundation (ASF) under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  The ASF licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing,
+## software distributed under the License is distributed on an
+## "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+## KIND, either express or implied.  See the License for the
+## specific language governing permissions and limitations
+## under the License.
+##
+#################################################################################
+
+import functools
+from sqlalchemy.sql import text
+
+## Rosters reduced to the columns the joins use, so a student on several rosters matches once
+GS_ROSTER = '(select distinct cast(student_id as bigint) as student_id, sid, user_id from gs_students)'
+CANVAS_ROSTER = '(select distinct id, cast(sis_user_id as bigint) as sis_user_id, name, email from canvas_students)'
+GS_LTI = '(select distinct lti, cid, shortname from gs_courses)'
+
+## For each entity: its output columns, and for each source the expression of each column, the
+## tables it reads, and a filter.  'combined' holds what changes when the other source is also
+## shown, e.g., Gradescope students fall back to their Canvas name and email.  'order' sorts
+## the (small) result the way the UNION used to, since it is shown as-is.
+ALIGNED = {
+    'students': {
+        'columns': ['gs_student_id', 'student_id', 'student', 'email', 'gs_user_id', 'gs_course_id', 'canvas_course_id', 'canvas_sid'],
+        'order': True,
+        'gradescope': {
+            'select': {'gs_student_id': 'cast(sid as bigint)', 'student_id': 'cast(gs.student_id as bigint)', 'student': 'gs.name',
+                       'email': 'emails', 'gs_user_id': 'cast(user_id as bigint)', 'gs_course_id': 'gs.course_id',
+                       'canvas_course_id': 'lti', 'canvas_sid': 'null'},
+            'from': 'gs_students gs join gs_courses crs on gs.course_id=crs.cid',
+            'where': "role like '%STUDENT'",
+            # SQLite's like ignores case
+            'duckdb': {
+                'where': "role ilike '%STUDENT'",
+            },
+            'combined': {
+                'select': {'student': 'case when gs.name is not null then gs.name else c.name end',
+                           'email': 'case when emails is not null then emails else c.email end',
+                           'canvas_sid': 'c.id'},
+                'from': 'gs_students gs join gs_courses crs on gs.course_id=crs.cid left join {} c on cast(gs.student_id as bigint) = c.sis_user_id'.format(CANVAS_ROSTER),
+            },
+        },
+        'canvas': {
+            'select': {'gs_student_id': 'null', 'student_id': 'cast(c.sis_user_id as bigint)', 'student': 'c.name', 'email': 'c.email',
+                       'gs_user_id': 'null', 'gs_course_id': 'null', 'canvas_course_id': 'c.course_id', 'canvas_sid': 'c.id'},
+            'from': 'canvas_students c',
+            'combined': {
+                'where': 'not exists (select * from gs_students where cast(student_id as bigint) = cast(c.sis_user_id as bigint))',
+            },
+        },
+    },
+    'courses': {
+        'columns': ['gs_course_id', 'gs_name', 'canvas_name', 'shortname', 'term', 'canvas_course_id', 'sis_course_id', 'start_at', 'end_at'],
+        'order': True,
+        'gradescope': {
+            'select': {'gs_course_id': 'cid', 'gs_name': 'gs.name', 'canvas_name': 'null', 'shortname': 'shortname', 'term': 'year',
+                       'canvas_course_id': 'lti', 'sis_course_id': 'null', 'start_at': 'null', 'end_at': 'null'},
+            'from': 'gs_courses gs',
+            'combined': {
+                'select': {'canvas_name': 'c.name', 'sis_course_id': 'sis_course_id', 'start_at': 'start_at', 'end_at': 'end_at'},
+                'from': 'gs_courses gs left join canvas_courses c on gs.lti = c.id',
+            },
+        },
+        'canvas': {
+            'select': {'gs_course_id': 'null', 'gs_name': 'null', 'canvas_name': 'c.name', 'shortname': 'null', 'term': 'null',
+                       'canvas_course_id': 'c.id', 'sis_course_id': 'sis_course_id', 'start_at': 'start_at', 'end_at': 'end_at'},
+            'from': 'canvas_courses c',
+            # Courses in both were already joined by the Gradescope half
+            'combined': {
+                'where': 'not exists (select * from gs_courses gs where gs.lti = c.id)',
+            },
+        },
+    },
+    'assignments': {
+        'columns': ['gs_assignment_id', 'canvas_assignment_id', 'gs_course_id', 'canvas_course_id', 'name', 'assigned', 'due', 'canvas_max_points', 'source'],
+        'gradescope': {
+            'select': {'gs_assignment_id': 'gs.id', 'canvas_assignment_id': 'null', 'gs_course_id': 'gs.course_id', 'canvas_course_id': 'crs.lti',
+                       'name': 'gs.name', 'assigned': "strftime('%Y-%m-%dT%H:%M:%SZ', gs.assigned)", 'due': "strftime('%Y-%m-%dT%H:%M:%SZ', gs.due)",
+                       'canvas_max_points': 'null', 'source': "'Gradescope'"},
+            'from': 'gs_assignments gs join gs_courses crs on gs.course_id = crs.cid',
+            # DuckDB parses the dates itself (see columnar.py)
+            'duckdb': {
+                'select': {'assigned': 'gs.assigned', 'due': 'gs.due'},
+            },
+        },
+        'canvas': {
+            'select': {'gs_assignment_id': 'null', 'canvas_assignment_id': 'c.id', 'gs_course_id': 'null', 'canvas_course_id': 'c.course_id',
+                       'name': 'c.name', 'assigned': 'unlock_at', 'due': 'due_at', 'canvas_max_points': 'points_possible', 'source': "'Canvas'"},
+            'from': 'canvas_assignments c',
+        },
+    },
+    'submissions': {
+        'columns': ['student', 'email', 'Total Score', 'Max Points', 'Status', 'gs_submission_id', 'canvas_submission_id', 'Submission Time',
+                    'submitted_at', 'due', 'student_id', 'gs_assignment_id', 'canvas_assignment_id', 'name', 'gs_student_id', 'gs_user_id',
+                    'gs_course_id', 'canvas_course_id', 'late', 'points_deducted', 'Lateness (H:M:S)', 'seconds_late', 'course_name', 'source'],
+        'gradescope': {
+            'select': {'student': '"First Name" || \' \' || "Last Name"', 'email': 'Email', 'Total Score': '"Total Score"', 'Max Points': '"Max Points"',
+                       'Status': 'Status', 'gs_submission_id': '"Submission ID"', 'canvas_submission_id': 'null',
+                       'Submission Time': '"Submission Time"', 'submitted_at': 'null', 'due': 'due', 'student_id': 'st.student_id',
+                       'gs_assignment_id': 'assign_id', 'canvas_assignment_id': 'null', 'name': 'gsa.name', 'gs_student_id': 'cast(st.sid as bigint)',
+                       'gs_user_id': 'user_id', 'gs_course_id': 'gs.course_id', 'canvas_course_id': 'gsc.lti',
+                       'late': 'null', 'points_deducted': '0', 'Lateness (H:M:S)': 'gs."Lateness (H:M:S)"', 'seconds_late': 'null',
+                       'course_name': 'gsc.shortname', 'source': "'Gradescope'"},
+            'from': 'gs_submissions gs left join {} st on gs.SID = st.student_id left join gs_courses gsc on gs.course_id=gsc.cid '
+                    'left join gs_assignments gsa on gs.assign_id = gsa.id'.format(GS_ROSTER),
+        },
+        'canvas': {
+            'select': {'student': 'st.name', 'email': 'st.email', 'Total Score': 'score', 'Max Points': 'a.points_possible',
+                       # Single quotes: in SQLite, "Missing" would be canvas_submissions' missing column
+                       'Status': "case when graded_at is not null then 'Graded' when submitted_at is not null then 'Submitted' else 'Missing' end",
+                       'gs_submission_id': 'null', 'canvas_submission_id': 's.id', 'Submission Time': 'null', 'submitted_at': 'submitted_at',
+                       'due': 'a.due_at', 'student_id': 'st.sis_user_id', 'gs_assignment_id': 'null', 'canvas_assignment_id': 'assignment_id',
+                       'name': 'a.name', 'gs_student_id': 'null', 'gs_user_id': 'null', 'gs_course_id': 'null', 'canvas_course_id': 'a.course_id',
+                       'late': 'late', 'points_deducted': 'points_deducted', 'Lateness (H:M:S)': 'null', 'seconds_late': 'seconds_late',
+                       'course_name': '(select name from canvas_courses where id = a.course_id)', 'source': "'Canvas'"},
+            'from': 'canvas_submissions s join {} st on s.user_id = st.id join canvas_assignments a on s.assignment_id = a.id'.format(CANVAS_ROSTER),
+            'combined': {
+                'select': {'gs_student_id': 'cast(gst.sid as bigint)', 'gs_user_id': 'gst.user_id', 'gs_course_id': 'gsc.cid', 'course_name': 'gsc.shortname'},
+                'from': 'canvas_submissions s join {} st on s.user_id = st.id join canvas_assignments a on s.assignment_id = a.id '
+                        'left join {} gst on gst.student_id = st.sis_user_id left join {} gsc on gsc.lti = a.course_id'.format(CANVAS_ROSTER, GS_ROSTER, GS_LTI),
+            },
+        },
+    },
+}
+
+def quote(column: str) -> str:
+    return column if column.isidentifier() else '"{}"'.format(column)
+
+def half_sql(entity: str, source: str, combined: bool, dialect: str = 'sqlite') -> str:
+    """
+    The Gradescope or Canvas half of an aligned query, for SQLite or DuckDB (whose expressions
+    that differ are declared in the spec under 'duckdb')
+    """
+    spec = ALIGNED[entity][source]
+    overrides = spec.get('combined', {}) if combined else {}
+    dialect_overrides = spec.get(dialect, {})
+    select = {**spec['select'], **overrides.get('select', {}), **dialect_overrides.get('select', {})}
+    where = dialect_overrides.get('where', overrides.get('where', spec.get('where')))
+
+    sql = 'select {} from {}'.format(', '.join('{} as {}'.format(select[column], quote(column)) for column in ALIGNED[entity]['columns']),
+                                     overrides.get('from', spec['from']))
+    if where:
+        sql += ' where ' + where
+    return sql
+
+def halves(entity: str, include_gs: bool, include_canvas: bool, dialect: str = 'sqlite') -> list:
+    parts = []
+    if include_gs:
+        parts.append(half_sql(entity, 'gradescope', include_canvas, dialect))
+    if include_canvas:
+        parts.append(half_sql(entity, 'canvas', include_gs, dialect))
+    return parts
+
+@functools.lru_cache(maxsize=None)
+def aligned_sql(entity: str, include_gs: bool, include_canvas: bool, dialect: str = 'sqlite') -> str:
+    """
+    The aligned query for an entity (students, courses, assignments or submissions), according
+    to which sources are enabled
+    """
+    parts = halves(entity, include_gs, include_canvas, dialect)
+    sql = ' union all '.join(parts)
+    if ALIGNED[entity].get('order') and len(parts) > 1:
+        # As SQLite sorts: nulls first
+        sql += ' order by ' + ', '.join('{}{}'.format(i + 1, ' nulls first' if dialect == 'duckdb' else '')
+                                       for i in range(len(ALIGNED[entity]['columns'])))
+    return sql
+
+@functools.lru_cache(maxsize=None)
+def aligned_parts(entity: str, include_gs: bool, include_canvas: bool) -> tuple:
+    """
+    Queries whose rows, one after the other, are those of the aligned query: its halves, which
+    can be read concurrently, unless the union is sorted (which only SQLite reproduces exactly)
+    """
+    if ALIGNED[entity].get('order') and include_gs and include_canvas:
+        return (aligned_sql(entity, include_gs, include_canvas),)
+    return tuple(halves(entity, include_gs, include_canvas))
+
+@functools.lru_cache(maxsize=None)
+def aligned_statement(entity: str, include_gs: bool, include_canvas: bool):
+    """
+    The compiled statement, built once so SQLAlchemy's statement cache (and sqlite3's
+    prepared statement cache) are hit on every later load
+    """
+    return text(aligned_sql(entity, include_gs, include_canvas))
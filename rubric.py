@@ -0,0 +1,126 @@
+#################################################################################
+## rubric.py - rubric configuration for the Penn CIS Teaching Dashboard
+##
+## The rubric section of config.yaml, reloaded whenever the file changes so
+## that edits to a course's rubric take effect without restarting the
+## dashboard.  Each reload is diffed against the previous rubric, per course
+## and per group, so that views.py recomputes only what the edit affects.
+##
+## Licensed to the Apache Software Foundation (ASF) under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  The ASF licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing,
+## software distributed under the License is distributed on an
+## "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+## KIND, either express or implied.  See the License for the
+## specific language governing permissions and limitations
+## under the License.
+##
+#################################################################################
+
+import os
+import threading
+import traceback
+import yaml
+
+## The settings of a group that determine its component frame; the others (e.g., points) only
+## change the course totals
+COMPONENT_SETTINGS = ['substring', 'source', 'max_score', 'max_extra_credit']
+
+def freeze(value):
+    """
+    A hashable version of a (nested) rubric setting, for use in cache keys
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+def component_key(group: dict) -> tuple:
+    return freeze({setting: group[setting] for setting in COMPONENT_SETTINGS if setting in group})
+
+def diff_rubric(old: dict, new: dict) -> dict:
+    """
+    The courses whose rubric changed, each mapped to the set of its groups whose component
+    frames changed (possibly empty, e.g. if only the points of a group changed).  A course
+    that was added or removed maps to all of its groups.
+    """
+    changes = {}
+    for course_id in set(old) | set(new):
+        before, after = old.get(course_id) or {}, new.get(course_id) or {}
+        if freeze(before) == freeze(after):
+            continue
+
+        changes[course_id] = {group for group in set(before) | set(after)
+                              if group != 'spreadsheet' and
+                              (group not in before or group not in after or
+                               component_key(before[group]) != component_key(after[group]))}
+    return changes
+
+class RubricConfig:
+    """
+    The rubric of each course, as currently configured in config.yaml.  The file is checked
+    (with a stat) on each access, and re-read once it has changed; listeners are told which
+    courses and groups an edit changed.
+    """
+    def __init__(self, file: str = 'config.yaml'):
+        self.file = file
+        self.rubric = None
+        self.changes = {}
+        self.reloads = 0
+
+        self._stamp = None
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def stamp(self) -> tuple:
+        stat = os.stat(self.file)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def on_change(self, listener: callable) -> None:
+        self._listeners.append(listener)
+
+    def get(self) -> dict:
+        try:
+            stamp = self.stamp()
+        except OSError:
+            stamp = self._stamp
+        if stamp == self._stamp and self.rubric is not None:
+            return self.rubric
+
+        with self._lock:
+            if stamp != self._stamp or self.rubric is None:
+                self.reload(stamp)
+        return self.rubric
+
+    def reload(self, stamp: tuple) -> None:
+        try:
+            with open(self.file) as config_file:
+                rubric = (yaml.safe_load(config_file) or {}).get('rubric') or {}
+        except (OSError, yaml.YAMLError):
+            # Most likely saved halfway through an edit: keep the previous rubric, and retry next time
+            if self.rubric is None:
+                raise
+            traceback.print_exc()
+            return
+
+        if self.rubric is not None:
+            self.changes = diff_rubric(self.rubric, rubric)
+            self.reloads += 1
+            if self.changes:
+                print('Rubric changed for courses {}'.format(
+                    ', '.join('{} ({})'.format(course_id, ', '.join(sorted(groups)) or 'totals only')
+                              for course_id, groups in self.changes.items())))
+            for listener in self._listeners:
+                listener(self.changes)
+
+        self.rubric = rubric
+        self._stamp = stamp
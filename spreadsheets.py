@@ -0,0 +1,107 @@
+#################################################################################
+## spreadsheets.py - additional-fields spreadsheets for the Penn CIS Teaching Dashboard
+##
+## Loads the Excel spreadsheets of supplemental fields (more-fields-<course>.xlsx,
+## or the rubric's spreadsheet setting).  Parsing Excel is slow, so each file is
+## parsed once per version (path, modification time and size) and the frame is
+## shared by every session; an edit shows up on the next rerun.  Optionally,
+## the parsed frame is also saved as an Arrow sidecar file next to the
+## spreadsheet, so it survives restarts:
+##
+##    spreadsheets:
+##      sidecar: true
+##
+## Licensed to the Apache Software Foundation (ASF) under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  The ASF licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing,
+## software distributed under the License is distributed on an
+## "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+## KIND, either express or implied.  See the License for the
+## specific language governing permissions and limitations
+## under the License.
+##
+#################################################################################
+
+import os
+import json
+import traceback
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from database import config
+from instrumentation import timed_resource, timer
+
+spreadsheet_config = config.get('spreadsheets', {}) or {}
+
+## Student info copied from Gradescope, which the students frame already has
+NAME_COLUMNS = ['First Name', 'Last Name', 'Email']
+
+def spreadsheet_path(course_id: int, course_rubric: dict) -> str:
+    """
+    The additional-fields spreadsheet of a course: the rubric's spreadsheet setting, or by default
+    more-fields-<course>.xlsx
+    """
+    return course_rubric.get('spreadsheet', 'more-fields-{}.xlsx'.format(course_id))
+
+def file_stamp(file: str) -> tuple:
+    """
+    The version of a file: its modification time and size, or None if it doesn't exist
+    """
+    try:
+        stat = os.stat(file)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def sidecar_path(file: str) -> str:
+    directory, name = os.path.split(file)
+    return os.path.join(directory, '.{}.arrow'.format(name))
+
+def read_sidecar(file: str, stamp: tuple) -> pd.DataFrame:
+    """
+    The frame saved next to the spreadsheet, if it was parsed from this version of it
+    """
+    try:
+        table = feather.read_table(sidecar_path(file))
+    except (OSError, pa.ArrowInvalid):
+        return None
+    if (table.schema.metadata or {}).get(b'spreadsheet_stamp') != json.dumps(stamp).encode():
+        return None
+    return table.to_pandas()
+
+def write_sidecar(file: str, stamp: tuple, frame: pd.DataFrame) -> None:
+    try:
+        table = pa.Table.from_pandas(frame)
+        table = table.replace_schema_metadata(dict(table.schema.metadata or {}, spreadsheet_stamp=json.dumps(stamp)))
+        temporary = sidecar_path(file) + '.tmp'
+        feather.write_feather(table, temporary)
+        os.replace(temporary, sidecar_path(file))
+    except (OSError, pa.ArrowInvalid, pa.ArrowTypeError):
+        # The sidecar only saves time; without it, the spreadsheet is parsed after a restart
+        traceback.print_exc()
+
+@timed_resource(max_entries=64)
+def parse_spreadsheet(file: str, stamp: tuple) -> pd.DataFrame:
+    """
+    One version of a spreadsheet, parsed (or read from its sidecar) once and shared by every session
+    """
+    sidecar = spreadsheet_config.get('sidecar', False)
+    if sidecar:
+        frame = read_sidecar(file, stamp)
+        if frame is not None:
+            return frame
+
+    with timer('spreadsheets.parse_spreadsheet: read_excel'):
+        frame = pd.read_excel(file).drop(columns=NAME_COLUMNS)
+    if sidecar:
+        write_sidecar(file, stamp, frame)
+    return frame
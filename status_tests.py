@@ -35,6 +35,9 @@ due_date = 'due'# ({})'.format(timezone)
 ## Grace period
 grace = timedelta(days=5)
 
+## How far ahead of the deadline we start warning about unsubmitted work
+near_due_window = timedelta(days=2)
+
 def is_unsubmitted(x):
     return x['Status'] == 'Missing' or x['Total Score'] is None or x['Total Score'] < x['Max Points'] / 2.0 
 
@@ -47,7 +50,7 @@ def is_near_due(x, due):
     if not pd.isnull(x[due_date]):
         due = x[due_date]
 
-    return is_unsubmitted(x) and (due - now) < timedelta(days = 2) and not is_overdue(x, due)# now < due + timedelta(days=5)
+    return is_unsubmitted(x) and (due - now) < near_due_window and not is_overdue(x, due)# now < due + timedelta(days=5)
 
 def is_submitted(x: pd.Series):
     return x['Status'] != 'Missing'
@@ -0,0 +1,84 @@
+#################################################################################
+## student_index.py - student lookup index for the Penn CIS Teaching Dashboard
+##
+## An inverted index over the enrollments frame of a data store snapshot,
+## mapping each student's normalized identifiers (email, SIS ID, full name,
+## and each word of the name) to the rows of their submissions in every
+## course.  Keys are kept sorted, so a lookup by prefix (e.g., the first few
+## letters of a name) is a binary search plus the matching rows, rather than
+## a scan of all submissions.
+##
+## Licensed to the Apache Software Foundation (ASF) under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  The ASF licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing,
+## software distributed under the License is distributed on an
+## "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+## KIND, either express or implied.  See the License for the
+## specific language governing permissions and limitations
+## under the License.
+##
+#################################################################################
+
+import numpy as np
+import pandas as pd
+
+def normalize(value: str) -> str:
+    return ' '.join(str(value).lower().split())
+
+def normalize_column(values: pd.Series) -> pd.Series:
+    return values.dropna().astype(str).str.lower().str.split().str.join(' ')
+
+class StudentIndex:
+    """
+    Maps normalized student identifiers (and their prefixes) to row positions in an enrollments
+    frame; built once per snapshot
+    """
+    def __init__(self, enrollments: pd.DataFrame):
+        # Indexed by row position
+        column = lambda name: enrollments[name].reset_index(drop=True)
+
+        keys = [normalize_column(column('email')),
+                column('student_id').dropna().astype('int64').astype(str),
+                normalize_column(column('student'))]
+        # Each word of the name, so "smith" finds "Jane Smith"
+        keys.append(keys[-1].str.split().explode())
+
+        pairs = pd.DataFrame({'key': np.concatenate([key.to_numpy(dtype=object) for key in keys]),
+                              'row': np.concatenate([key.index.to_numpy() for key in keys])})
+        pairs = pairs[pairs['key'].str.len() > 0].drop_duplicates().sort_values(['key', 'row'])
+
+        # The rows of the i-th key are rows[offsets[i]:offsets[i + 1]]
+        self.keys, starts = np.unique(pairs['key'].to_numpy(dtype=str), return_index=True)
+        self.offsets = np.append(starts, len(pairs))
+        self.rows = pairs['row'].to_numpy()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def find(self, query: str, prefix: bool = True) -> np.ndarray:
+        """
+        The (sorted) positions of the enrollment rows of every student with an identifier equal to
+        the query, or starting with it
+        """
+        query = normalize(query)
+        if not query:
+            return np.array([], dtype=int)
+
+        first = np.searchsorted(self.keys, query, side='left')
+        if prefix:
+            last = np.searchsorted(self.keys, query + '\U0010ffff', side='left')
+        else:
+            last = first + int(first < len(self.keys) and self.keys[first] == query)
+        if first == last:
+            return np.array([], dtype=int)
+
+        # The keys in range are adjacent, so their rows are one slice
+        return np.unique(self.rows[self.offsets[first]:self.offsets[last]])
@@ -0,0 +1,278 @@
+#################################################################################
+## synthetic_data.py - synthetic crawler databases for the Penn CIS Teaching Dashboard
+##
+## Generates a SQLite database with the same tables and columns the
+## Gradescope-Canvas crawler produces (gs_* and canvas_*), with configurable
+## numbers of courses, students and assignments, overlap between the two
+## sources, and extension rates.  Also writes a matching config.yaml (with a
+## rubric for every Gradescope course), so the dashboard can be run against it:
+##
+##    python synthetic_data.py --courses 20 --students 150 --output /tmp/synth
+##    cd /tmp/synth && streamlit run /path/to/dashboard.py
+##
+## Licensed to the Apache Software Foundation (ASF) under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  The ASF licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing,
+## software distributed under the License is distributed on an
+## "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+## KIND, either express or implied.  See the License for the
+## specific language governing permissions and limitations
+## under the License.
+##
+#################################################################################
+
+import os
+import random
+import sqlite3
+import argparse
+import yaml
+from datetime import datetime, timedelta, timezone
+
+FIRST_NAMES = ['Alex', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie', 'Avery', 'Quinn', 'Parker',
+               'Sam', 'Drew', 'Rowan', 'Skyler', 'Reese', 'Hayden', 'Emerson', 'Finley', 'Sage', 'Kendall']
+LAST_NAMES = ['Smith', 'Chen', 'Patel', 'Garcia', 'Kim', 'Nguyen', 'Johnson', 'Lee', 'Brown', 'Davis',
+              'Martinez', 'Lopez', 'Wilson', 'Anderson', 'Thomas', 'Moore', 'Jackson', 'Martin', 'Clark', 'Lewis']
+
+## Gradescope and Canvas format dates differently; these match what the crawler stores
+CANVAS_DATE = '%Y-%m-%dT%H:%M:%SZ'
+GS_SUBMISSION_DATE = '%Y-%m-%d %H:%M:%S %z'
+GS_EXTENSION_DATE = '%b %d %Y %I:%M %p'
+
+## Gradescope's extension export labels its date columns with the local time zone
+tz_name = datetime.now().astimezone().tzinfo
+
+SCHEMA = {
+    'gs_courses': ['cid integer', 'name text', 'shortname text', 'year text', 'lti integer'],
+    'gs_students': ['sid integer', 'student_id integer', 'name text', 'emails text', 'user_id integer',
+                    'course_id integer', 'role text'],
+    'gs_assignments': ['id integer', 'course_id integer', 'name text', 'assigned text', 'due text'],
+    'gs_submissions': ['[First Name] text', '[Last Name] text', 'SID integer', 'Email text', 'Sections text',
+                       'course_id integer', 'assign_id integer', '[Submission ID] integer', '[Total Score] real',
+                       '[Max Points] real', '[Submission Time] text', 'Status text', '[Lateness (H:M:S)] text'],
+    'gs_extensions': ['course_id integer', 'assign_id integer', 'user_id integer', '[First Name] text',
+                      '[Last Name] text', 'Email text', 'Edit text', 'Section text', '[First & Last Name Swap] text',
+                      '[Last, First Name Swap] text', 'Sections text',
+                      '[Release ({0})Due ({0})] text'.format(tz_name), '[Release ({})] text'.format(tz_name),
+                      '[Due ({})] text'.format(tz_name), '[Late Due ({})] text'.format(tz_name),
+                      '[Time Limit] text', '[Extension Type] text'],
+    'canvas_courses': ['id integer', 'name text', 'course_code text', 'sis_course_id text', 'start_at text',
+                       'end_at text'],
+    'canvas_students': ['id integer', 'sis_user_id integer', 'name text', 'email text', 'course_id integer'],
+    'canvas_assignments': ['id integer', 'course_id integer', 'name text', 'unlock_at text', 'due_at text',
+                           'points_possible real'],
+    'canvas_submissions': ['id integer', 'user_id integer', 'assignment_id integer', 'course_id integer',
+                           'score real', 'submitted_at text', 'graded_at text', 'late integer', 'missing integer',
+                           'points_deducted real', 'seconds_late integer', 'workflow_state text'],
+    'canvas_extensions': ['id integer', 'user_id integer', 'assignment_id integer', 'course_id integer',
+                          'extra_attempts integer', 'extra_time integer', 'late_due_at text',
+                          'extended_due_at text', 'created_at text', 'updated_at text'],
+}
+
+def create_schema(connection: sqlite3.Connection) -> None:
+    for table, columns in SCHEMA.items():
+        connection.execute('drop table if exists [{}]'.format(table))
+        connection.execute('create table [{}] ({})'.format(table, ', '.join(columns)))
+
+def insert(connection: sqlite3.Connection, table: str, rows: list) -> None:
+    if len(rows):
+        connection.executemany('insert into [{}] values ({})'.format(table, ', '.join(['?'] * len(rows[0]))), rows)
+
+def lateness(seconds: int) -> str:
+    return '{:02d}:{:02d}:{:02d}'.format(seconds // 3600, (seconds % 3600) // 60, seconds % 60)
+
+def generate(filename: str,
+             courses: int = 10,
+             students: int = 100,
+             assignments: int = 12,
+             overlap: float = 0.8,
+             student_overlap: float = 0.95,
+             canvas_only: float = 0.1,
+             extension_rate: float = 0.05,
+             missing_rate: float = 0.08,
+             late_rate: float = 0.1,
+             seed: int = 0,
+             start: datetime = None) -> dict:
+    """
+    Writes a synthetic crawler database to filename, and returns the rubric for its courses.
+
+    courses:          number of courses
+    students:         students per course
+    assignments:      Gradescope assignments per course (homeworks plus two midterms); Canvas
+                      courses get the same number of quizzes
+    overlap:          fraction of Gradescope courses whose Canvas site was also crawled
+    student_overlap:  fraction of students in such a course that appear in both rosters
+    canvas_only:      fraction of courses that only exist in Canvas
+    extension_rate:   fraction of Gradescope (student, assignment) pairs with an extension
+    missing_rate:     fraction of submissions that are missing
+    late_rate:        fraction of submissions that are late
+    start:            first day of the semester (default: eight weeks ago, so some work is still due)
+    """
+    rand = random.Random(seed)
+    if start is None:
+        start = (datetime.now(timezone.utc) - timedelta(weeks=8)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    connection = sqlite3.connect(filename)
+    create_schema(connection)
+
+    rubric = {}
+    next_id = {'student': 10000000, 'gs_user': 500000, 'canvas_user': 900000, 'submission': 1, 'extension': 1}
+
+    for course in range(courses):
+        canvas_id = 1000 + course
+        gs_id = 500000 + course
+        shortname = 'CIS {}'.format(1000 + course * 10)
+        name = '{} Synthetic Course {}'.format(shortname, course)
+        in_canvas_only = rand.random() < canvas_only
+        in_gradescope = not in_canvas_only
+        in_canvas = in_canvas_only or rand.random() < overlap
+
+        if in_gradescope:
+            insert(connection, 'gs_courses', [(gs_id, name, shortname, 'Fall {}'.format(start.year), canvas_id)])
+        if in_canvas:
+            insert(connection, 'canvas_courses', [(canvas_id, name, shortname, 'SIS-{}'.format(canvas_id),
+                                                   start.strftime(CANVAS_DATE),
+                                                   (start + timedelta(weeks=16)).strftime(CANVAS_DATE))])
+
+        roster = []
+        for _ in range(students):
+            first, last = rand.choice(FIRST_NAMES), rand.choice(LAST_NAMES)
+            student = {'sis': next_id['student'], 'first': first, 'last': last,
+                       'email': '{}.{}{}@upenn.edu'.format(first, last, next_id['student']).lower(),
+                       'gs_sid': next_id['gs_user'], 'gs_user': next_id['gs_user'] + 1000000,
+                       'canvas_user': next_id['canvas_user'],
+                       'in_gs': in_gradescope,
+                       'in_canvas': in_canvas and (in_canvas_only or not in_gradescope or rand.random() < student_overlap)}
+            for key in ['student', 'gs_user', 'canvas_user']:
+                next_id[key] += 1
+            roster.append(student)
+
+        insert(connection, 'gs_students', [(s['gs_sid'], s['sis'], '{} {}'.format(s['first'], s['last']), s['email'],
+                                            s['gs_user'], gs_id, 'STUDENT') for s in roster if s['in_gs']])
+        insert(connection, 'canvas_students', [(s['canvas_user'], s['sis'], '{} {}'.format(s['first'], s['last']),
+                                                s['email'], canvas_id) for s in roster if s['in_canvas']])
+
+        # Weekly deliverables across a 16-week semester; the midterms land a third and two thirds of the way in.
+        # Rubrics are matched up via the Gradescope course, so Canvas-only courses don't get one
+        if in_gradescope:
+            rubric[canvas_id] = {}
+            gs_assigns = []
+            for inx in range(assignments):
+                due = start + timedelta(weeks=1 + inx * 15 / max(assignments, 1), hours=23, minutes=59)
+                if inx == assignments // 3:
+                    title, points = 'Midterm 1', 80
+                elif inx == (2 * assignments) // 3:
+                    title, points = 'Midterm 2', 80
+                else:
+                    title, points = 'Homework {}'.format(inx + 1), 100
+                gs_assigns.append({'id': gs_id * 100 + inx, 'name': title, 'due': due, 'points': points})
+
+            insert(connection, 'gs_assignments', [(a['id'], gs_id, a['name'], (a['due'] - timedelta(weeks=1)).strftime(CANVAS_DATE),
+                                                   a['due'].strftime(CANVAS_DATE)) for a in gs_assigns])
+
+            submissions = []
+            extensions = []
+            for a in gs_assigns:
+                for s in [s for s in roster if s['in_gs']]:
+                    submission_id = next_id['submission']
+                    next_id['submission'] += 1
+                    if a['due'] > datetime.now(timezone.utc) or rand.random() < missing_rate:
+                        submissions.append((s['first'], s['last'], s['sis'], s['email'], None, gs_id, a['id'], None,
+                                            None, a['points'], None, 'Missing', '00:00:00'))
+                        continue
+                    late = rand.random() < late_rate
+                    seconds_late = rand.randint(60, 72 * 3600) if late else 0
+                    submitted = a['due'] + timedelta(seconds=seconds_late) if late else a['due'] - timedelta(minutes=rand.randint(1, 5 * 24 * 60))
+                    submissions.append((s['first'], s['last'], s['sis'], s['email'], None, gs_id, a['id'], submission_id,
+                                        round(min(a['points'], max(0, rand.gauss(0.82, 0.15) * a['points'])), 1), a['points'],
+                                        submitted.astimezone(timezone(timedelta(hours=-4))).strftime(GS_SUBMISSION_DATE),
+                                        'Graded', lateness(seconds_late)))
+
+                    if rand.random() < extension_rate:
+                        extended = a['due'] + timedelta(days=rand.randint(1, 7))
+                        extensions.append((gs_id, a['id'], s['gs_user'], s['first'], s['last'], s['email'], 'Edit', None,
+                                           '{} {}'.format(s['last'], s['first']), '{}, {}'.format(s['last'], s['first']),
+                                           None, '(no change)', '(no change)', extended.strftime(GS_EXTENSION_DATE),
+                                           'No late due date', '--', 'Extension'))
+            insert(connection, 'gs_submissions', submissions)
+            insert(connection, 'gs_extensions', extensions)
+
+            rubric[canvas_id]['midterm1'] = {'substring': 'Midterm 1', 'points': 15, 'max_score': 80, 'max_extra_credit': 0, 'source': 'Gradescope'}
+            rubric[canvas_id]['midterm2'] = {'substring': 'Midterm 2', 'points': 15, 'max_score': 80, 'max_extra_credit': 0, 'source': 'Gradescope'}
+            rubric[canvas_id]['homeworks'] = {'substring': 'Homework', 'points': 50, 'source': 'Gradescope'}
+
+        if in_canvas:
+            quizzes = [{'id': canvas_id * 1000 + inx, 'name': 'Lecture {} review'.format(inx + 1),
+                        'due': start + timedelta(weeks=1 + inx * 15 / max(assignments, 1), hours=10), 'points': 10}
+                       for inx in range(assignments)]
+            insert(connection, 'canvas_assignments', [(q['id'], canvas_id, q['name'], (q['due'] - timedelta(days=2)).strftime(CANVAS_DATE),
+                                                       q['due'].strftime(CANVAS_DATE), q['points']) for q in quizzes])
+
+            submissions = []
+            for q in quizzes:
+                for s in [s for s in roster if s['in_canvas']]:
+                    submission_id = next_id['submission']
+                    next_id['submission'] += 1
+                    if q['due'] > datetime.now(timezone.utc) or rand.random() < missing_rate:
+                        submissions.append((submission_id, s['canvas_user'], q['id'], canvas_id, None, None, None,
+                                            0, 1, 0, 0, 'unsubmitted'))
+                        continue
+                    late = rand.random() < late_rate
+                    seconds_late = rand.randint(60, 48 * 3600) if late else 0
+                    submitted = q['due'] + timedelta(seconds=seconds_late) if late else q['due'] - timedelta(minutes=rand.randint(1, 48 * 60))
+                    submissions.append((submission_id, s['canvas_user'], q['id'], canvas_id,
+                                        float(rand.randint(5, 10)), submitted.strftime(CANVAS_DATE),
+                                        (submitted + timedelta(hours=1)).strftime(CANVAS_DATE),
+                                        1 if late else 0, 0, 1.0 if late else 0, seconds_late, 'graded'))
+            insert(connection, 'canvas_submissions', submissions)
+
+            if in_gradescope:
+                rubric[canvas_id]['quizzes'] = {'substring': 'review', 'points': 20, 'source': 'Canvas'}
+
+    connection.commit()
+    connection.close()
+
+    return rubric
+
+def write_config(directory: str, db_file: str, rubric: dict, include_gs: bool = True, include_canvas: bool = True) -> str:
+    """
+    Writes a config.yaml for the dashboard, pointing at the synthetic database
+    """
+    config = {'db': db_file,
+              'gradescope': {'show': include_gs},
+              'canvas': {'show': include_canvas},
+              'rubric': rubric}
+    filename = os.path.join(directory, 'config.yaml')
+    with open(filename, 'w') as config_file:
+        yaml.safe_dump(config, config_file, sort_keys=False)
+    return filename
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic crawler database (and config.yaml) for the dashboard')
+    parser.add_argument('--output', default='.', help='directory for dashboard.db and config.yaml')
+    parser.add_argument('--courses', type=int, default=10)
+    parser.add_argument('--students', type=int, default=100, help='students per course')
+    parser.add_argument('--assignments', type=int, default=12, help='assignments per course and source')
+    parser.add_argument('--overlap', type=float, default=0.8, help='fraction of Gradescope courses also crawled from Canvas')
+    parser.add_argument('--student-overlap', type=float, default=0.95, help='fraction of students on both rosters')
+    parser.add_argument('--canvas-only', type=float, default=0.1, help='fraction of courses only in Canvas')
+    parser.add_argument('--extension-rate', type=float, default=0.05)
+    parser.add_argument('--missing-rate', type=float, default=0.08)
+    parser.add_argument('--late-rate', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    db_file = os.path.join(args.output, 'dashboard.db')
+    rubric = generate(db_file, courses=args.courses, students=args.students, assignments=args.assignments,
+                      overlap=args.overlap, student_overlap=args.student_overlap, canvas_only=args.canvas_only,
+                      extension_rate=args.extension_rate, missing_rate=args.missing_rate,
+                      late_rate=args.late_rate, seed=args.seed)
+    print('Wrote {} and {}'.format(db_file, write_config(args.output, 'dashboard.db', rubric)))
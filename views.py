@@ -25,15 +25,21 @@
 
 import streamlit as st
 import pandas as pd
+import numpy as np
 import yaml
 import sys
-from os import path
 
 from entities import get_students, get_courses, get_assignments_and_submissions
-from entities import get_course_enrollments
-
-with open('config.yaml') as config_file:
-    config = yaml.safe_load(config_file)
+from entities import get_course_enrollments, get_course_submissions, get_store
+from instrumentation import timed, timer
+import datastore
+from datastore import RemoteSnapshot
+from rubric import RubricConfig, component_key, freeze
+from spreadsheets import spreadsheet_path, file_stamp, parse_spreadsheet
+from student_index import StudentIndex
+from prefetch import prefetcher, course_cache, prefetch_config, nearest_first
+from changes import get_changes, state_path
+from status_tests import is_overdue, is_near_due, is_submitted, now
 
 def cap_points(row, rubric_items):
     '''
@@ -73,13 +79,184 @@ def sum_scaled(x, sums, maxes, scales):
                 total += x[sums[i]] * float(scales[i]) / float(x[maxes[i]])
     return total
 
+def group_title(group: str, group_rubric: dict) -> str:
+    group_name = group[0].upper() + group[1:]
+    if group_name[-1] >= '0' and group_name[-1] <= '9':
+        group_name = group_name[0:-1] + ' ' + group_name[-1]
+
+    if 'source' in group_rubric:
+        return "{} ({})".format(group_name, group_rubric["source"])
+    return group_name
+
+@timed
+def compute_rubric_component(the_course: pd.DataFrame, group_rubric: dict) -> pd.DataFrame:
+    '''
+    The component frame of one rubric group: each student's total score and max points over
+    the course's assignments in the group
+    '''
+    # The subset we want -- just those matching the substring
+    assigns = the_course[the_course['name'].apply(lambda x: str(group_rubric['substring']).lower() in x.lower())]
+
+    # If we have filtered to one source (Gradescope or Canvas), make sure we eliminate any others
+    if 'source' in group_rubric:
+        assigns = assigns[assigns['source'].apply(lambda x: x.upper() == str(group_rubric['source']).upper())]
+
+    # Now we want to group by student and email, and sum up all assignments in this group
+    if len(assigns):
+        assigns = assigns.groupby(by=['student', 'email', 'student_id']).\
+                sum().reset_index()\
+                [['student', 'Total Score', "Max Points", 'email', 'student_id']]
+
+    if len(assigns):
+        assigns['Max Points'] = assigns['Max Points'].apply(lambda x: adjust_max(x, group_rubric))
+
+        # Cap the total points based on max + ec max
+        assigns['Total Score'] = assigns.apply(lambda x: cap_points(x, group_rubric), axis=1)
+
+        assigns = assigns.astype({'student_id': int})
+
+    return assigns
+
+def get_rubric_component(store, course: pd.Series, course_id: int, group: str, group_rubric: dict) -> pd.DataFrame:
+    '''
+    The component frame of one rubric group, computed once per data snapshot and group settings
+    and kept in the course cache
+    '''
+    return prefetcher.get(('rubric_component', snapshot_key(store), course['gs_course_id'], course_id, group, component_key(group_rubric)),
+                          lambda: compute_rubric_component(store.course_submissions(gs_course_id=course['gs_course_id']), group_rubric))
+
+@timed
+def compute_course_grading(students: pd.DataFrame, course: pd.Series, course_id: int, course_rubric: dict, components: dict,
+                           more_fields: pd.DataFrame = None) -> dict:
+    '''
+    Merges the rubric components of a course (and any additional fields from Excel) into the
+    students of the course, and scales and sums them into each student's total
+    '''
+    sums = []
+    scales = []
+    errors = []
+    total = len(students)
+
+    # Make sure we account for nulls
+    students1 = students[students['gs_course_id'] == course['gs_course_id']].drop(columns=['gs_course_id', 'canvas_course_id'], axis=1)
+    students2 = students[students['canvas_course_id'] == course['canvas_course_id']].drop(columns=['gs_course_id', 'canvas_course_id'], axis=1)
+
+    students = pd.concat([students1, students2]).drop_duplicates()
+    students.fillna(0, inplace=True)
+    students = students.astype({'student_id': int})
+    for group, assigns in components.items():
+        if len(assigns):
+            students = students.merge(assigns[['student_id', 'Total Score', 'Max Points']].rename(columns={'Total Score': group, 
+                                                                                                           'Max Points': group + '_max', 
+                                                                                                           'student_id': 'student_id_'}), 
+                                                                                                           left_on='student_id', right_on='student_id_', 
+                                                                                                           how='left').drop(columns=['student_id_'])
+        else:
+            students[group] = None
+            students[group + '_max'] = None
+
+        if len(students) > total:
+            errors.append(assigns)
+            total = len(students)
+
+        sums.append(group)
+        scales.append(course_rubric[group]['points'])
+
+    # Optional additional fields, from Excel
+    if more_fields is not None:
+        students = students.merge(more_fields, left_on='student_id', right_on='SID', how='left').drop('SID', axis=1)
+        for field in more_fields.columns:
+            if field != 'SID' and field != 'Comments':
+                sums.append(field)
+                if field != 'Adjustments':
+                    students[field + '_max'] = max(students[field])
+                    scales.append(max(students[field]))
+                else:
+                    scales.append(0)
+                    students[field + '_max'] = 0
+
+    # scale and sum the points
+    with timer('views.get_scores_in_rubric: scale and sum'):
+        students['Total Points'] = students.apply(lambda x: sum_scaled(x, sums, [s + "_max" for s in sums], scales), axis=1)
+        students['Max Points'] = students.apply(lambda x: sum_scaled(x, [s + "_max" for s in sums], [s + "_max" for s in sums], scales), axis=1)
+
+    grading = {}
+    for col in students.columns:
+        if not '_max' in col and not 'course_id' in col and col != 'gs_user_id':
+            grading[col] = students[col].values.tolist()
+
+    return {'students': students, 'grading': pd.DataFrame(grading), 'errors': errors,
+            'more_fields': None if more_fields is None else more_fields.columns.to_list()}
+
+def grade_course(store, course: pd.Series, course_id: int, course_rubric: dict) -> tuple:
+    '''
+    The rubric component frames of a course, by group, and its totals (see compute_course_grading),
+    kept in the course cache.  With a data service, the service grades the course.
+    '''
+    groups = [group for group in course_rubric if group != 'spreadsheet']
+    if isinstance(store, RemoteSnapshot):
+        return store.grading(course['gs_course_id'], groups, freeze(course_rubric))
+    components = {group: get_rubric_component(store, course, course_id, group, course_rubric[group]) for group in groups}
+
+    # Look for optional file with additional fields (an edit to it is picked up on the next rerun)
+    ss = spreadsheet_path(course_id, course_rubric)
+    ss_stamp = file_stamp(ss)
+
+    graded = prefetcher.get(('rubric_course', snapshot_key(store), course['gs_course_id'], course_id, freeze(course_rubric), ss, ss_stamp),
+                            lambda: compute_course_grading(store.students, course, course_id, course_rubric, components,
+                                                           parse_spreadsheet(ss, ss_stamp) if ss_stamp else None))
+    return components, graded
+
+def get_grading_part(store, course: pd.Series, part: str) -> pd.DataFrame:
+    '''
+    One part of a course's grading, as served by the data service: the component frame of a
+    rubric group, the 'total' or 'grading' frame, the 'errors' or the 'more_fields'; None if the
+    course has no such part
+    '''
+    course_id = int(course['canvas_course_id'])
+    course_rubric = rubric_config.get().get(course_id)
+    if course_rubric is None:
+        return pd.DataFrame() if part in ['total', 'grading', 'errors', 'more_fields'] else None
+    components, graded = grade_course(store, course, course_id, course_rubric)
+
+    if part in components:
+        return components[part]
+    if part == 'total':
+        return graded['students']
+    if part == 'grading':
+        return graded['grading']
+    if part == 'errors':
+        return pd.concat(graded['errors'], ignore_index=True) if len(graded['errors']) else pd.DataFrame()
+    if part == 'more_fields':
+        return pd.DataFrame({'field': graded['more_fields'] or []})
+    return None
+
+def grading_stamp(course: pd.Series) -> tuple:
+    '''
+    What a course's grading depends on besides the data: its rubric, and the version of its
+    additional-fields spreadsheet
+    '''
+    course_id = int(course['canvas_course_id'])
+    course_rubric = rubric_config.get().get(course_id)
+    if course_rubric is None:
+        return (None, None)
+    return (freeze(course_rubric), file_stamp(spreadsheet_path(course_id, course_rubric)))
+
+@timed
 def get_scores_in_rubric(output: callable, course:pd.Series = None) -> list[pd.DataFrame]:
     '''
     Returns a list of dataframes, one for each course, with overall grade scoring information.
 
     Along the way, it creates a series of dataframes for each rubric item.  It calls the output function
     to display the rubric item in the UI.
+
+    The rubric is reloaded when config.yaml changes.  Each group's component frame and each
+    course's totals are kept in the course cache, keyed by the snapshot and their rubric settings,
+    so after an edit only the groups and courses it affects are recomputed.
     '''
+    store = get_store()
+    rubric = rubric_config.get()
+
     courses = get_courses()
     if course is not None:
         courses = courses[courses['gs_course_id'] == course['gs_course_id']]
@@ -90,138 +267,315 @@ def get_scores_in_rubric(output: callable, course:pd.Series = None) -> list[pd.D
         course_id = int(course['canvas_course_id'])
 
         st.write('For course {}, {}'.format(course_id, course['name']))
-        sums = []
-        scales = []
-        scores = get_assignments_and_submissions()
-        if course_id in config['rubric']:
-            students = get_students()
-            total = len(students)
-
-            # Make sure we account for nulls
-            students1 = students[students['gs_course_id'] == course['gs_course_id']].drop(columns=['gs_course_id', 'canvas_course_id'], axis=1)
-            students2 = students[students['canvas_course_id'] == course['canvas_course_id']].drop(columns=['gs_course_id', 'canvas_course_id'], axis=1)
-            
-            students = pd.concat([students1, students2]).drop_duplicates()
-            students.fillna(0, inplace=True)
-            students = students.astype({'student_id': int})
-            for group in config['rubric'][course_id]:
-                if group == 'spreadsheet':
-                    continue
-                the_course = scores[scores['gs_course_id'] == course['gs_course_id']]
-
-                # The subset we want -- just those matching the substring
-                assigns = the_course[the_course['name'].apply(lambda x: str(config['rubric'][course_id][group]['substring']).lower() in x.lower())]
-
-                # If we have filtered to one source (Gradescope or Canvas), make sure we eliminate any others
-                if 'source' in config['rubric'][course_id][group]:
-                    assigns = assigns[assigns['source'].apply(lambda x: x.upper() == str(config['rubric'][course_id][group]['source']).upper())]
-
-                # Now we want to group by student and email, and sum up all assignments in this group
-                if len(assigns):
-                    assigns = assigns.groupby(by=['student', 'email', 'student_id']).\
-                            sum().reset_index()\
-                            [['student', 'Total Score', "Max Points", 'email', 'student_id']]
-                
-                if len(assigns):
-                    assigns['Max Points'] = assigns['Max Points'].apply(lambda x: adjust_max(x, config['rubric'][course_id][group]))
-
-                    # Cap the total points based on max + ec max
-                    assigns['Total Score'] = assigns.apply(lambda x: cap_points(x, config['rubric'][course_id][group]), axis=1)
-
-                    assigns = assigns.astype({'student_id': int})
-
-                    students = students.merge(assigns[['student_id', 'Total Score', 'Max Points']].rename(columns={'Total Score': group, 
-                                                                                                                   'Max Points': group + '_max', 
-                                                                                                                   'student_id': 'student_id_'}), 
-                                                                                                                   left_on='student_id', right_on='student_id_', 
-                                                                                                                   how='left').drop(columns=['student_id_'])
-                else:
-                    students[group] = None
-                    students[group + '_max'] = None
-
-                if len(students) > total:
-                    st.write("Error here, grew number of students")
-                    st.dataframe(assigns)
-                    total = len(students)
-
-                sums.append(group)
-                scales.append(config['rubric'][course_id][group]['points'])
-
-                group_name = group[0].upper() + group[1:]
-                if group_name[-1] >= '0' and group_name[-1] <= '9':
-                    group_name = group_name[0:-1] + ' ' + group_name[-1]
-
-                if 'source' in config['rubric'][course_id][group]:
-                    if len(assigns):
-                        assigns2 = assigns.drop(columns=['email'])
-                    else:
-                        assigns2 = assigns
-                    output("{} ({})".format(group_name, config['rubric'][course_id][group]["source"]), 'Total Score', 'Max Points', assigns2)
-                else:
-                    output(group_name, 'Total Score', 'Max Points', assigns.drop(columns=['email']))
-
-            # Look for optional file with additional fields
-            ss = 'more-fields-{}.xlsx'.format(course_id)
-            if "spreadsheet" in config['rubric'][course_id]:
-                ss = config['rubric'][course_id]['spreadsheet']
-
-            if path.isfile(ss):
+        if course_id in rubric:
+            course_rubric = rubric[course_id]
+            groups = [group for group in course_rubric if group != 'spreadsheet']
+            components, graded = grade_course(store, course, course_id, course_rubric)
+
+            for assigns in graded['errors']:
+                st.write("Error here, grew number of students")
+                st.dataframe(assigns)
+
+            # Each caller gets its own copy, since the cached frames are shared
+            for group in groups:
+                assigns = components[group]
+                if len(assigns) or 'source' not in course_rubric[group]:
+                    assigns = assigns.drop(columns=['email'])
+                output(group_title(group, course_rubric[group]), 'Total Score', 'Max Points', assigns.copy())
+
+            if graded['more_fields'] is not None:
                 st.markdown ("## Additional Fields from Excel")
-                more_fields = pd.read_excel('more-fields-{}.xlsx'.format(course_id)).drop(columns=['First Name', 'Last Name','Email'])
-                
-                students = students.merge(more_fields, left_on='student_id', right_on='SID', how='left').drop('SID', axis=1)
-                for field in more_fields.columns:
-                    if field != 'SID' and field != 'Comments':
-                        sums.append(field)
-                        if field != 'Adjustments':
-                            students[field + '_max'] = max(students[field])
-                            scales.append(max(students[field]))
-                        else:
-                            scales.append(0)
-                            students[field + '_max'] = 0
-                st.write('Adding {}'.format(more_fields.columns.to_list()))
-
-            # scale and sum the points
-            students['Total Points'] = students.apply(lambda x: sum_scaled(x, sums, [s + "_max" for s in sums], scales), axis=1)
-            students['Max Points'] = students.apply(lambda x: sum_scaled(x, [s + "_max" for s in sums], [s + "_max" for s in sums], scales), axis=1)
-            output('Total', 'Total Points', 'Max Points', students)
-
-            grading = {}
-            for col in students.columns:
-                if not '_max' in col and not 'course_id' in col and col != 'gs_user_id':
-                    grading[col] = students[col].values.tolist()
-
-            grading_df = pd.DataFrame(grading)
+                st.write('Adding {}'.format(graded['more_fields']))
+
+            output('Total', 'Total Points', 'Max Points', graded['students'].copy())
 
+            grading_df = graded['grading'].copy()
             output('Grading', 'Total Points', 'Max Points', grading_df)
 
             grading_dfs.append(grading_df)
 
     return grading_dfs
 
+def forget_rubric(changes: dict) -> None:
+    '''
+    Drops the cached components and totals that a rubric edit made stale
+    '''
+    def stale(key) -> bool:
+        if not isinstance(key, tuple):
+            return False
+        # The data service's encoded /grading bodies (see dataservice.respond)
+        if key[0] in ['json', 'arrow'] and key[1] == 'grading':
+            return bool(changes)
+        if key[0] not in ['rubric_component', 'rubric_course'] or key[3] not in changes:
+            return False
+        return key[0] == 'rubric_course' or key[4] in changes[key[3]]
+
+    for store in {id(store): store for store in [datastore.pinned(), datastore.current()] if store is not None}.values():
+        store.discard(stale)
+    course_cache.discard(stale)
+
+rubric_config = RubricConfig()
+rubric_config.on_change(forget_rubric)
+
+def get_page(frame: pd.DataFrame, sort_by = None, ascending: bool = True, search: str = None,
+             page: int = 1, page_size: int = 50, columns: list = None) -> tuple[pd.DataFrame, int, int]:
+    """
+    One page of the given columns of a (shared, read-only) frame, filtered to the rows where some
+    text column contains the search string, and sorted by a column (or list of columns).  Only
+    the page itself is copied.  Returns the page, the number of matching rows, and the page number
+    (clamped to the last page).
+    """
+    if columns is None:
+        columns = list(frame.columns)
+
+    positions = np.arange(len(frame))
+    if search:
+        matches = np.zeros(len(frame), dtype=bool)
+        for column in [column for column in columns if frame[column].dtype == object]:
+            matches |= frame[column].astype(str).str.contains(search, case=False, regex=False).to_numpy()
+        positions = positions[matches]
+
+    if sort_by:
+        by = [sort_by] if isinstance(sort_by, str) else list(sort_by)
+        keys = frame[by].iloc[positions].reset_index(drop=True)
+        try:
+            order = keys.sort_values(by=by, ascending=ascending, kind='mergesort', na_position='last').index
+        except TypeError:
+            # e.g., a column mixing text and numbers
+            order = keys.astype(str).sort_values(by=by, ascending=ascending, kind='mergesort').index
+        positions = positions[order.to_numpy()]
+
+    pages = max(1, -(-len(positions) // page_size))
+    page = min(max(1, page), pages)
+    return frame.iloc[positions[(page - 1) * page_size:page * page_size]][columns].copy(), len(positions), page
+
+@timed
 def get_course_student_status_summary(
         is_overdue, 
         is_near_due, 
-        is_submitted) -> pd.DataFrame:
-    """
-    Returns the number of total, submissions, overdue, and pending
+        is_submitted,
+        store = None) -> pd.DataFrame:
     """
+    Returns the number of total, submissions, overdue, and pending.
 
+    Computed once per data store snapshot (the refresher precomputes it off the request path)
+    """
+    if store is None:
+        store = get_store()
+    if isinstance(store, RemoteSnapshot):
+        return store.summary()
+
+    return store.derive(('course_student_status_summary', is_overdue, is_near_due, is_submitted),
+                        lambda: compute_course_student_status_summary(store.course_enrollments(), store.courses,
+                                                                      is_overdue, is_near_due, is_submitted)).copy()
+
+@timed
+def compute_course_student_status_summary(
+        enrollments: pd.DataFrame,
+        courses: pd.DataFrame,
+        is_overdue, 
+        is_near_due, 
+        is_submitted) -> pd.DataFrame:
     course_col = 'gs_course_id'
     # name = 'shortname'
     due_date = 'due'
     # student_id = 'sid'
 
-    enrollments = get_course_enrollments()
     # st.dataframe(enrollments.head(100))
 
-    useful = enrollments.rename(columns={'gs_course_id': 'gs_course_id_', 'canvas_course_id': 'canvas_course_id_'}).merge(get_courses().drop(columns=['shortname','name']),left_on='gs_course_id_', right_on='gs_course_id').rename(columns={'shortname':'Course'})
+    useful = enrollments.rename(columns={'gs_course_id': 'gs_course_id_', 'canvas_course_id': 'canvas_course_id_'}).merge(courses.drop(columns=['shortname','name']),left_on='gs_course_id_', right_on='gs_course_id').rename(columns={'shortname':'Course'})
 
-    useful['😰'] = useful.apply(lambda x: is_overdue(x, x['due']), axis=1)
-    useful['😅'] = useful.apply(lambda x: is_near_due(x, x['due']), axis=1)
-    useful['✓'] = useful.apply(lambda x: is_submitted(x), axis=1)
+    with timer('views.get_course_student_status_summary: status tests'):
+        useful['😰'] = useful.apply(lambda x: is_overdue(x, x['due']), axis=1)
+        useful['😅'] = useful.apply(lambda x: is_near_due(x, x['due']), axis=1)
+        useful['✓'] = useful.apply(lambda x: is_submitted(x), axis=1)
 
     ids_to_short = enrollments[['gs_course_id','course_name']].drop_duplicates().rename(columns={'course_name':'Course'}).set_index('gs_course_id')
 
     return useful[[course_col,'😰','😅','✓']].groupby(course_col).sum().join(ids_to_short)[['Course','😰','😅','✓']]
 
+def status_flags(submissions: pd.DataFrame, due) -> dict:
+    """
+    Which of an assignment's submissions are overdue, nearly due and submitted
+    """
+    return {'overdue': submissions.apply(lambda x: is_overdue(x, due), axis=1).to_numpy(dtype=bool),
+            'near_due': submissions.apply(lambda x: is_near_due(x, due), axis=1).to_numpy(dtype=bool),
+            'submitted': submissions.apply(lambda x: is_submitted(x), axis=1).to_numpy(dtype=bool)}
+
+@timed
+def compute_course_view(store, canvas_course_id: int) -> dict:
+    """
+    The parts of a course page that don't depend on the rubric: each student's total score, and
+    the submissions of each past-due assignment (in order of deadline) with their status flags
+    """
+    scores = store.course_submissions(canvas_course_id=canvas_course_id)
+    totals = scores.groupby(by=['email', 'student'])['Total Score'].sum().reset_index().sort_values(by=['Total Score'])
+
+    assignments = []
+    rows = scores.groupby('gs_assignment_id', sort=False).indices
+    for _, assign in scores[['gs_assignment_id', 'name', 'due']].drop_duplicates().iterrows():
+        if assign['gs_assignment_id'] not in rows:
+            continue
+        submissions = scores.iloc[rows[assign['gs_assignment_id']]]
+        due = submissions['due'].iloc[0]
+        # Skip homework if it's not yet due!
+        if now < due:
+            continue
+        assignments.append(dict(status_flags(submissions, due), assign=assign, due=due, submissions=submissions))
+
+    return {'totals': totals, 'assignments': assignments}
+
+def snapshot_key(store) -> tuple:
+    return (store.version, tuple(getattr(store, 'terms', None) or ()))
+
+def get_course_view(canvas_course_id: int, store = None) -> dict:
+    """
+    The course view (see compute_course_view), from the prefetch cache if it is there.  The
+    frames are shared, so callers must not modify them.
+    """
+    if store is None:
+        store = get_store()
+    return prefetcher.get(('course_view', snapshot_key(store), canvas_course_id),
+                          lambda: compute_course_view(store, canvas_course_id))
+
+def prefetch_course(store, course: pd.Series) -> dict:
+    """
+    Computes everything a course page shows: the rubric scores of the course and its course
+    view (returned), all kept in the size-bounded course cache
+    """
+    rubric = rubric_config.get()
+    courses = store.courses
+    for _, row in courses[courses['gs_course_id'] == course['gs_course_id']].drop_duplicates().iterrows():
+        if not pd.isna(row['canvas_course_id']) and int(row['canvas_course_id']) in rubric:
+            grade_course(store, row, int(row['canvas_course_id']), rubric[int(row['canvas_course_id'])])
+    return compute_course_view(store, int(course['canvas_course_id']))
+
+def prefetch_courses(selected: str, shortnames: list, store = None) -> None:
+    """
+    Once the selected course has rendered, queues the other courses in the selector (those
+    next to it first) to be computed in the background
+    """
+    if not prefetch_config.get('enabled', True):
+        return
+    if store is None:
+        store = get_store()
+
+    courses = store.courses.dropna(subset=['canvas_course_id']).drop_duplicates(subset=['shortname'])
+    courses = courses.set_index('shortname', drop=False)
+    prefetcher.prefetch([(('course_view', snapshot_key(store), int(course['canvas_course_id'])),
+                          lambda course=course: prefetch_course(store, course))
+                         for course in (courses.loc[name] for name in nearest_first(shortnames, selected) if name in courses.index)])
+
+## Lateness histogram bins, in hours after the student's deadline
+LATENESS_BINS = [0, 1, 6, 24, 72, np.inf]
+LATENESS_LABELS = ['< 1h', '1-6h', '6-24h', '1-3d', '> 3d']
+LATENESS_PERCENTILES = [0.5, 0.9, 0.99]
+
+@timed
+def compute_lateness_distribution(submissions: pd.DataFrame) -> dict:
+    """
+    How late the submitted work was: per assignment and per course, the number of submissions,
+    how many were late, a histogram of the hours late and percentiles of the late ones; and,
+    per course, the students who were late more than once
+    """
+    submitted = submissions[submissions['Status'] != 'Missing']
+    course = ['canvas_course_id', 'course_name']
+    keys = course + ['name']
+
+    hours = submitted['hours_late'].where(submitted['late'].astype(bool))
+    bins = pd.get_dummies(pd.cut(hours, LATENESS_BINS, labels=LATENESS_LABELS, include_lowest=True)).astype('int64')
+    counts = pd.concat([submitted[keys + ['due']], hours.rename('hours'), bins.assign(Late=bins.sum(axis=1))], axis=1)
+
+    with timer('views.compute_lateness_distribution: group'):
+        grouped = counts.groupby(keys, sort=False, dropna=False)
+        by_assignment = grouped[['Late'] + LATENESS_LABELS].sum()
+        by_assignment.insert(0, 'Submitted', grouped.size())
+        by_assignment.insert(0, 'due', grouped['due'].max())
+        percentiles = grouped['hours'].quantile(LATENESS_PERCENTILES).unstack()
+
+    def finish(frame: pd.DataFrame, percentiles: pd.DataFrame) -> pd.DataFrame:
+        frame['Late %'] = (100 * frame['Late'] / frame['Submitted']).round(1)
+        percentiles.columns = ['p{:g} (h)'.format(100 * q) for q in LATENESS_PERCENTILES]
+        return frame.join(percentiles.round(1)).reset_index()
+
+    # Counts add up per course; percentiles have to be taken over the course's late submissions
+    by_course = by_assignment.drop(columns=['due']).groupby(course, sort=False, dropna=False).sum()
+    by_course.insert(0, 'Assignments', by_assignment.groupby(course, sort=False, dropna=False).size())
+    course_percentiles = counts.groupby(course, sort=False, dropna=False)['hours'].quantile(LATENESS_PERCENTILES).unstack()
+
+    late = counts.dropna(subset=['hours']).join(submitted[['student', 'email']])
+    students = late.groupby(course + ['student', 'email'], sort=False, dropna=False).agg(
+        Late=('hours', 'size'), **{'Total (h)': ('hours', 'sum'), 'Max (h)': ('hours', 'max')})
+    students = students[students['Late'] > 1].round(1).reset_index().sort_values(['canvas_course_id', 'Late'], ascending=[True, False])
+
+    return {'assignments': finish(by_assignment, percentiles).sort_values(['canvas_course_id', 'due', 'name']),
+            'courses': finish(by_course, course_percentiles),
+            'students': students}
+
+def get_lateness_distribution(canvas_course_id = None, store = None) -> dict:
+    """
+    The lateness distribution (see compute_lateness_distribution), computed once per data store
+    snapshot, optionally for a single course
+    """
+    if store is None:
+        store = get_store()
+    distribution = store.derive(('lateness_distribution',), lambda: compute_lateness_distribution(store.submissions))
+    if canvas_course_id is None:
+        return {name: frame.copy() for name, frame in distribution.items()}
+    return {name: frame[frame['canvas_course_id'] == canvas_course_id].copy() for name, frame in distribution.items()}
+
+def get_changes_since_last_crawl(course: str = None, store = None) -> pd.DataFrame:
+    """
+    The submissions and extensions that the latest crawl inserted, updated or deleted, optionally
+    for one course
+    """
+    if store is None:
+        store = get_store()
+    if isinstance(store, RemoteSnapshot):
+        return store.changes(course=course)
+    return get_changes(course=course, filename=state_path(store.terms))
+
+def get_student_index(store = None) -> StudentIndex:
+    """
+    The index of the students in the enrollments, built once per data store snapshot
+    """
+    if store is None:
+        store = get_store()
+    return store.derive(('student_index',), lambda: StudentIndex(store.enrollments))
+
+@timed
+def get_student_drilldown(query: str, store = None) -> pd.DataFrame:
+    """
+    Every submission, in every course, of the students whose email, SIS ID or name matches
+    the query (or starts with it), flagged like the course status tables.  Only the matching
+    rows are read.
+    """
+    if store is None:
+        store = get_store()
+    rows = store.enrollments.iloc[get_student_index(store).find(query)]
+
+    columns = ['student', 'email', 'student_id', 'term', 'course_name', 'name', 'due', 'Status', 'Total Score', 'Max Points', 'late']
+    drilldown = rows[[column for column in columns if column in rows.columns]].copy()
+    drilldown['😰'] = [is_overdue(x, x['due']) for _, x in rows.iterrows()]
+    drilldown['😅'] = [is_near_due(x, x['due']) for _, x in rows.iterrows()]
+    drilldown['✓'] = [is_submitted(x) for _, x in rows.iterrows()]
+    return drilldown.sort_values(['student', 'course_name', 'due'], kind='mergesort')
+
+def get_student_rollup(drilldown: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per student, across all of their courses: how many assignments are missing, overdue,
+    nearly due and late
+    """
+    flags = drilldown.assign(Missing=drilldown['Status'] == 'Missing', Late=drilldown['late'].fillna(0).astype(bool))
+    return flags.groupby(['student_id', 'student', 'email'], dropna=False).agg(
+        Courses=('course_name', 'nunique'), Assignments=('name', 'count'), Missing=('Missing', 'sum'),
+        Late=('Late', 'sum'), **{'😰': ('😰', 'sum'), '😅': ('😅', 'sum')}).reset_index()
+
+def warm_store(store) -> None:
+    """
+    Precomputes the sidebar summary, the student index and the lateness distribution for a
+    freshly built store, before it is swapped in
+    """
+    get_course_student_status_summary(is_overdue, is_near_due, is_submitted, store)
+    get_student_index(store)
+    get_lateness_distribution(store=store)